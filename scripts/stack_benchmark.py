@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how fast stack_core classifies the lines of a logcat.
+
+Compares TraceConverter.MatchHeaderLines with searching every header regex
+on every line, and times ProcessLine over the whole input. Without a FILE, a
+synthetic logcat with crashes from example_crashes.py is generated.
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import time
+
+import example_crashes
+import stack_core
+import symbol
+
+LOGCAT_MESSAGES = (
+    "Start proc %d:com.example.app/u0a%d for service %d",
+    "Displayed com.example/.MainActivity: +%dms (%d) %d",
+    "Background concurrent copying GC freed %d(%dKB) AllocSpace objects, %d",
+    "uid=%d(u0_a%d) com.example identical %d lines",
+    "    at com.example.Foo.bar(Foo.java:%d) %d %d",
+    "Fatal signal %d (SIGSEGV), code 1 (SEGV_MAPERR), fault addr 0x%x in tid %d",
+)
+LOGCAT_TAGS = ("ActivityManager", "PackageManager", "WindowManager", "chatty",
+               "Zygote", "AudioFlinger", "SurfaceFlinger", "DEBUG")
+
+def GenerateLogcat(size):
+  """Returns about size bytes of logcat lines with a crash every ~1000 lines."""
+  rand = random.Random(0)
+  crash = example_crashes.arm64.strip().split("\n")
+  lines = []
+  total = 0
+  while total < size:
+    if rand.random() < 0.001:
+      for line in crash:
+        lines.append("10-17 12:34:56.789  1234  1234 F DEBUG   : %s\n" % line)
+        total += len(lines[-1])
+    message = rand.choice(LOGCAT_MESSAGES) % (
+        rand.randint(1, 9999), rand.randint(1, 9999), rand.randint(1, 9999))
+    lines.append("10-17 12:34:56.789  %5d  %5d %s %s: %s\n" % (
+        rand.randint(1, 30000), rand.randint(1, 30000), rand.choice("VDIWEF"),
+        rand.choice(LOGCAT_TAGS), message))
+    total += len(lines[-1])
+  return lines
+
+def MatchAllHeaderLines(tc, line):
+  """Searches every header regex, as ProcessLine used to."""
+  headers = []
+  for name, _ in tc.header_lines:
+    match = getattr(tc, name).search(line)
+    if match:
+      headers.append(match.group(1))
+  return headers
+
+def Time(func, lines):
+  start = time.perf_counter()
+  result = [func(line) for line in lines]
+  return time.perf_counter() - start, result
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("file", metavar="FILE", nargs="?", help="a logcat dump")
+  parser.add_argument("--size", type=int, default=100,
+                      help="size of the synthetic logcat in MB (default: 100)")
+  parser.add_argument("--arch", default="arm64", help="the target architecture")
+  args = parser.parse_args()
+
+  symbol.ARCH_IS_32BIT = not "64" in args.arch
+  if args.file:
+    with open(args.file, "r", errors="ignore") as f:
+      lines = f.readlines()
+  else:
+    lines = GenerateLogcat(args.size * 1000000)
+  print("lines: %d, bytes: %d" % (len(lines), sum(len(line) for line in lines)))
+
+  tc = stack_core.TraceConverter()
+  tc.UpdateBitnessRegexes()
+  lines = [tc.CleanLine(line) for line in lines]
+
+  all_time, expected = Time(lambda line: MatchAllHeaderLines(tc, line), lines)
+  fast_time, actual = Time(tc.MatchHeaderLines, lines)
+  if actual != expected:
+    raise SystemExit("error: MatchHeaderLines disagrees with the header regexes")
+  print("all header regexes: %.2fs" % all_time)
+  print("MatchHeaderLines:   %.2fs (%.1fx)" % (fast_time, all_time / fast_time))
+
+  with contextlib.redirect_stdout(io.StringIO()):
+    process_time, _ = Time(tc.ProcessLine, lines)
+  print("ProcessLine:        %.2fs (%.1f MB/s)" % (
+      process_time, sum(len(line) for line in lines) / process_time / 1e6))
+
+if __name__ == "__main__":
+  main()
@@ -16,15 +16,22 @@
 
 """stack symbolizes native crash dumps."""
 
+import bisect
 import collections
+import contextlib
 import functools
+import io
+import json
+import mmap
 import os
-import pathlib
 import re
-import subprocess
+import shutil
+import struct
+import sys
 import symbol
 import tempfile
 import unittest
+import zipfile
 
 import example_crashes
 
@@ -33,6 +40,94 @@ def ConvertTrace(lines):
   print("Reading symbols from", symbol.SYMBOLS_DIR)
   tracer.ConvertTrace(lines)
 
+# The first line of a tombstone.
+TOMBSTONE_START = "*** *** *** *** *** *** *** *** *** *** *** *** *** *** *** ***"
+
+def SplitTombstones(lines):
+  """Split a stream with several tombstones at their start lines."""
+  tombstones = []
+  current = []
+  seen_start = False
+  for line in lines:
+    if TOMBSTONE_START in line:
+      # Any lines before the first start line belong to the first tombstone.
+      if seen_start:
+        tombstones.append(current)
+        current = []
+      seen_start = True
+    current.append(line)
+  if current:
+    tombstones.append(current)
+  return tombstones
+
+def ConvertTraces(tombstones, output_dir=None, json_file=None):
+  """Symbolize several tombstones with one shared symbolization pass.
+
+  The addresses of all tombstones are collected first, deduplicated and
+  symbolized with one batch per library. Each tombstone is then rendered from
+  the shared results.
+
+  Args:
+    tombstones: list of (name, lines) pairs
+    output_dir: if set, the output of each tombstone is written to output_dir/name
+    json_file: if set, a JSON line is written for each tombstone instead
+
+  Otherwise the outputs are printed one after another.
+  """
+  fixed_bitness = symbol.ARCH_IS_32BIT
+  tracer = TraceConverter()
+  inputs = []
+  try:
+    # Keep stdout clean for the outputs, warnings go to stderr.
+    with contextlib.redirect_stdout(sys.stderr):
+      print("Reading symbols from", symbol.SYMBOLS_DIR)
+      lib_to_addrs = collections.defaultdict(set)
+      for name, lines in tombstones:
+        lines = [tracer.CleanLine(line) for line in lines]
+        if fixed_bitness is None:
+          symbol.SetBitness(lines)
+        inputs.append((name, lines, symbol.ARCH_IS_32BIT))
+        tracer.UpdateBitnessRegexes()
+        tracer.CollectSymbolAddrs(lines, lib_to_addrs)
+      symbol.SymbolInformationForSets(lib_to_addrs)
+
+    for name, lines, is_32bit in inputs:
+      symbol.ARCH_IS_32BIT = is_32bit
+      tc = TraceConverter()
+      output = io.StringIO()
+      error = None
+      try:
+        with contextlib.redirect_stdout(output):
+          tc.UpdateBitnessRegexes()
+          for line in lines:
+            tc.ProcessLine(line)
+          tc.PrintOutput(tc.trace_lines, tc.value_lines)
+      except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+        print("ERROR: %s: %s" % (name, error), file=sys.stderr)
+      symbol.FlushDemangledSymbols()
+
+      if json_file:
+        record = {"name": name,
+                  "output": output.getvalue(),
+                  "stacks": [{"trace": trace_lines, "values": value_lines}
+                             for trace_lines, value_lines in tc.printed_blocks]}
+        if error:
+          record["error"] = error
+        json_file.write(json.dumps(record) + "\n")
+      elif output_dir:
+        path = os.path.join(output_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+          f.write(output.getvalue())
+      else:
+        print("\n==> %s <==" % name)
+        sys.stdout.write(output.getvalue())
+  finally:
+    symbol.ARCH_IS_32BIT = fixed_bitness
+    # Delete any temporary files created while processing the lines.
+    tracer.DeleteApkTmpFiles()
+
 class TraceConverter:
   process_info_line = re.compile(r"(pid: [0-9]+, tid: [0-9]+.*)")
   revision_line = re.compile(r"(Revision: '(.*)')")
@@ -46,27 +141,42 @@ class TraceConverter:
   sanitizer_trace_line = re.compile("$a")
   value_line = re.compile("$a")
   code_line = re.compile("$a")
-  zipinfo_central_directory_line = re.compile(r"Central\s+directory\s+entry")
-  zipinfo_central_info_match = re.compile(
-      r"^\s*(\S+)$\s*offset of local header from start of archive:\s*(\d+)"
-      r".*^\s*compressed size:\s+(\d+)", re.M | re.S)
   unreachable_line = re.compile(r"((\d+ bytes in \d+ unreachable allocations)|"
                                 r"(\d+ bytes unreachable at [0-9a-f]+)|"
                                 r"(referencing \d+ unreachable bytes in \d+ allocation(s)?)|"
                                 r"(and \d+ similar unreachable bytes in \d+ allocation(s)?))")
-  trace_lines = []
-  value_lines = []
+  # The header regexes in the order in which their matches are printed, each
+  # with a substring that every line it matches contains. Checking for the
+  # substrings is much cheaper than running the regexes, and most lines of a
+  # logcat contain none of them.
+  header_lines = (
+      ("process_info_line", "pid: "),
+      ("signal_line", "signal "),
+      ("abort_message_line", "Abort message: '"),
+      ("register_line", "    "),
+      ("thread_line", "--- " * 15 + "---"),
+      ("dalvik_jni_thread_line", "\" prio="),
+      ("dalvik_native_thread_line", "\" sysTid="),
+      ("revision_line", "Revision: '"),
+      ("unreachable_line", "unreachable "),
+  )
+  hex_digits = frozenset("0123456789abcdef")
   last_frame = -1
   width = "{8}"
   spacing = ""
+  # {apk: [apk_full_path, entries, entry starts, {name: (lib, is_tmp_file)}]}
   apk_info = dict()
+  # An entry of an APK. start is the offset of the local header, data_offset
+  # the offset of the (compressed) data which ends at end.
+  ApkEntry = collections.namedtuple(
+      "ApkEntry", ["name", "start", "end", "data_offset", "size", "stored"])
   lib_to_path = dict()
 
-  # We use the "file" command line tool to extract BuildId from ELF files.
-  ElfInfo = collections.namedtuple("ElfInfo", ["bitness", "build_id"])
-  readelf_output = re.compile(r"Class:\s*ELF(?P<bitness>32|64).*"
-                              r"Build ID:\s*(?P<build_id>[0-9a-f]+)",
-                              flags=re.DOTALL)
+  def __init__(self):
+    self.trace_lines = []
+    self.value_lines = []
+    # The (trace_lines, value_lines) of each printed stack.
+    self.printed_blocks = []
 
   def UpdateBitnessRegexes(self):
     if symbol.ARCH_IS_32BIT:
@@ -120,6 +230,10 @@ class TraceConverter:
     #   03-25 00:51:05.530 I/DEBUG ( 65): bea4170c 8018e4e9 /data/data/com.my.project/lib/libmyproject.so
     # Again, note the spacing differences.
     self.value_line = re.compile(r"(.*)([0-9a-f]" + self.width + r")[ \t]+([0-9a-f]" + self.width + r")[ \t]+([^\r\n \t]*)( \((.*)\))?")
+    # Both value lines and code lines contain two hex words. The value_line and
+    # code_line regexes backtrack from the end of the line, searching for this
+    # first rules out most other lines much faster.
+    self.value_hint = re.compile(r"[a-f0-9]" + self.width + r"[ \t]*[a-f0-9]" + self.width)
     # Lines from 'code around' sections of the output will be matched before
     # value lines because otheriwse the 'code around' sections will be confused as
     # value lines.
@@ -158,6 +272,8 @@ class TraceConverter:
       print("  %8s  %8s  %s  %s" % (addr, value, symbol_with_offset.ljust(maxlen), location))
 
   def PrintOutput(self, trace_lines, value_lines):
+    if self.trace_lines or self.value_lines:
+      self.printed_blocks.append((self.trace_lines, self.value_lines))
     if self.trace_lines:
       self.PrintTraceLines(self.trace_lines)
     if self.value_lines:
@@ -167,9 +283,11 @@ class TraceConverter:
     print("\n-----------------------------------------------------\n")
 
   def DeleteApkTmpFiles(self):
-    for _, _, tmp_files in self.apk_info.values():
-      for tmp_file in tmp_files.values():
-        os.unlink(tmp_file)
+    for _, _, _, libs in self.apk_info.values():
+      for name, (lib, is_tmp_file) in list(libs.items()):
+        if is_tmp_file:
+          os.unlink(lib)
+          del libs[name]
 
   def ConvertTrace(self, lines):
     lines = [self.CleanLine(line) for line in lines]
@@ -177,14 +295,19 @@ class TraceConverter:
       if symbol.ARCH_IS_32BIT is None:
         symbol.SetBitness(lines)
       self.UpdateBitnessRegexes()
+      self.PrefetchSymbols(lines)
       for line in lines:
         self.ProcessLine(line)
       self.PrintOutput(self.trace_lines, self.value_lines)
     finally:
+      symbol.FlushDemangledSymbols()
       # Delete any temporary files created while processing the lines.
       self.DeleteApkTmpFiles()
 
   def MatchTraceLine(self, line):
+    # Both kinds of trace lines have a frame number.
+    if "#" not in line:
+      return None
     match = self.trace_line.match(line)
     if match:
       return {"frame": match.group("frame"),
@@ -207,128 +330,110 @@ class TraceConverter:
 
   def ExtractLibFromApk(self, apk, shared_lib_name):
     # Create a temporary file containing the shared library from the apk.
-    tmp_file = None
+    tmp_fd, tmp_file = tempfile.mkstemp()
     try:
-      tmp_fd, tmp_file = tempfile.mkstemp()
-      if subprocess.call(["unzip", "-p", apk, shared_lib_name], stdout=tmp_fd) == 0:
-        os.close(tmp_fd)
-        shared_file = tmp_file
-        tmp_file = None
-        return shared_file
-    finally:
-      if tmp_file:
-        os.close(tmp_fd)
-        os.unlink(tmp_file)
+      with os.fdopen(tmp_fd, "wb") as tmp, zipfile.ZipFile(apk) as zf, \
+          zf.open(shared_lib_name) as lib:
+        shutil.copyfileobj(lib, tmp)
+      return tmp_file
+    except (OSError, KeyError, zipfile.BadZipFile, zipfile.LargeZipFile):
+      os.unlink(tmp_file)
     return None
 
-  def ProcessCentralInfo(self, offset_list, central_info):
-    match = self.zipinfo_central_info_match.search(central_info)
-    if not match:
-      raise Exception("Cannot find all info from zipinfo\n" + central_info)
-    name = match.group(1)
-    start = int(match.group(2))
-    end = start + int(match.group(3))
-
-    offset_list.append([name, start, end])
-    return name, start, end
+  def ReadApkEntries(self, apk_full_path):
+    """Return the ApkEntry list of an APK sorted by offset.
+
+    The central directory is read with zipfile. The offsets of the data are
+    read from the local headers, whose extra fields may differ from the ones
+    in the central directory (e.g. alignment padding). The result is kept in
+    the persistent symbol cache keyed by the path, mtime and size of the APK.
+    """
+    st = os.stat(apk_full_path)
+    key = "%s:%d:%d" % (os.path.abspath(apk_full_path), st.st_mtime_ns, st.st_size)
+    cached = symbol.GetCachedValue("apk-entries", key)
+    if cached is not None:
+      return [self.ApkEntry(*entry) for entry in cached]
+
+    entries = []
+    with open(apk_full_path, "rb") as f, zipfile.ZipFile(f) as zf:
+      for info in zf.infolist():
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", f.read(4))
+        data_offset = info.header_offset + 30 + name_length + extra_length
+        entries.append(self.ApkEntry(info.filename, info.header_offset,
+                                     data_offset + info.compress_size, data_offset,
+                                     info.file_size, info.compress_type == zipfile.ZIP_STORED))
+    # The zip file does not guarantee that the entries are in order.
+    entries.sort(key=lambda entry: entry.start)
+    symbol.PutCachedValue("apk-entries", key, [list(entry) for entry in entries])
+    return entries
+
+  def FindApkLibInSymbols(self, apk_full_path, entry):
+    """Return the path of the unstripped copy of a library in an APK, or None.
+
+    A library that is stored uncompressed and page-aligned is mapped directly
+    from the APK on the device. Its build-id can be read in place and looked
+    up in the symbols directory without extracting the library.
+    """
+    if not entry.stored or entry.data_offset % mmap.ALLOCATIONGRANULARITY:
+      return None
+    try:
+      with symbol.ElfFile(apk_full_path, entry.data_offset, entry.size) as elf:
+        build_id = elf.GetBuildId()
+    except (OSError, symbol.ElfError):
+      return None
+    if not build_id:
+      return None
+    return self.GetLibraryByBuildId(symbol.SYMBOLS_DIR, os.path.basename(entry.name), build_id)
 
   def GetLibFromApk(self, apk, offset):
     # Convert the string to hex.
     offset = int(offset, 16)
 
-    # Check if we already have information about this offset.
-    if apk in self.apk_info:
-      apk_full_path, offset_list, tmp_files = self.apk_info[apk]
-      for file_name, start, end in offset_list:
-        if offset >= start and offset < end:
-          if file_name in tmp_files:
-            return file_name, tmp_files[file_name]
-          tmp_file = self.ExtractLibFromApk(apk_full_path, file_name)
-          if tmp_file:
-            tmp_files[file_name] = tmp_file
-            return file_name, tmp_file
-          break
-      return None, None
-
-    if not "ANDROID_PRODUCT_OUT" in os.environ:
-      print("ANDROID_PRODUCT_OUT environment variable not set.")
-      return None, None
-    out_dir = os.environ["ANDROID_PRODUCT_OUT"]
-    if not os.path.exists(out_dir):
-      print("ANDROID_PRODUCT_OUT", out_dir, "does not exist.")
-      return None, None
-    if apk.startswith("/"):
-      apk_full_path = out_dir + apk
-    else:
-      apk_full_path = os.path.join(out_dir, apk)
-    if not os.path.exists(apk_full_path):
-      print("Cannot find apk", apk)
-      return None, None
-
-    cmd = subprocess.Popen(["zipinfo", "-v", apk_full_path], stdout=subprocess.PIPE,
-                           encoding='utf8')
-    # Find the first central info marker.
-    for line in cmd.stdout:
-      if self.zipinfo_central_directory_line.search(line):
-        break
-
-    central_info = ""
-    file_name = None
-    offset_list = []
-    for line in cmd.stdout:
-      match = self.zipinfo_central_directory_line.search(line)
-      if match:
-        cur_name, start, end = self.ProcessCentralInfo(offset_list, central_info)
-        if not file_name and offset >= start and offset < end:
-          file_name = cur_name
-        central_info = ""
+    if apk not in self.apk_info:
+      if not "ANDROID_PRODUCT_OUT" in os.environ:
+        print("ANDROID_PRODUCT_OUT environment variable not set.")
+        return None, None
+      out_dir = os.environ["ANDROID_PRODUCT_OUT"]
+      if not os.path.exists(out_dir):
+        print("ANDROID_PRODUCT_OUT", out_dir, "does not exist.")
+        return None, None
+      if apk.startswith("/"):
+        apk_full_path = out_dir + apk
       else:
-        central_info += line
-    if central_info:
-      cur_name, start, end = self.ProcessCentralInfo(offset_list, central_info)
-      if not file_name and offset >= start and offset < end:
-        file_name = cur_name
-
-    # Make sure the offset_list is sorted, the zip file does not guarantee
-    # that the entries are in order.
-    offset_list = sorted(offset_list, key=lambda entry: entry[1])
-
-    # Save the information from the zip.
-    tmp_files = dict()
-    self.apk_info[apk] = [apk_full_path, offset_list, tmp_files]
-    if not file_name:
+        apk_full_path = os.path.join(out_dir, apk)
+      if not os.path.exists(apk_full_path):
+        print("Cannot find apk", apk)
+        return None, None
+      try:
+        entries = self.ReadApkEntries(apk_full_path)
+      except (OSError, zipfile.BadZipFile, struct.error) as e:
+        print("Cannot read apk", apk, e)
+        entries = []
+      self.apk_info[apk] = [apk_full_path, entries, [entry.start for entry in entries], {}]
+
+    apk_full_path, entries, starts, libs = self.apk_info[apk]
+    index = bisect.bisect_right(starts, offset) - 1
+    if index < 0 or offset >= entries[index].end:
       return None, None
-    tmp_shared_lib = self.ExtractLibFromApk(apk_full_path, file_name)
-    if tmp_shared_lib:
-      tmp_files[file_name] = tmp_shared_lib
-      return file_name, tmp_shared_lib
-    return None, None
-
-  # Find all files in the symbols directory and group them by basename (without directory).
-  @functools.lru_cache(maxsize=None)
-  def GlobSymbolsDir(self, symbols_dir):
-    files_by_basename = {}
-    for path in sorted(pathlib.Path(symbols_dir).glob("**/*")):
-      if os.path.isfile(path):
-        files_by_basename.setdefault(path.name, []).append(path)
-    return files_by_basename
-
-  # Use the "file" command line tool to find the bitness and build_id of given ELF file.
-  @functools.lru_cache(maxsize=None)
-  def GetLibraryInfo(self, lib):
-    stdout = subprocess.check_output([symbol.ToolPath("llvm-readelf"), "-h", "-n", lib], text=True)
-    match = self.readelf_output.search(stdout)
-    if match:
-      return self.ElfInfo(bitness=match.group("bitness"), build_id=match.group("build_id"))
-    return None
+    entry = entries[index]
+    if entry.name not in libs:
+      lib = self.FindApkLibInSymbols(apk_full_path, entry)
+      if lib:
+        libs[entry.name] = (lib, False)
+      else:
+        tmp_file = self.ExtractLibFromApk(apk_full_path, entry.name)
+        if not tmp_file:
+          return None, None
+        libs[entry.name] = (tmp_file, True)
+    return entry.name, libs[entry.name][0]
 
   # Search for a library with the given basename and build_id anywhere in the symbols directory.
   @functools.lru_cache(maxsize=None)
   def GetLibraryByBuildId(self, symbols_dir, basename, build_id):
-    for candidate in self.GlobSymbolsDir(symbols_dir).get(basename, []):
-      info = self.GetLibraryInfo(candidate)
-      if info and info.build_id == build_id:
-        return "/" + str(candidate.relative_to(symbols_dir))
+    for candidate in symbol.GetBuildIdIndex(symbols_dir).Lookup(build_id):
+      if os.path.basename(candidate) == basename:
+        return "/" + candidate
     return None
 
   def GetLibPath(self, lib):
@@ -400,45 +505,125 @@ class TraceConverter:
     return lib
 
 
+  def GetTraceLib(self, area, so_offset, build_id, warn=True):
+    """Find the library to symbolize a trace line with.
+
+    Returns a tuple of the area (with any "!suffix" after a .so removed), the
+    library path (or None) and the name of the library inside an apk (or None).
+    """
+    # If this is an apk, it usually means that there is actually
+    # a shared so that was loaded directly out of it. In that case,
+    # extract the shared library and the name of the shared library.
+    lib = None
+    # The format of the map name:
+    #   Some.apk!libshared.so
+    # or
+    #   Some.apk
+    if so_offset:
+      # If it ends in apk, we are done.
+      apk = None
+      if area.endswith(".apk"):
+        apk = area
+      else:
+        index = area.rfind(".so!")
+        if index != -1:
+          # Sometimes we'll see something like:
+          #   #01 pc abcd  libart.so!libart.so (offset 0x134000)
+          # Remove everything after the ! and zero the offset value.
+          area = area[0:index + 3]
+          so_offset = 0
+        else:
+          index = area.rfind(".apk!")
+          if index != -1:
+            apk = area[0:index + 4]
+      if apk:
+        lib_name, lib = self.GetLibFromApk(apk, so_offset)
+    else:
+      # Sometimes we'll see something like:
+      #   #01 pc abcd  libart.so!libart.so
+      # Remove everything after the !.
+      index = area.rfind(".so!")
+      if index != -1:
+        area = area[0:index + 3]
+    if not lib:
+      lib = area
+      lib_name = None
+
+    if build_id:
+      # If we have the build_id, look it up in the build-id index of the symbols directory.
+      basename = os.path.basename(lib).split("!")[-1]
+      lib = self.GetLibraryByBuildId(symbol.SYMBOLS_DIR, basename, build_id)
+      if not lib and warn:
+        print("WARNING: Cannot find {} with build id {} in symbols directory."
+              .format(basename, build_id))
+    else:
+      # When using atest, test paths are different between the out/ directory
+      # and device. Apply fixups.
+      lib = self.GetLibPath(lib)
+    return area, lib, lib_name
+
+  def PrefetchSymbols(self, lines):
+    """Symbolize the addresses of all trace and value lines up front.
+
+    All addresses of a library are sent to the symbolizer in one batch and
+    several libraries are symbolized in parallel. ProcessLine then finds the
+    results in the symbol caches.
+    """
+    lib_to_addrs = collections.defaultdict(set)
+    self.CollectSymbolAddrs(lines, lib_to_addrs)
+    symbol.SymbolInformationForSets(lib_to_addrs)
+
+  def CollectSymbolAddrs(self, lines, lib_to_addrs):
+    """Add the addresses of the trace and value lines to {lib: set of addresses}."""
+    for line in lines:
+      trace_line_dict = self.MatchTraceLine(line)
+      if trace_line_dict is not None:
+        area = trace_line_dict["dso"]
+        if area == "<unknown>" or area == "[heap]" or area == "[stack]":
+          continue
+        _, lib, _ = self.GetTraceLib(area, trace_line_dict["so_offset"],
+                                     trace_line_dict["build_id"], warn=False)
+        if lib:
+          lib_to_addrs[lib].add(trace_line_dict["offset"])
+        continue
+      if not self.MayBeValueLine(line) or self.code_line.match(line):
+        continue
+      match = self.value_line.match(line)
+      if match:
+        (unused_, addr, value, area, symbol_present, symbol_name) = match.groups()
+        if area and area != "<unknown>" and area != "[heap]" and area != "[stack]":
+          lib_to_addrs[area].add(value)
+
+  def MatchHeaderLines(self, line):
+    """Returns the text to print for each header regex that matches line."""
+    headers = []
+    for name, keyword in self.header_lines:
+      if keyword not in line:
+        continue
+      # Register lines end with a register value.
+      if name == "register_line" and line.rstrip("\n")[-1:] not in self.hex_digits:
+        continue
+      match = getattr(self, name).search(line)
+      if match:
+        headers.append(match.group(1))
+    return headers
+
+  def MayBeValueLine(self, line):
+    """Returns False if line can match neither code_line nor value_line."""
+    return self.value_hint.search(line) is not None
+
   def ProcessLine(self, line):
     ret = False
-    process_header = self.process_info_line.search(line)
-    signal_header = self.signal_line.search(line)
-    abort_message_header = self.abort_message_line.search(line)
-    thread_header = self.thread_line.search(line)
-    register_header = self.register_line.search(line)
-    revision_header = self.revision_line.search(line)
-    dalvik_jni_thread_header = self.dalvik_jni_thread_line.search(line)
-    dalvik_native_thread_header = self.dalvik_native_thread_line.search(line)
-    unreachable_header = self.unreachable_line.search(line)
-    if process_header or signal_header or abort_message_header or thread_header or \
-        register_header or dalvik_jni_thread_header or dalvik_native_thread_header or \
-        revision_header or unreachable_header:
-      ret = True
+    headers = self.MatchHeaderLines(line)
+    if headers:
       if self.trace_lines or self.value_lines:
         self.PrintOutput(self.trace_lines, self.value_lines)
         self.PrintDivider()
         self.trace_lines = []
         self.value_lines = []
         self.last_frame = -1
-      if process_header:
-        print(process_header.group(1))
-      if signal_header:
-        print(signal_header.group(1))
-      if abort_message_header:
-        print(abort_message_header.group(1))
-      if register_header:
-        print(register_header.group(1))
-      if thread_header:
-        print(thread_header.group(1))
-      if dalvik_jni_thread_header:
-        print(dalvik_jni_thread_header.group(1))
-      if dalvik_native_thread_header:
-        print(dalvik_native_thread_header.group(1))
-      if revision_header:
-        print(revision_header.group(1))
-      if unreachable_header:
-        print(unreachable_header.group(1))
+      for header in headers:
+        print(header)
       return True
     trace_line_dict = self.MatchTraceLine(line)
     if trace_line_dict is not None:
@@ -461,55 +646,7 @@ class TraceConverter:
       if area == "<unknown>" or area == "[heap]" or area == "[stack]":
         self.trace_lines.append((code_addr, "", area))
       else:
-        # If this is an apk, it usually means that there is actually
-        # a shared so that was loaded directly out of it. In that case,
-        # extract the shared library and the name of the shared library.
-        lib = None
-        # The format of the map name:
-        #   Some.apk!libshared.so
-        # or
-        #   Some.apk
-        if so_offset:
-          # If it ends in apk, we are done.
-          apk = None
-          if area.endswith(".apk"):
-            apk = area
-          else:
-            index = area.rfind(".so!")
-            if index != -1:
-              # Sometimes we'll see something like:
-              #   #01 pc abcd  libart.so!libart.so (offset 0x134000)
-              # Remove everything after the ! and zero the offset value.
-              area = area[0:index + 3]
-              so_offset = 0
-            else:
-              index = area.rfind(".apk!")
-              if index != -1:
-                apk = area[0:index + 4]
-          if apk:
-            lib_name, lib = self.GetLibFromApk(apk, so_offset)
-        else:
-          # Sometimes we'll see something like:
-          #   #01 pc abcd  libart.so!libart.so
-          # Remove everything after the !.
-          index = area.rfind(".so!")
-          if index != -1:
-            area = area[0:index + 3]
-        if not lib:
-          lib = area
-          lib_name = None
-
-        if build_id:
-          # If we have the build_id, do a brute-force search of the symbols directory.
-          basename = os.path.basename(lib).split("!")[-1]
-          lib = self.GetLibraryByBuildId(symbol.SYMBOLS_DIR, basename, build_id)
-          if not lib:
-            print("WARNING: Cannot find {} with build id {} in symbols directory."
-                  .format(basename, build_id))
-        else:
-          # When using atest, test paths are different between the out/ directory
-          # and device. Apply fixups.
-          lib = self.GetLibPath(lib)
+        area, lib, lib_name = self.GetTraceLib(area, so_offset, build_id)
 
         # If a calls b which further calls c and c is inlined to b, we want to
         # display "a -> b -> c" in the stack trace instead of just "a -> c"
@@ -538,6 +675,8 @@ class TraceConverter:
             if not symbol_with_offset:
               symbol_with_offset = source_symbol
             self.trace_lines.append((code_addr, symbol_with_offset, source_location))
+    if not self.MayBeValueLine(line):
+      return ret
     if self.code_line.match(line):
       # Code lines should be ignored. If this were exluded the 'code around'
       # sections would trigger value_line matches.
@@ -647,5 +786,119 @@ class ValueLinesTest(unittest.TestCase):
     tc.ProcessLine("    12345678  00001000  .")
     self.assertEqual([], tc.value_lines)
 
+class HeaderLinesTests(unittest.TestCase):
+  def test_keywords_do_not_skip_headers(self):
+    tc = TraceConverter()
+    for is_32bit in (True, False):
+      symbol.ARCH_IS_32BIT = is_32bit
+      tc.UpdateBitnessRegexes()
+      for name in ("arm", "arm64", "x86", "x86_64", "riscv64", "libmemunreachable",
+                   "long_asan_crash"):
+        for line in getattr(example_crashes, name).split('\n'):
+          expected = [match.group(1) for match in
+                      (getattr(tc, regex).search(line) for regex, _ in tc.header_lines)
+                      if match]
+          self.assertEqual(expected, tc.MatchHeaderLines(line), line)
+          if tc.value_line.match(line) or tc.code_line.match(line):
+            self.assertTrue(tc.MayBeValueLine(line), line)
+    symbol.ARCH_IS_32BIT = None
+
+class ApkTests(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.saved_symbols_dir = symbol.SYMBOLS_DIR
+    symbol.SYMBOLS_DIR = os.path.join(self.tmp_dir.name, "symbols")
+    os.makedirs(os.path.join(symbol.SYMBOLS_DIR, "system", "lib64"))
+    self.foo = os.path.join(symbol.SYMBOLS_DIR, "system", "lib64", "libfoo.so")
+    symbol._WriteTestElf(self.foo, "aabb")
+    self.bar = os.path.join(self.tmp_dir.name, "libbar.so")
+    symbol._WriteTestElf(self.bar, "ccdd")
+
+    self.out_dir = os.path.join(self.tmp_dir.name, "out")
+    os.makedirs(os.path.join(self.out_dir, "system", "app"))
+    self.apk = "/system/app/%s.apk" % self.id()
+    with zipfile.ZipFile(self.out_dir + self.apk, "w") as zf:
+      zf.writestr("classes.dex", b"dex" * 1000, zipfile.ZIP_DEFLATED)
+      # Store libfoo.so uncompressed and page aligned with a padding extra field.
+      info = zipfile.ZipInfo("lib/arm64-v8a/libfoo.so")
+      header_offset = zf.fp.tell()
+      padding = -(header_offset + 30 + len(info.filename) + 4) % mmap.ALLOCATIONGRANULARITY
+      info.extra = struct.pack("<HH", 0xd935, padding) + b"\0" * padding
+      with open(self.foo, "rb") as f:
+        zf.writestr(info, f.read(), zipfile.ZIP_STORED)
+      zf.write(self.bar, "lib/arm64-v8a/libbar.so", zipfile.ZIP_DEFLATED)
+    self.entries = {entry.name: entry
+                    for entry in TraceConverter().ReadApkEntries(self.out_dir + self.apk)}
+
+    self.saved_environ = dict(os.environ)
+    os.environ["ANDROID_PRODUCT_OUT"] = self.out_dir
+
+  def tearDown(self):
+    os.environ.clear()
+    os.environ.update(self.saved_environ)
+    symbol.SYMBOLS_DIR = self.saved_symbols_dir
+    self.tmp_dir.cleanup()
+
+  def test_stored_lib_in_symbols(self):
+    entry = self.entries["lib/arm64-v8a/libfoo.so"]
+    self.assertTrue(entry.stored)
+    self.assertEqual(0, entry.data_offset % mmap.ALLOCATIONGRANULARITY)
+    tc = TraceConverter()
+    self.assertEqual(("lib/arm64-v8a/libfoo.so", "/system/lib64/libfoo.so"),
+                     tc.GetLibFromApk(self.apk, "%x" % entry.data_offset))
+    self.assertEqual(("lib/arm64-v8a/libfoo.so", "/system/lib64/libfoo.so"),
+                     tc.GetLibFromApk(self.apk, "%x" % entry.start))
+    self.assertEqual((None, None), tc.GetLibFromApk(self.apk, "100000"))
+
+  def test_entries_cached(self):
+    symbol.SetSymbolCache(os.path.join(self.tmp_dir.name, "cache.db"))
+    try:
+      apk_full_path = self.out_dir + self.apk
+      entries = TraceConverter().ReadApkEntries(apk_full_path)
+      self.assertEqual(sorted(self.entries.values(), key=lambda entry: entry.start), entries)
+      # The cached entries are used as long as the mtime and size match.
+      st = os.stat(apk_full_path)
+      with open(apk_full_path, "r+b") as f:
+        f.seek(-22, os.SEEK_END)
+        f.write(b"\0" * 22)
+      os.utime(apk_full_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+      self.assertEqual(entries, TraceConverter().ReadApkEntries(apk_full_path))
+    finally:
+      symbol.SetSymbolCache(None)
+
+  def test_compressed_lib_extracted(self):
+    tc = TraceConverter()
+    entry = self.entries["lib/arm64-v8a/libbar.so"]
+    self.assertFalse(entry.stored)
+    name, lib = tc.GetLibFromApk(self.apk, "%x" % entry.data_offset)
+    self.assertEqual("lib/arm64-v8a/libbar.so", name)
+    with open(lib, "rb") as f, open(self.bar, "rb") as expected:
+      self.assertEqual(expected.read(), f.read())
+    tc.DeleteApkTmpFiles()
+    self.assertFalse(os.path.exists(lib))
+
+class BatchTests(unittest.TestCase):
+  def test_split_tombstones(self):
+    lines = ["garbage\n", TOMBSTONE_START + "\n", "pid: 1\n",
+             "01-01 00:00:00.000 F DEBUG   : " + TOMBSTONE_START + "\n", "pid: 2\n"]
+    self.assertEqual([lines[0:3], lines[3:5]], SplitTombstones(lines))
+    self.assertEqual([], SplitTombstones([]))
+
+  def test_convert_traces_json(self):
+    tombstones = [("arm", example_crashes.arm.split('\n')),
+                  ("arm64", example_crashes.arm64.split('\n'))]
+    output = io.StringIO()
+    ConvertTraces(tombstones, json_file=output)
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    self.assertEqual(["arm", "arm64"], [record["name"] for record in records])
+    for record in records:
+      self.assertNotIn("error", record)
+      self.assertIn("Stack Trace:", record["output"])
+      self.assertTrue(record["stacks"][0]["trace"])
+    # The bitness of each tombstone is detected separately.
+    self.assertIn("  RELADDR   FUNCTION", records[0]["output"])
+    self.assertIn("  RELADDR           FUNCTION", records[1]["output"])
+    self.assertIsNone(symbol.ARCH_IS_32BIT)
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -20,14 +20,26 @@ The information can include symbol names, offsets, and source locations.
 """
 
 import atexit
+import bisect
+import collections
+import concurrent.futures
+import contextlib
 import json
 import glob
+import mmap
 import os
 import platform
 import re
 import shutil
 import signal
+import sqlite3
+import stat
+import struct
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 ANDROID_BUILD_TOP = os.environ.get("ANDROID_BUILD_TOP", ".")
@@ -72,16 +84,32 @@ _SYMBOL_INFORMATION_ADDR2LINE_CACHE = {}
 _SYMBOL_INFORMATION_OBJDUMP_CACHE = {}
 _SYMBOL_DEMANGLING_CACHE = {}
 
+# Demangled symbols not yet stored in the persistent cache (see
+# FlushDemangledSymbols).
+_PENDING_DEMANGLED_SYMBOLS = {}
+
+# Persistent cache shared by all stack invocations (see SetSymbolCache).
+_SYMBOL_CACHE = None
+
 # Caches for pipes to subprocesses.
 
 class ProcessCache:
   _cmd2pipe = {}
   _lru = []
 
+  # Pipes handed out by UseProcess, which must not be terminated.
+  _in_use = collections.Counter()
+  _pipe_locks = {}
+  _lock = threading.RLock()
+
   # Max number of open pipes.
   _PIPE_MAX_OPEN = 10
 
   def GetProcess(self, cmd):
+    with self._lock:
+      return self._GetProcess(cmd)
+
+  def _GetProcess(self, cmd):
     cmd_tuple = tuple(cmd)  # Need to use a tuple as lists can't be dict keys.
     # Pipe already available?
     if cmd_tuple in self._cmd2pipe:
@@ -92,9 +120,12 @@ class ProcessCache:
 
     # Not cached, yet. Open a new one.
 
-    # Check if too many are open, close the old ones.
+    # Check if too many are open, close the old ones (unless they are in use).
     while len(self._lru) >= self._PIPE_MAX_OPEN:
-      open_cmd, open_pipe = self._lru.pop()
+      unused = [i for i, (open_cmd, _) in enumerate(self._lru) if not self._in_use[open_cmd]]
+      if not unused:
+        break
+      open_cmd, open_pipe = self._lru.pop(unused[-1])
       del self._cmd2pipe[open_cmd]
       self.TerminateProcess(open_pipe)
 
@@ -104,6 +135,26 @@ class ProcessCache:
     self._lru = [(cmd_tuple, pipe)] + self._lru
     return pipe
 
+  @contextlib.contextmanager
+  def UseProcess(self, cmd):
+    """Get a process for exclusive use by the calling thread.
+
+    The process is not terminated to make room for other processes until the
+    context exits.
+    """
+    cmd_tuple = tuple(cmd)
+    with self._lock:
+      pipe_lock = self._pipe_locks.setdefault(cmd_tuple, threading.Lock())
+    with pipe_lock:
+      with self._lock:
+        pipe = self._GetProcess(cmd)
+        self._in_use[cmd_tuple] += 1
+      try:
+        yield pipe
+      finally:
+        with self._lock:
+          self._in_use[cmd_tuple] -= 1
+
   def SpawnProcess(self, cmd):
      return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
 
@@ -134,6 +185,496 @@ def CloseAllPipes():
 atexit.register(CloseAllPipes)
 
 
+class ElfError(Exception):
+  pass
+
+
+ElfSection = collections.namedtuple(
+    "ElfSection", ["name", "type", "flags", "addr", "offset", "size", "link", "info", "entsize"])
+
+
+class ElfFile:
+  """Minimal memory-mapped ELF reader (section headers, notes and symbols)."""
+
+  SHT_SYMTAB = 2
+  SHT_NOTE = 7
+  SHT_DYNSYM = 11
+  SHF_EXECINSTR = 0x4
+  NT_GNU_BUILD_ID = 3
+  STT_FUNC = 2
+  STT_GNU_IFUNC = 10
+  STB_LOCAL = 0
+  EM_ARM = 40
+
+  def __init__(self, path, offset=0, size=0):
+    """Map the ELF file at path, or the one embedded at offset (a multiple of
+    mmap.ALLOCATIONGRANULARITY) with the given size, e.g. in an APK."""
+    self._file = open(path, "rb")
+    try:
+      self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ, offset=offset)
+    except ValueError:
+      # Empty files can't be mapped.
+      self._file.close()
+      raise ElfError("%s: empty file" % path)
+    try:
+      self._ReadSections(path)
+    except:
+      self.Close()
+      raise
+
+  def _ReadSections(self, path):
+    ident = self._map[:6]
+    if len(ident) < 6 or ident[:4] != b"\x7fELF" or ident[4] not in (1, 2) or \
+        ident[5] not in (1, 2):
+      raise ElfError("%s: not an ELF file" % path)
+    self.is_64bit = ident[4] == 2
+    self.endian = "<" if ident[5] == 1 else ">"
+    try:
+      self.machine, = struct.unpack_from(self.endian + "H", self._map, 0x12)
+      if self.is_64bit:
+        shoff, = struct.unpack_from(self.endian + "Q", self._map, 0x28)
+        shentsize, shnum, shstrndx = struct.unpack_from(self.endian + "HHH", self._map, 0x3a)
+        section_format = self.endian + "IIQQQQIIQQ"
+      else:
+        shoff, = struct.unpack_from(self.endian + "I", self._map, 0x20)
+        shentsize, shnum, shstrndx = struct.unpack_from(self.endian + "HHH", self._map, 0x2e)
+        section_format = self.endian + "IIIIIIIIII"
+      headers = [struct.unpack_from(section_format, self._map, shoff + i * shentsize)
+                 for i in range(shnum)]
+    except struct.error:
+      raise ElfError("%s: truncated section headers" % path)
+    if shstrndx < len(headers):
+      names = headers[shstrndx]
+      names = self._map[names[4]:names[4] + names[5]]
+    else:
+      names = b""
+    self.sections = []
+    for (name, sh_type, flags, addr, offset, size, link, info, _, entsize) in headers:
+      end = names.find(b"\0", name)
+      name = names[name:end if end != -1 else len(names)].decode("utf-8", "replace")
+      self.sections.append(ElfSection(name, sh_type, flags, addr, offset, size, link, info,
+                                      entsize))
+
+  def Close(self):
+    self._map.close()
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused):
+    self.Close()
+
+  def GetSectionData(self, section):
+    return self._map[section.offset:section.offset + section.size]
+
+  def GetFunctionSymbols(self):
+    """Return a list of (address, size, name, is_local) for the function symbols
+    in .symtab and .dynsym that are defined in executable sections."""
+    if self.is_64bit:
+      symbol_format = self.endian + "IBBHQQ"
+    else:
+      symbol_format = self.endian + "IIIBBH"
+    symbol_size = struct.calcsize(symbol_format)
+    # Clear the Thumb bit of ARM function addresses.
+    addr_mask = ~1 if self.machine == self.EM_ARM else ~0
+
+    result = []
+    for section in self.sections:
+      if section.type not in (self.SHT_SYMTAB, self.SHT_DYNSYM) or \
+          section.link >= len(self.sections):
+        continue
+      names = self.GetSectionData(self.sections[section.link])
+      data = self.GetSectionData(section)
+      data = data[:len(data) - len(data) % symbol_size]
+      for entry in struct.iter_unpack(symbol_format, data):
+        if self.is_64bit:
+          name, info, _, shndx, value, size = entry
+        else:
+          name, value, size, info, _, shndx = entry
+        if (info & 0xf) not in (self.STT_FUNC, self.STT_GNU_IFUNC) or \
+            shndx == 0 or shndx >= len(self.sections) or \
+            not self.sections[shndx].flags & self.SHF_EXECINSTR:
+          continue
+        end = names.find(b"\0", name)
+        name = names[name:end if end != -1 else len(names)].decode("utf-8", "replace")
+        if name:
+          result.append((value & addr_mask, size, name, (info >> 4) == self.STB_LOCAL))
+    return result
+
+  def GetExecutableSections(self):
+    """Return a list of (start, end, name) of the executable sections."""
+    return [(section.addr, section.addr + section.size, section.name)
+            for section in self.sections if section.flags & self.SHF_EXECINSTR and section.size]
+
+  def GetBuildId(self):
+    """Return the GNU build-id as a hex string or None."""
+    for section in self.sections:
+      if section.type != self.SHT_NOTE:
+        continue
+      data = self.GetSectionData(section)
+      pos = 0
+      while pos + 12 <= len(data):
+        namesz, descsz, note_type = struct.unpack_from(self.endian + "III", data, pos)
+        name_pos = pos + 12
+        desc_pos = name_pos + ((namesz + 3) & ~3)
+        pos = desc_pos + ((descsz + 3) & ~3)
+        if note_type == self.NT_GNU_BUILD_ID and data[name_pos:name_pos + namesz] == b"GNU\0":
+          return data[desc_pos:desc_pos + descsz].hex()
+    return None
+
+
+_BUILD_ID_CACHE = {}
+
+def GetBuildId(path):
+  """Return the GNU build-id of an ELF file as a hex string, or None."""
+  if path in _BUILD_ID_CACHE:
+    return _BUILD_ID_CACHE[path]
+  build_id = _ReadBuildId(path)
+  _BUILD_ID_CACHE[path] = build_id
+  return build_id
+
+
+def _ReadBuildId(path):
+  try:
+    with ElfFile(path) as elf:
+      return elf.GetBuildId()
+  except (OSError, ElfError):
+    return None
+
+
+class BuildIdIndex:
+  """Persistent index of the GNU build-ids of the ELF files in a directory.
+
+  The index is stored as JSON, by default next to the directory. Refresh()
+  only reads the files whose mtime or size changed since the last scan, in
+  parallel.
+  """
+
+  _VERSION = 1
+
+  def __init__(self, root, path=None, max_workers=None):
+    self.root = root
+    self.path = path if path else os.path.normpath(root) + ".build-ids.json"
+    self.max_workers = max_workers
+    # {relative path: [mtime_ns, size, build_id]}
+    self._files = {}
+    self._by_build_id = {}
+
+  def _Load(self):
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+    except (OSError, ValueError):
+      return {}
+    if not isinstance(data, dict) or data.get("version") != self._VERSION or \
+        data.get("root") != os.path.abspath(self.root):
+      return {}
+    return data.get("files", {})
+
+  def _Save(self):
+    data = {"version": self._VERSION, "root": os.path.abspath(self.root), "files": self._files}
+    try:
+      fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+    except OSError:
+      # The index is only an optimization, e.g. the symbols may be read-only.
+      return
+    try:
+      with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+      os.replace(tmp_path, self.path)
+    except OSError:
+      os.unlink(tmp_path)
+
+  def _Scan(self):
+    """Yield (relative path, mtime_ns, size) of the files under root."""
+    for dirpath, _, filenames in os.walk(self.root):
+      for name in filenames:
+        path = os.path.join(dirpath, name)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue
+        if stat.S_ISREG(st.st_mode):
+          yield os.path.relpath(path, self.root), st.st_mtime_ns, st.st_size
+
+  def Refresh(self):
+    """Update the index from the files under root and save it if it changed."""
+    old_files = self._files or self._Load()
+    files = {}
+    changed = []
+    for relpath, mtime_ns, size in self._Scan():
+      entry = old_files.get(relpath)
+      if entry and entry[0] == mtime_ns and entry[1] == size:
+        files[relpath] = entry
+      else:
+        files[relpath] = [mtime_ns, size, None]
+        changed.append(relpath)
+
+    if changed:
+      paths = [os.path.join(self.root, relpath) for relpath in changed]
+      with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+        for relpath, build_id in zip(changed, executor.map(_ReadBuildId, paths)):
+          files[relpath][2] = build_id
+
+    self._files = files
+    self._by_build_id = {}
+    for relpath in sorted(files):
+      build_id = files[relpath][2]
+      if build_id:
+        self._by_build_id.setdefault(build_id, []).append(relpath)
+    if changed or len(files) != len(old_files):
+      self._Save()
+
+  def Lookup(self, build_id):
+    """Return the sorted relative paths of the files with the given build-id."""
+    return self._by_build_id.get(build_id, [])
+
+
+_BUILD_ID_INDEXES = {}
+
+def GetBuildIdIndex(root):
+  """Return the refreshed BuildIdIndex of a directory, once per process."""
+  if root not in _BUILD_ID_INDEXES:
+    index = BuildIdIndex(root)
+    index.Refresh()
+    _BUILD_ID_INDEXES[root] = index
+  return _BUILD_ID_INDEXES[root]
+
+
+class ElfSymbolIndex:
+  """Sorted address index of the function symbols of an ELF file."""
+
+  def __init__(self, symbols, sections):
+    # For aliases, pick the greatest name like llvm-objdump, which prints the
+    # labels of aliases sorted by name (and the last label wins).
+    by_addr = {}
+    for addr, _, name, _ in symbols:
+      if addr not in by_addr or by_addr[addr] < name:
+        by_addr[addr] = name
+    self._addrs = sorted(by_addr)
+    self._names = [by_addr[addr] for addr in self._addrs]
+    self._sections = sorted(sections)
+
+  def __len__(self):
+    return len(self._addrs)
+
+  def Lookup(self, addr):
+    """Return (mangled symbol, offset) of the function containing an address, or None."""
+    i = bisect.bisect_right(self._sections, (addr, float("inf"))) - 1
+    if i < 0 or addr >= self._sections[i][1]:
+      # Not in an executable section.
+      return None
+    section_start, _, section_name = self._sections[i]
+    i = bisect.bisect_right(self._addrs, addr) - 1
+    if i < 0 or self._addrs[i] < section_start:
+      # No symbol before the address, use the section like objdump.
+      return (section_name, addr - section_start)
+    return (self._names[i], addr - self._addrs[i])
+
+
+_SYMBOL_INDEX_CACHE = {}
+
+def GetSymbolIndex(path):
+  """Return the ElfSymbolIndex of an ELF file, or None if it has no function symbols.
+
+  The indexes are cached per build-id (or per path if there is no build-id).
+  """
+  key = GetBuildId(path) or path
+  if key in _SYMBOL_INDEX_CACHE:
+    return _SYMBOL_INDEX_CACHE[key]
+  try:
+    with ElfFile(path) as elf:
+      index = ElfSymbolIndex(elf.GetFunctionSymbols(), elf.GetExecutableSections())
+  except (OSError, ElfError, struct.error):
+    index = None
+  if index is not None and not len(index):
+    index = None
+  _SYMBOL_INDEX_CACHE[key] = index
+  return index
+
+
+def DemangleSymbols(symbols):
+  """Demangle a list of symbols with one llvm-cxxfilt run. Returns None on failure."""
+  if not any(symbol.startswith("_Z") for symbol in symbols):
+    return list(symbols)
+  try:
+    output = subprocess.run([ToolPath("llvm-cxxfilt")], input="\n".join(symbols) + "\n",
+                            stdout=subprocess.PIPE, universal_newlines=True,
+                            check=True).stdout
+  # ToolPath raises a plain Exception when the toolchain can't be found.
+  except Exception:
+    return None
+  demangled = output.splitlines()
+  if len(demangled) != len(symbols):
+    return None
+  return demangled
+
+
+def _LookupFunctionsFromSymbolIndex(symbols, addrs):
+  """Find the containing functions of addresses with the ELF symbol tables.
+
+  Returns a dictionary of the form {addr: (string symbol, offset)} or None if
+  the symbol tables can't be used (in which case objdump should be used).
+  """
+  index = GetSymbolIndex(symbols)
+  if index is None:
+    return None
+  found = {}
+  for addr in addrs:
+    match = index.Lookup(int(addr, 16))
+    if match:
+      found[addr] = match
+  names = sorted(set(name for name, _ in found.values()))
+  demangled = DemangleSymbols(names)
+  if demangled is None:
+    return None
+  demangled = dict(zip(names, demangled))
+  return {addr: (demangled[name], offset) for addr, (name, offset) in found.items()}
+
+
+class SymbolCache:
+  """Persistent symbolization cache shared by concurrent processes.
+
+  The results are stored in a sqlite database keyed by the kind of the result,
+  the ELF build-id, and the address (or the mangled name for demangling). The
+  least recently used entries are evicted when there are more than max_entries
+  (plus some slack, so that the entries are only counted once in a while).
+  """
+
+  _SCHEMA_VERSION = 1
+
+  # Don't bump the access time of entries used within this many seconds.
+  _ATIME_GRANULARITY = 3600
+
+  # Max number of SQL variables in one statement.
+  _MAX_VARIABLES = 500
+
+  # Fraction of max_entries the cache may grow past before it is trimmed.
+  _EVICTION_SLACK = 0.1
+
+  def __init__(self, path, max_entries=1000000):
+    self.max_entries = max_entries
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    try:
+      self._conn.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.DatabaseError:
+      # Not supported on some file systems; the rollback journal works too.
+      pass
+    with self._conn:
+      version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+      if version != self._SCHEMA_VERSION:
+        self._conn.execute("DROP TABLE IF EXISTS entries")
+        self._conn.execute("PRAGMA user_version=%d" % self._SCHEMA_VERSION)
+      self._conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "kind TEXT NOT NULL, build_id TEXT NOT NULL, key TEXT NOT NULL, "
+                         "value TEXT NOT NULL, atime REAL NOT NULL, "
+                         "PRIMARY KEY (kind, build_id, key))")
+      self._conn.execute("CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)")
+      # An upper bound of the number of entries. Replaced entries and the
+      # entries added by other processes are only seen when it is recounted.
+      self._count = self._CountEntries()
+
+  def _CountEntries(self):
+    return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+  def Close(self):
+    self._conn.close()
+
+  def Get(self, kind, build_id, keys):
+    """Return a dictionary of the form {key: value} for the cached keys."""
+    with self._lock:
+      return self._Get(kind, build_id, list(keys))
+
+  def _Get(self, kind, build_id, keys):
+    result = {}
+    for i in range(0, len(keys), self._MAX_VARIABLES):
+      chunk = keys[i:i + self._MAX_VARIABLES]
+      rows = self._conn.execute(
+          "SELECT key, value FROM entries WHERE kind = ? AND build_id = ? AND key IN (%s)" %
+          ",".join("?" * len(chunk)), [kind, build_id] + chunk)
+      for key, value in rows:
+        result[key] = json.loads(value)
+    if result:
+      now = time.time()
+      with self._conn:
+        self._conn.executemany(
+            "UPDATE entries SET atime = ? "
+            "WHERE kind = ? AND build_id = ? AND key = ? AND atime < ?",
+            [(now, kind, build_id, key, now - self._ATIME_GRANULARITY) for key in result])
+    return result
+
+  def Put(self, kind, build_id, items):
+    """Store the values of a dictionary of the form {key: value}."""
+    if not items:
+      return
+    with self._lock:
+      self._Put(kind, build_id, items)
+
+  def _Put(self, kind, build_id, items):
+    now = time.time()
+    with self._conn:
+      self._conn.executemany(
+          "INSERT OR REPLACE INTO entries (kind, build_id, key, value, atime) "
+          "VALUES (?, ?, ?, ?, ?)",
+          [(kind, build_id, key, json.dumps(value), now) for key, value in items.items()])
+      self._count += len(items)
+      if self._count <= self.max_entries + int(self.max_entries * self._EVICTION_SLACK):
+        return
+      self._count = self._CountEntries()
+      if self._count > self.max_entries:
+        self._conn.execute(
+            "DELETE FROM entries WHERE rowid IN "
+            "(SELECT rowid FROM entries ORDER BY atime LIMIT ?)",
+            (self._count - self.max_entries,))
+        self._count = self.max_entries
+
+
+def SetSymbolCache(path, max_entries=1000000):
+  """Use a persistent symbolization cache at path (or no cache if path is None)."""
+  global _SYMBOL_CACHE
+  if _SYMBOL_CACHE:
+    FlushDemangledSymbols()
+    _SYMBOL_CACHE.Close()
+  _SYMBOL_CACHE = SymbolCache(path, max_entries) if path else None
+
+
+def GetCachedValue(kind, key):
+  """Look up a value in the persistent cache, or return None."""
+  if not _SYMBOL_CACHE:
+    return None
+  return _SYMBOL_CACHE.Get(kind, "", [key]).get(key)
+
+
+def PutCachedValue(kind, key, value):
+  """Store a value in the persistent cache."""
+  if _SYMBOL_CACHE:
+    _SYMBOL_CACHE.Put(kind, "", {key: value})
+
+
+def _NormalizeAddr(addr):
+  """Strip the zero padding so that 32-bit and 64-bit style addresses share entries."""
+  return "%x" % int(addr, 16)
+
+
+def _GetPersistentResults(kind, build_id, addrs):
+  """Look up addresses in the persistent cache."""
+  if not _SYMBOL_CACHE or not build_id:
+    return {}
+  keys = {_NormalizeAddr(addr): addr for addr in addrs}
+  cached = _SYMBOL_CACHE.Get(kind, build_id, keys)
+  return {keys[key]: value for key, value in cached.items()}
+
+
+def _PutPersistentResults(kind, build_id, results):
+  """Store symbolized addresses in the persistent cache."""
+  if not _SYMBOL_CACHE or not build_id:
+    return
+  _SYMBOL_CACHE.Put(kind, build_id,
+                    {_NormalizeAddr(addr): value for addr, value in results.items()})
+
+
 def PipeTermHandler(signum, frame):
   CloseAllPipes()
   os._exit(0)
@@ -241,6 +782,75 @@ def SymbolInformationForSet(lib, unique_addrs):
   return result
 
 
+def SymbolInformationForSets(lib_to_addrs, max_workers=None):
+  """Look up symbol information for addresses in several libraries in parallel.
+
+  Args:
+    lib_to_addrs: dictionary of the form {lib: set of hexidecimal addresses}
+    max_workers: max number of libraries to symbolize at the same time
+
+  Returns:
+    A dictionary of the form {lib: result of SymbolInformationForSet}.
+  """
+  libs = [lib for lib in lib_to_addrs if lib]
+  if not libs:
+    return {}
+  if max_workers is None:
+    max_workers = min(os.cpu_count() or 1, ProcessCache._PIPE_MAX_OPEN)
+  max_workers = max(1, min(max_workers, len(libs)))
+  if max_workers == 1:
+    return {lib: SymbolInformationForSet(lib, lib_to_addrs[lib]) for lib in libs}
+  with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+    futures = {lib: executor.submit(SymbolInformationForSet, lib, lib_to_addrs[lib])
+               for lib in libs}
+    return {lib: future.result() for lib, future in futures.items()}
+
+
+def _ParseLlvmSymbolizerRecords(line):
+  """Parse a JSON reply from llvm-symbolizer into [(symbol, file:line)]."""
+  records = []
+  json_result = json.loads(line.strip())
+  for symbol in json_result["Symbol"]:
+    function_name = symbol["FunctionName"]
+    # GNU style location: file_name:line_num
+    location = ("%s:%s" % (symbol["FileName"], symbol["Line"]))
+    records.append((function_name, location))
+  return records
+
+
+def _RunLlvmSymbolizerPipelined(child, addrs):
+  """Send all addresses to llvm-symbolizer at once and read the replies.
+
+  The replies are drained by a reader thread while the addresses are written, so
+  that neither side blocks on a full pipe. Returns a list with a reply line (or
+  an exception) for each address.
+  """
+  replies = []
+
+  def ReadReplies():
+    try:
+      for _ in addrs:
+        line = child.stdout.readline()
+        if not line:
+          raise IOError("llvm-symbolizer exited unexpectedly")
+        replies.append(line)
+    except (IOError, ValueError) as e:
+      replies.extend([e] * (len(addrs) - len(replies)))
+
+  reader = threading.Thread(target=ReadReplies, daemon=True)
+  reader.start()
+  try:
+    child.stdin.write("".join("0x%s\n" % addr for addr in addrs))
+    child.stdin.flush()
+  except IOError as e:
+    # Unblock the reader.
+    child.kill()
+    reader.join()
+    return [e] * len(addrs)
+  reader.join()
+  return replies
+
+
 def CallLlvmSymbolizerForSet(lib, unique_addrs):
   """Look up line and symbol information for a set of addresses.
 
@@ -292,31 +902,40 @@ def CallLlvmSymbolizerForSet(lib, unique_addrs):
   if os.path.isdir(symbols):
     return None
 
+  build_id = GetBuildId(symbols)
+  cached = _GetPersistentResults("llvm-symbolizer", build_id, addrs)
+  for addr, records in cached.items():
+    records = [tuple(record) for record in records]
+    result[addr] = records
+    addr_cache[addr] = records
+  addrs = [addr for addr in addrs if addr not in cached]
+  if not addrs:
+    return result
+
   cmd = [ToolPath("llvm-symbolizer"), "--functions", "--inlines",
       "--demangle", "--obj=" + symbols, "--output-style=JSON"]
-  child = _PIPE_ADDR2LINE_CACHE.GetProcess(cmd)
+  with _PIPE_ADDR2LINE_CACHE.UseProcess(cmd) as child:
+    replies = _RunLlvmSymbolizerPipelined(child, addrs)
 
-  for addr in addrs:
-    try:
-      child.stdin.write("0x%s\n" % addr)
-      child.stdin.flush()
-      records = []
-      json_result = json.loads(child.stdout.readline().strip())
-      for symbol in json_result["Symbol"]:
-        function_name = symbol["FunctionName"]
-        # GNU style location: file_name:line_num
-        location = ("%s:%s" % (symbol["FileName"], symbol["Line"]))
-        records.append((function_name, location))
-    except IOError as e:
+  new_results = {}
+  for addr, reply in zip(addrs, replies):
+    if isinstance(reply, Exception):
       # Remove the / in front of the library name to match other output.
-      records = [(None, lib[1:] + "  ***Error: " + str(e))]
+      records = [(None, lib[1:] + "  ***Error: " + str(reply))]
+    else:
+      records = _ParseLlvmSymbolizerRecords(reply)
+      new_results[addr] = records
     result[addr] = records
     addr_cache[addr] = records
+  _PutPersistentResults("llvm-symbolizer", build_id, new_results)
   return result
 
 
 def CallObjdumpForSet(lib, unique_addrs):
-  """Use objdump to find out the names of the containing functions.
+  """Find out the names of the containing functions.
+
+  The functions are looked up in the ELF symbol tables. If that is not possible
+  (e.g. a stripped library), objdump is used to disassemble the code instead.
 
   Args:
     lib: library (or executable) pathname containing symbols
@@ -357,6 +976,23 @@ def CallObjdumpForSet(lib, unique_addrs):
     if not os.path.exists(symbols):
       return None
 
+  build_id = GetBuildId(symbols)
+  cached = _GetPersistentResults("objdump", build_id, addrs)
+  for addr, (object_symbol, object_offset) in cached.items():
+    result[addr] = (object_symbol, object_offset)
+    addr_cache[addr] = result[addr]
+  addrs = [addr for addr in addrs if addr not in cached]
+  if not addrs:
+    return result
+
+  new_results = _LookupFunctionsFromSymbolIndex(symbols, addrs)
+  if new_results is not None:
+    result.update(new_results)
+    addr_cache.update(new_results)
+    _PutPersistentResults("objdump", build_id, new_results)
+    return result
+
+  new_results = {}
   start_addr_dec = str(int(addrs[0], 16))
   stop_addr_dec = str(int(addrs[-1], 16) + 8)
   cmd = [ToolPath("llvm-objdump"),
@@ -411,11 +1047,13 @@ def CallObjdumpForSet(lib, unique_addrs):
       if i_addr == i_target:
         result[target_addr] = (current_symbol, i_target - current_symbol_addr)
         addr_cache[target_addr] = result[target_addr]
+        new_results[target_addr] = result[target_addr]
         addr_index += 1
         if addr_index >= len(addrs):
           break
   stream.close()
 
+  _PutPersistentResults("objdump", build_id, new_results)
   return result
 
 
@@ -423,6 +1061,12 @@ def CallCppFilt(mangled_symbol):
   if mangled_symbol in _SYMBOL_DEMANGLING_CACHE:
     return _SYMBOL_DEMANGLING_CACHE[mangled_symbol]
 
+  if _SYMBOL_CACHE:
+    cached = _SYMBOL_CACHE.Get("cxxfilt", "", [mangled_symbol])
+    if mangled_symbol in cached:
+      _SYMBOL_DEMANGLING_CACHE[mangled_symbol] = cached[mangled_symbol]
+      return cached[mangled_symbol]
+
   global _CACHED_CXX_FILT
   if not _CACHED_CXX_FILT:
     toolchains = None
@@ -452,10 +1096,19 @@ def CallCppFilt(mangled_symbol):
   demangled_symbol = process.stdout.readline().strip()
 
   _SYMBOL_DEMANGLING_CACHE[mangled_symbol] = demangled_symbol
+  if _SYMBOL_CACHE:
+    _PENDING_DEMANGLED_SYMBOLS[mangled_symbol] = demangled_symbol
 
   return demangled_symbol
 
 
+def FlushDemangledSymbols():
+  """Store the symbols demangled by CallCppFilt in the persistent cache at once."""
+  if _SYMBOL_CACHE:
+    _SYMBOL_CACHE.Put("cxxfilt", "", _PENDING_DEMANGLED_SYMBOLS)
+  _PENDING_DEMANGLED_SYMBOLS.clear()
+
+
 def FormatSymbolWithOffset(symbol, offset):
   if offset == 0:
     return symbol
@@ -579,5 +1232,231 @@ class FormatSymbolWithoutParametersTests(unittest.TestCase):
     self.assertEqual(FormatSymbolWithoutParameters("foo<bar(int i)"), "foo<bar(int i)")
     self.assertEqual(FormatSymbolWithoutParameters("foo>bar(int i)"), "foo>bar(int i)")
 
+def _WriteTestElf(path, build_id, text_range=None, symbols=()):
+  """Write a minimal 64-bit little-endian ELF file with a build-id note and,
+  optionally, a .text section at text_range=(addr, size) and a .symtab with
+  function symbols (name, addr, size)."""
+  desc = bytes.fromhex(build_id)
+  note = struct.pack("<III", 4, len(desc), ElfFile.NT_GNU_BUILD_ID) + b"GNU\0" + desc
+  note += b"\0" * (-len(note) % 4)
+  # (name, type, flags, addr, data, link, entsize)
+  sections = [(".note.gnu.build-id", ElfFile.SHT_NOTE, 2, 0, note, 0, 0)]
+  if text_range:
+    sections.append((".text", 1, 2 | ElfFile.SHF_EXECINSTR, text_range[0], b"", 0, 0))
+    strtab = b"\0"
+    symtab = b"\0" * 24
+    for name, addr, size in symbols:
+      symtab += struct.pack("<IBBHQQ", len(strtab), ElfFile.STT_FUNC | (1 << 4), 0, 2, addr, size)
+      strtab += name.encode() + b"\0"
+    sections.append((".symtab", ElfFile.SHT_SYMTAB, 0, 0, symtab, 4, 24))
+    sections.append((".strtab", 3, 0, 0, strtab, 0, 0))
+  shstrtab = b"\0" + b"".join(section[0].encode() + b"\0" for section in sections) + \
+             b".shstrtab\0"
+  sections.append((".shstrtab", 3, 0, 0, shstrtab, 0, 0))
+
+  data = b""
+  headers = [struct.pack("<IIQQQQIIQQ", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)]
+  name_offset = 1
+  for name, sh_type, flags, addr, section_data, link, entsize in sections:
+    offset = 64 + len(data)
+    size = text_range[1] if name == ".text" else len(section_data)
+    info = 1 if sh_type == ElfFile.SHT_SYMTAB else 0  # Index of the first global symbol.
+    align = 4 if sh_type == ElfFile.SHT_NOTE else 8
+    headers.append(struct.pack("<IIQQQQIIQQ", name_offset, sh_type, flags, addr, offset, size,
+                               link, info, align, entsize))
+    name_offset += len(name) + 1
+    data += section_data + b"\0" * (-len(section_data) % 8)
+  shoff = 64 + len(data)
+  header = b"\x7fELF\x02\x01\x01" + b"\0" * 9
+  header += struct.pack("<HHIQQQIHHHHHH", 3, 183, 1, 0, 0, shoff, 0, 64, 0, 0, 64,
+                        len(headers), len(headers) - 1)
+  with open(path, "wb") as f:
+    f.write(header + data + b"".join(headers))
+
+class ElfFileTests(unittest.TestCase):
+  def test_build_id(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, "libfoo.so")
+      _WriteTestElf(path, "0123456789abcdef")
+      with ElfFile(path) as elf:
+        self.assertTrue(elf.is_64bit)
+        self.assertEqual([s.name for s in elf.sections], ["", ".note.gnu.build-id", ".shstrtab"])
+        self.assertEqual(elf.GetBuildId(), "0123456789abcdef")
+
+  def test_symbol_index(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, "libfoo.so")
+      _WriteTestElf(path, "0123456789abcdef", (0x1000, 0x100),
+                    [("foo", 0x1010, 0x10), ("bar", 0x1020, 0x20), ("baz", 0x1020, 0x20)])
+      index = GetSymbolIndex(path)
+      self.assertEqual(len(index), 2)
+      self.assertIsNone(index.Lookup(0xfff))
+      self.assertEqual(index.Lookup(0x1004), (".text", 4))
+      self.assertEqual(index.Lookup(0x1010), ("foo", 0))
+      self.assertEqual(index.Lookup(0x101f), ("foo", 15))
+      self.assertEqual(index.Lookup(0x1024), ("baz", 4))
+      self.assertEqual(index.Lookup(0x10ff), ("baz", 0xdf))
+      self.assertIsNone(index.Lookup(0x1100))
+      self.assertEqual(_LookupFunctionsFromSymbolIndex(path, ["1014", "2000"]),
+                       {"1014": ("foo", 4)})
+
+  def test_no_symbol_index(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, "libfoo.so")
+      _WriteTestElf(path, "00")
+      self.assertIsNone(GetSymbolIndex(path))
+      self.assertIsNone(_LookupFunctionsFromSymbolIndex(path, ["1000"]))
+
+  def test_not_elf(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, "libfoo.so")
+      with open(path, "w") as f:
+        f.write("not an elf file")
+      self.assertIsNone(GetBuildId(path))
+      self.assertIsNone(GetBuildId(os.path.join(tmp_dir, "missing.so")))
+
+class BuildIdIndexTests(unittest.TestCase):
+  def test_refresh(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      root = os.path.join(tmp_dir, "symbols")
+      os.makedirs(os.path.join(root, "system", "lib64"))
+      os.makedirs(os.path.join(root, "vendor", "lib64"))
+      _WriteTestElf(os.path.join(root, "system", "lib64", "libfoo.so"), "aa")
+      _WriteTestElf(os.path.join(root, "vendor", "lib64", "libfoo.so"), "bb")
+      with open(os.path.join(root, "system", "README"), "w") as f:
+        f.write("not an elf file")
+
+      index = BuildIdIndex(root)
+      index.Refresh()
+      self.assertEqual(index.path, root + ".build-ids.json")
+      self.assertEqual(index.Lookup("aa"), [os.path.join("system", "lib64", "libfoo.so")])
+      self.assertEqual(index.Lookup("bb"), [os.path.join("vendor", "lib64", "libfoo.so")])
+      self.assertEqual(index.Lookup("cc"), [])
+
+      # Only the files with a new mtime or size are read again, so rewriting a
+      # file and restoring its mtime keeps the stale build-id.
+      path = os.path.join(root, "system", "lib64", "libfoo.so")
+      st = os.stat(path)
+      _WriteTestElf(path, "dd")
+      os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+      os.unlink(os.path.join(root, "vendor", "lib64", "libfoo.so"))
+      _WriteTestElf(os.path.join(root, "vendor", "lib64", "libbar.so"), "cccc")
+      index = BuildIdIndex(root)
+      index.Refresh()
+      self.assertEqual(index.Lookup("aa"), [os.path.join("system", "lib64", "libfoo.so")])
+      self.assertEqual(index.Lookup("bb"), [])
+      self.assertEqual(index.Lookup("cccc"), [os.path.join("vendor", "lib64", "libbar.so")])
+
+class SymbolCacheTests(unittest.TestCase):
+  def test_get_put(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cache = SymbolCache(os.path.join(tmp_dir, "cache.db"))
+      cache.Put("objdump", "1234", {"100": ["foo", 4]})
+      cache.Close()
+
+      cache = SymbolCache(os.path.join(tmp_dir, "cache.db"))
+      self.assertEqual(cache.Get("objdump", "1234", ["100", "104"]), {"100": ["foo", 4]})
+      self.assertEqual(cache.Get("objdump", "5678", ["100"]), {})
+      self.assertEqual(cache.Get("llvm-symbolizer", "1234", ["100"]), {})
+      cache.Close()
+
+  def test_eviction(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cache = SymbolCache(os.path.join(tmp_dir, "cache.db"), max_entries=2)
+      cache.Put("cxxfilt", "", {"a": "a"})
+      cache.Put("cxxfilt", "", {"b": "b"})
+      cache.Put("cxxfilt", "", {"c": "c"})
+      self.assertEqual(cache.Get("cxxfilt", "", ["a", "b", "c"]), {"b": "b", "c": "c"})
+      cache.Close()
+
+  def test_eviction_slack(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cache = SymbolCache(os.path.join(tmp_dir, "cache.db"), max_entries=10)
+      for i in range(11):
+        cache.Put("cxxfilt", "", {str(i): i})
+      self.assertEqual(len(cache.Get("cxxfilt", "", [str(i) for i in range(11)])), 11)
+      cache.Close()
+
+      # The count is read back when the cache is opened again.
+      cache = SymbolCache(os.path.join(tmp_dir, "cache.db"), max_entries=10)
+      cache.Put("cxxfilt", "", {"11": 11})
+      self.assertEqual(len(cache.Get("cxxfilt", "", [str(i) for i in range(12)])), 10)
+      cache.Close()
+
+  def test_symbolize_from_cache(self):
+    global SYMBOLS_DIR
+    saved_symbols_dir = SYMBOLS_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      SYMBOLS_DIR = tmp_dir
+      _WriteTestElf(os.path.join(tmp_dir, "libcached.so"), "00112233")
+      try:
+        SetSymbolCache(os.path.join(tmp_dir, "cache.db"))
+        _SYMBOL_CACHE.Put("llvm-symbolizer", "00112233", {"10": [["foo()", "foo.cpp:1"]]})
+        _SYMBOL_CACHE.Put("objdump", "00112233", {"10": ["foo()", 8]})
+
+        def GetProcess(cmd):
+          raise AssertionError("unexpected tool invocation")
+        _PIPE_ADDR2LINE_CACHE.GetProcess = GetProcess
+        self.assertEqual(SymbolInformation("/libcached.so", "0000000000000010"),
+                         [("foo()", "foo.cpp:1", "foo()+8")])
+      finally:
+        del _PIPE_ADDR2LINE_CACHE.GetProcess
+        SetSymbolCache(None)
+        SYMBOLS_DIR = saved_symbols_dir
+
+class PipelinedSymbolizerTests(unittest.TestCase):
+  # Replies like llvm-symbolizer --output-style=JSON, one line per address.
+  FAKE_SYMBOLIZER = (
+      "import json, sys\n"
+      "for line in sys.stdin:\n"
+      "  addr = line.strip()\n"
+      "  print(json.dumps({'Address': addr, 'Symbol': [\n"
+      "      {'FunctionName': 'f' + addr, 'FileName': 'a.c', 'Line': 1}]}), flush=True)\n")
+
+  def test_many_addresses(self):
+    # Enough addresses to fill both pipes if they were not drained concurrently.
+    addrs = ["%x" % i for i in range(20000)]
+    child = subprocess.Popen([sys.executable, "-c", self.FAKE_SYMBOLIZER],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             universal_newlines=True)
+    try:
+      replies = _RunLlvmSymbolizerPipelined(child, addrs)
+      self.assertEqual(len(replies), len(addrs))
+      self.assertEqual(_ParseLlvmSymbolizerRecords(replies[-1]), [("f0x4e1f", "a.c:1")])
+    finally:
+      ProcessCache().TerminateProcess(child)
+
+  def test_child_exits(self):
+    child = subprocess.Popen([sys.executable, "-c", "pass"],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             universal_newlines=True)
+    child.wait()
+    replies = _RunLlvmSymbolizerPipelined(child, ["10", "20"])
+    self.assertEqual(len(replies), 2)
+    self.assertTrue(all(isinstance(reply, IOError) for reply in replies))
+
+class ProcessCacheTests(unittest.TestCase):
+  def test_in_use_process_not_terminated(self):
+    class FakeProcessCache(ProcessCache):
+      _cmd2pipe = {}
+      _lru = []
+      _in_use = collections.Counter()
+      _pipe_locks = {}
+      _PIPE_MAX_OPEN = 2
+      terminated = []
+
+      def SpawnProcess(self, cmd):
+        return cmd[0]
+
+      def TerminateProcess(self, pipe):
+        self.terminated.append(pipe)
+
+    cache = FakeProcessCache()
+    with cache.UseProcess(["a"]):
+      cache.GetProcess(["b"])
+      cache.GetProcess(["c"])
+      cache.GetProcess(["d"])
+    self.assertEqual(cache.terminated, ["b", "c"])
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -22,28 +22,39 @@ The reports must be based on the same build fingerprint.
 """
 
 import argparse
+import concurrent.futures
+import functools
 import os
-import tempfile
-import zipfile
 
 import constant
 import parse_cts_report
+import report_cache
 
 
 def aggregate_cts_reports(report_files,
                           selected_abis=constant.ALL_TEST_ABIS,
-                          ignore_abi=False):
+                          ignore_abi=False,
+                          num_jobs=None,
+                          cache_dir=None):
   """Aggregate all report files and produce information files to output_dir.
 
   If the results of the same test are different in two reports, choose the one
   with a higher priority, following the order: PASS > IGNORED
   > ASSUMPTION_FAILURE > FAIL > TEST_ERROR > TEST_STATUS_UNSPECIFIED.
 
+  The build info of all reports is read and checked first. The reports are
+  then parsed in a process pool, and merged in the order of report_files, so
+  the result does not depend on which report is parsed first.
+
   Args:
     report_files: A list of paths to cts reports.
     ignore_abi: Ignore the tests ABI when doing the aggregation, which means
                 that tests would be considered as the same one as long as they
                 have the same module_name#class_name.test_name.
+    num_jobs: The number of processes to parse the reports, defaults to the
+              number of CPUs.
+    cache_dir: The directory of the cache of parsed reports, see
+               report_cache.py. No cache is used if not specified.
 
   Raises:
     UserWarning: Report files not compatible.
@@ -52,26 +63,38 @@ def aggregate_cts_reports(report_files,
     A dictionary that maps build_fingerprint to a CtsReport object.
   """
 
+  infos = [parse_cts_report.read_report_info(report_file)
+           for report_file in report_files]
   first_report_file = report_files[0]
+  first_report = parse_cts_report.CtsReport(infos[0], selected_abis)
 
-  report = parse_cts_report.parse_report_file(
-      first_report_file, selected_abis, ignore_abi)
+  for report_file, info in zip(report_files, infos):
+    if not first_report.is_compatible(info):
+      msg = (f'{report_file} is incompatible to {first_report_file}.')
+      raise UserWarning(msg)
 
-  with tempfile.TemporaryDirectory() as temp_dir:
+    print(f'Parsing {selected_abis} test results from: ')
+    parse_cts_report.print_test_info(info)
 
-    for report_file in report_files[1:]:
-      xml_path = (
-          parse_cts_report.extract_test_result_from_zip(report_file, temp_dir)
-          if zipfile.is_zipfile(report_file)
-          else report_file)
+  parse = functools.partial(report_cache.parse_report_file,
+                            selected_abis=selected_abis,
+                            ignore_abi=ignore_abi,
+                            cache_dir=cache_dir,
+                            print_info=False)
 
-      test_info = parse_cts_report.get_test_info_xml(xml_path)
+  if num_jobs is None:
+    num_jobs = os.cpu_count() or 1
+  num_jobs = min(num_jobs, len(report_files))
 
-      if not report.is_compatible(test_info):
-        msg = (f'{report_file} is incompatible to {first_report_file}.')
-        raise UserWarning(msg)
+  if num_jobs > 1:
+    with concurrent.futures.ProcessPoolExecutor(num_jobs) as executor:
+      reports = list(executor.map(parse, report_files))
+  else:
+    reports = [parse(report_file) for report_file in report_files]
 
-      report.read_test_result_xml(xml_path, ignore_abi)
+  report = reports[0]
+  for partial_report in reports[1:]:
+    report.merge_report(partial_report)
 
   return report
 
@@ -89,6 +112,11 @@ def main():
   parser.add_argument('--abi', choices=constant.ALL_TEST_ABIS, nargs='*',
                       default=constant.ALL_TEST_ABIS,
                       help='Selected test ABIs to be aggregated.')
+  parser.add_argument('-j', '--jobs', type=int,
+                      help=('Number of processes to parse the reports, '
+                            'defaults to the number of CPUs.'))
+  parser.add_argument('--cache-dir',
+                      help='Directory to cache the parsed reports.')
 
   args = parser.parse_args()
 
@@ -98,7 +126,8 @@ def main():
   if not os.path.exists(output_dir):
     raise FileNotFoundError(f'Output directory {output_dir} does not exist.')
 
-  report = aggregate_cts_reports(report_files, args.abi, args.ignore_abi)
+  report = aggregate_cts_reports(report_files, args.abi, args.ignore_abi,
+                                 args.jobs, args.cache_dir)
   report.output_files(output_dir)
 
 
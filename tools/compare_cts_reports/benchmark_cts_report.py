@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+#
+"""Measure the load time and the memory of a CtsReport.
+
+Compares CtsReport with a report stored in nested dicts, as CtsReport used to
+be. Without a report, a synthetic test_result.xml is generated.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import constant
+import parse_cts_report
+
+
+class DictCtsReport(parse_cts_report.CtsReport):
+  """A CtsReport with the test results in nested dicts."""
+
+  result_tree = None
+
+  def __init__(self, info, selected_abis=constant.ALL_TEST_ABIS):
+    super().__init__(info, selected_abis)
+    self.result_tree = {}
+
+  def gen_rows(self):
+    for module_name, abis in self.result_tree.items():
+      for abi, test_classes in abis.items():
+        for class_name, tests in test_classes.items():
+          for test_name, status in tests.items():
+            yield module_name, abi, class_name, test_name, status
+
+  def get_test_status(self, module_name, abi, class_name, test_name):
+    tests = (self.result_tree.get(module_name, {}).get(abi, {})
+             .get(class_name, {}))
+    return tests.get(test_name, constant.NO_DATA)
+
+  def set_test_status(
+      self, module_name, abi, class_name, test_name, test_status
+  ):
+    previous = self.get_test_status(module_name, abi, class_name, test_name)
+
+    abis = self.result_tree.setdefault(module_name, {})
+    test_classes = abis.setdefault(abi, {})
+    tests = test_classes.setdefault(class_name, {})
+
+    if previous == constant.NO_DATA:
+      tests[test_name] = test_status
+
+      module_summary = self.module_summaries.setdefault(module_name, {})
+      summary = module_summary.setdefault(abi, self.ModuleSummary())
+      summary.counter[test_status] += 1
+
+    elif (self.STATUS_ORDER.index(test_status)
+          < self.STATUS_ORDER.index(previous)):
+      summary = self.module_summaries[module_name][abi]
+
+      tests[test_name] = test_status
+
+      summary.counter[previous] -= 1
+      summary.counter[test_status] += 1
+
+
+def write_test_result_xml(path, num_modules, num_classes, num_tests):
+  """Write a test_result.xml with num_tests tests per class for two ABIs.
+
+  As in real reports, the test names are unique in a module, but the same for
+  both ABIs.
+  """
+
+  rand = random.Random(0)
+  statuses = parse_cts_report.CtsReport.STATUS_ORDER
+  weights = [90, 2, 2, 4, 1, 1]
+
+  with open(path, 'w') as xml_file:
+    xml_file.write(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Result suite_name="CTS" suite_plan="cts" suite_build_number="1" '
+        'suite_version="14_r1">\n'
+        '<Build build_model="model" build_device="device" build_id="1" '
+        'build_version_sdk="34" build_version_security_patch="2023-06-05" '
+        'build_board="board" build_type="userdebug" '
+        'build_version_release="14" build_fingerprint="fingerprint" />\n')
+    for module in range(num_modules):
+      for abi in [constant.ABI_ARM_V8A, constant.ABI_ARM_V7A]:
+        xml_file.write(f'<Module name="CtsModule{module}TestCases" '
+                       f'abi="{abi}" done="true">\n')
+        for test_class in range(num_classes):
+          xml_file.write(f'<TestCase name="android.module{module}.cts.'
+                         f'Class{test_class}Test">\n')
+          results = rand.choices(statuses, weights, k=num_tests)
+          for test, result in enumerate(results):
+            xml_file.write(f'<Test result="{result}" '
+                           f'name="testClass{test_class}Method{test}" />\n')
+          xml_file.write('</TestCase>\n')
+        xml_file.write('</Module>\n')
+    xml_file.write('</Result>\n')
+
+
+def load_report(report_class, report_file):
+  """Parse the report file into a report_class object."""
+
+  with parse_cts_report.open_test_result(report_file) as xml_file:
+    events = parse_cts_report.iterparse_test_result(xml_file)
+    info = parse_cts_report.read_test_info(events, report_file)
+    report = report_class(info)
+    report.read_test_result_events(events)
+  return report
+
+
+def measure(report_class, report_file):
+  """Return the load time, the memory and the csv output of a report."""
+
+  start = time.perf_counter()
+  load_report(report_class, report_file)
+  load_time = time.perf_counter() - start
+
+  gc.collect()
+  tracemalloc.start()
+  report = load_report(report_class, report_file)
+  gc.collect()
+  memory = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+
+  result_csvfile = io.StringIO()
+  summary_csvfile = io.StringIO()
+  report.write_to_csv(result_csvfile, summary_csvfile)
+
+  return (load_time, memory, len(report.gen_keys_list()),
+          (result_csvfile.getvalue(), summary_csvfile.getvalue()))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('report', nargs='?',
+                      help='Path to a cts report (zip or test_result.xml).')
+  parser.add_argument('--modules', type=int, default=200,
+                      help='Number of modules of the synthetic report.')
+  parser.add_argument('--classes', type=int, default=20,
+                      help='Number of classes per module.')
+  parser.add_argument('--tests', type=int, default=50,
+                      help='Number of tests per class.')
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as temp_dir:
+    report_file = args.report
+    if not report_file:
+      report_file = os.path.join(temp_dir, 'test_result.xml')
+      write_test_result_xml(report_file, args.modules, args.classes,
+                            args.tests)
+
+    results = {}
+    for report_class in [DictCtsReport, parse_cts_report.CtsReport]:
+      with contextlib.redirect_stdout(io.StringIO()):
+        results[report_class.__name__] = measure(report_class, report_file)
+
+  expected = results['DictCtsReport']
+  for name, (load_time, memory, num_tests, output) in results.items():
+    if output != expected[3]:
+      raise SystemExit(f'error: {name} output differs from DictCtsReport')
+    print(f'{name:<15} tests: {num_tests}  load: {load_time:.2f}s  '
+          f'memory: {memory / 1e6:.1f} MB')
+
+
+if __name__ == '__main__':
+  main()
@@ -48,6 +48,87 @@ import tempfile
 import aggregate_cts_reports
 import parse_cts_report
 import constant
+import report_cache
+
+
+def name_sort_key(name):
+  """Sort key of a name, where the numbers in names are compared by value."""
+
+  parts = re.split(r'(\d+)', name)
+  parts[1::2] = map(int, parts[1::2])
+  return parts, name
+
+
+def get_name_ranks(reports):
+  """Rank the names of the reports in the order of name_sort_key().
+
+  Returns:
+    4 dicts that map the module names, abis, class names and test names of all
+    the reports to their ranks.
+  """
+
+  name_ranks = []
+  for names_of_reports in zip(*[report.get_names() for report in reports]):
+    names = sorted(set().union(*names_of_reports), key=name_sort_key)
+    name_ranks.append(dict(zip(names, range(len(names)))))
+  return name_ranks
+
+
+def join_reports(report_a, report_b):
+  """Join the tests of two reports with a sort-merge join.
+
+  Both reports generate their tests sorted by name_sort_key() of the names,
+  grouped by module, abi and class. The groups, then the tests of the groups in
+  both reports, are merged in one pass without looking up the tests.
+
+  Yields:
+    (keys, result_in_a, result_in_b) of each test in any report, where keys is
+    (module_name, abi, class_name, test_name), and the result is NO_DATA if
+    the test is not in the report.
+  """
+
+  no_data = constant.NO_DATA
+  name_ranks = get_name_ranks([report_a, report_b])
+  groups_a = report_a.gen_sorted_groups(name_ranks)
+  groups_b = report_b.gen_sorted_groups(name_ranks)
+
+  end = ((), None, None)
+  ranks_a, names_a, tests_a = next(groups_a, end)
+  ranks_b, names_b, tests_b = next(groups_b, end)
+
+  while tests_a is not None or tests_b is not None:
+    if tests_b is None or (tests_a is not None and ranks_a < ranks_b):
+      for _, test_name, result in tests_a:
+        yield names_a + (test_name,), result, no_data
+      ranks_a, names_a, tests_a = next(groups_a, end)
+
+    elif tests_a is None or ranks_b < ranks_a:
+      for _, test_name, result in tests_b:
+        yield names_b + (test_name,), no_data, result
+      ranks_b, names_b, tests_b = next(groups_b, end)
+
+    else:
+      i = j = 0
+      while i < len(tests_a) and j < len(tests_b):
+        rank_a, test_name, result_in_a = tests_a[i]
+        rank_b, _, result_in_b = tests_b[j]
+        if rank_a < rank_b:
+          yield names_a + (test_name,), result_in_a, no_data
+          i += 1
+        elif rank_b < rank_a:
+          yield names_a + (tests_b[j][1],), no_data, result_in_b
+          j += 1
+        else:
+          yield names_a + (test_name,), result_in_a, result_in_b
+          i += 1
+          j += 1
+      for _, test_name, result in tests_a[i:]:
+        yield names_a + (test_name,), result, no_data
+      for _, test_name, result in tests_b[j:]:
+        yield names_a + (test_name,), no_data, result
+
+      ranks_a, names_a, tests_a = next(groups_a, end)
+      ranks_b, names_b, tests_b = next(groups_b, end)
 
 
 def one_way_compare(reports, diff_csv):
@@ -61,28 +142,19 @@ def one_way_compare(reports, diff_csv):
     diff_csv: path to csv which stores comparison results
   """
 
-  report_a = reports[0]
-  report_b = reports[1]
+  fail_statuses = {
+      status for status in parse_cts_report.CtsReport.STATUS_ORDER
+      if parse_cts_report.CtsReport.is_fail(status)
+  }
 
   with open(diff_csv, 'w') as diff_csvfile:
     diff_writer = csv.writer(diff_csvfile)
     diff_writer.writerow(['module_name', 'abi', 'class_name', 'test_name',
                           'result in A', 'result in B'])
 
-    for keys in report_a.gen_keys_list():
-      module_name, abi, class_name, test_name = keys
-      result_in_a = report_a.get_test_status(
-          module_name, abi, class_name, test_name
-      )
-
-      if parse_cts_report.CtsReport.is_fail(result_in_a):
-        result_in_b = report_b.get_test_status(
-            module_name, abi, class_name, test_name
-        )
-
-        diff_writer.writerow(
-            [module_name, abi, class_name, test_name, result_in_a, result_in_b]
-        )
+    for keys, result_in_a, result_in_b in join_reports(*reports):
+      if result_in_a in fail_statuses:
+        diff_writer.writerow(keys + (result_in_a, result_in_b))
 
 
 def two_way_compare(reports, diff_csv):
@@ -97,80 +169,40 @@ def two_way_compare(reports, diff_csv):
     diff_csv: path to csv which stores comparison results
   """
 
-  diff = {}
-
-  for i, report in enumerate(reports):
-    for keys in report.gen_keys_list():
-      module_name, abi, class_name, test_name = keys
-
-      abis = diff.setdefault(module_name, {})
-      test_classes = abis.setdefault(abi, {})
-      tests = test_classes.setdefault(class_name, {})
-
-      result = report.get_test_status(module_name, abi, class_name, test_name)
-
-      if test_name not in tests:
-        tests[test_name] = [constant.NO_DATA, constant.NO_DATA]
-
-      tests[test_name][i] = result
-
   with open(diff_csv, 'w') as diff_csvfile:
     diff_writer = csv.writer(diff_csvfile)
     diff_writer.writerow(['module_name', 'abi', 'class_name', 'test_name',
                           'result in A', 'result in B'])
 
-    for module_name, abis in diff.items():
-      for abi, test_classes in abis.items():
-        for class_name, tests in test_classes.items():
-          for test_name, results in tests.items():
-            if results[0] != results[1]:
-              row = [module_name, abi, class_name, test_name] + results
-              diff_writer.writerow(row)
-
+    for keys, result_in_a, result_in_b in join_reports(*reports):
+      if result_in_a != result_in_b:
+        diff_writer.writerow(keys + (result_in_a, result_in_b))
 
-def gen_summary_row(reports, module_with_abi, item):
-  """Generate one row of diff.csv.
 
-  According to module_with_abi and item, find the value of each report and
-  return as a list.
+def gen_summary_rows(summaries):
+  """Generate the rows of the n-way summary of one report.
 
   Args:
-    reports: list of CtsReport object
-    module_with_abi: combined module_name and abi
-    item: the attribute to find in report
+    summaries: list of CtsReport.ModuleSummary objects, or None if the module
+               is not in the report
 
-  Returns:
-    row: list to write into output file
+  Yields:
+    A list of the values of the items of each module: the counts of the
+    statuses in STATUS_ORDER, then the tested items and the pass rate.
   """
 
-  row = []
-
-  abi_with_bracket = re.findall(r'\[[^\[^\]]+\]$', module_with_abi)[0]
-
-  module_name = module_with_abi.removesuffix(abi_with_bracket)
-  abi = abi_with_bracket[1:-1]
-
-  for report in reports:
-    module_summary = (
-        report.module_summaries[module_name]
-        if module_name in report.module_summaries
-        else {}
-    )
-
-    summary = module_summary[abi] if abi in module_summary else None
+  fail_index = parse_cts_report.CtsReport.FAIL_INDEX
+  no_summary = [0] * len(parse_cts_report.CtsReport.STATUS_ORDER) + [0, 0.0]
 
+  for summary in summaries:
     if not summary:
-      row.append(0.0 if item == constant.PASS_RATE else 0)
-    elif item == constant.TESTED_ITEMS:
-      row.append(summary.tested_items)
-    elif item == constant.PASS_RATE:
-      row.append(summary.pass_rate)
-    elif item in parse_cts_report.CtsReport.STATUS_ORDER:
-      row.append(summary.counter[item])
-    else:
-      raise ValueError(f"Invalid value '{item}' for argument 'item'")
-
-  return row
+      yield no_summary
+      continue
+    values = summary.summary_list()
+    tested_items = sum(values)
+    pass_rate = (sum(values[:fail_index]) / tested_items
+                 if tested_items else 0.0)
+    yield values + [tested_items, pass_rate]
 
 
 def n_way_compare(reports, diff_csv):
@@ -198,7 +230,7 @@ def n_way_compare(reports, diff_csv):
 
     for module_name, abis in report.module_summaries.items():
       for abi, summary in abis.items():
-        module_with_abi = f'{module_name}[{abi}]'
+        module_with_abi = (module_name, abi)
 
         pass_rate = summary.pass_rate
 
@@ -207,28 +239,38 @@ def n_way_compare(reports, diff_csv):
         elif pass_rate < modules_min_rate[module_with_abi]:
           modules_min_rate[module_with_abi] = pass_rate
 
-  module_names = modules_min_rate.keys()
-  module_order = sorted(
-      module_names, key=lambda module_name: modules_min_rate[module_name]
-  )
+  module_order = sorted(modules_min_rate, key=modules_min_rate.__getitem__)
 
   items = parse_cts_report.CtsReport.STATUS_ORDER + [
       constant.TESTED_ITEMS,
       constant.PASS_RATE,
   ]
 
+  # The values of each report, then of each module, then of each item.
+  report_values = [
+      list(gen_summary_rows(
+          report.module_summaries.get(module_name, {}).get(abi)
+          for module_name, abi in module_order))
+      for report in reports
+  ]
+
   with open(diff_csv, 'w') as diff_csvfile:
     diff_writer = csv.writer(diff_csvfile)
     diff_writer.writerow(['module_with_abi', 'item'] + report_titles)
 
-    for module_with_abi in module_order:
-      for item in items:
-        row = gen_summary_row(reports, module_with_abi, item)
-        diff_writer.writerow([module_with_abi, item] + row)
+    for (module_name, abi), module_values in zip(
+        module_order, zip(*report_values)):
+      module_with_abi = f'{module_name}[{abi}]'
+      for item, values in zip(items, zip(*module_values)):
+        diff_writer.writerow([module_with_abi, item] + list(values))
 
 
-def load_parsed_report(report_dir, ignore_abi=False):
-  """Load CtsReport() from a directory that stores a parsed report."""
+def load_parsed_report(report_dir, ignore_abi=False, cache_dir=None):
+  """Load CtsReport() from a directory that stores a parsed report.
+
+  If cache_dir is specified, the report is loaded from the cache of parsed
+  reports when result.csv and info.json did not change.
+  """
 
   if not os.path.isdir(report_dir):
     raise FileNotFoundError(f'{report_dir} is not a directory')
@@ -240,15 +282,19 @@ def load_parsed_report(report_dir, ignore_abi=False):
     if not os.path.exists(f):
       raise FileNotFoundError(f"file {f} doesn't exist.")
 
-  with open(info_path, 'r') as info_jsonfile:
-    info = json.load(info_jsonfile)
+  def parse():
+    with open(info_path, 'r') as info_jsonfile:
+      info = json.load(info_jsonfile)
+
+    report = parse_cts_report.CtsReport(info)
 
-  report = parse_cts_report.CtsReport(info)
+    with open(result_path, 'r') as result_csvfile:
+      report.load_from_csv(result_csvfile, ignore_abi)
 
-  with open(result_path, 'r') as result_csvfile:
-    report.load_from_csv(result_csvfile, ignore_abi)
+    return report
 
-  return report
+  return report_cache.get_report(cache_dir, [info_path, result_path], parse,
+                                 constant.ALL_TEST_ABIS, ignore_abi)
 
 
 def main():
@@ -272,6 +318,9 @@ def main():
                       help='Output parsed csv files.')
   parser.add_argument('--ignore-abi', action='store_true',
                       help='Ignore the tests ABI while comparing.')
+  parser.add_argument('--cache-dir',
+                      help=('Directory to cache the parsed reports, so that '
+                            'they are not parsed again in later runs.'))
 
   args = parser.parse_args()
 
@@ -296,9 +345,10 @@ def main():
 
     if is_report_files:
       report = aggregate_cts_reports.aggregate_cts_reports(
-          report_path, constant.ALL_TEST_ABIS, ignore_abi)
+          report_path, constant.ALL_TEST_ABIS, ignore_abi,
+          cache_dir=args.cache_dir)
     else:
-      report = load_parsed_report(report_path, ignore_abi)
+      report = load_parsed_report(report_path, ignore_abi, args.cache_dir)
 
     if is_report_files and args.output_files:
       device_name = report.info['build_device']
@@ -21,11 +21,12 @@ turns them into three files: info.json, result.csv, and summary.csv.
 """
 
 import argparse
+import array
+import contextlib
 import csv
 import json
 import os
 import shutil
-import tempfile
 import xml.etree.ElementTree as ET
 import zipfile
 import constant
@@ -48,106 +49,351 @@ class CtsReport:
 
   FAIL_INDEX = STATUS_ORDER.index('fail')
 
+  STATUS_CODES = {status: i for i, status in enumerate(STATUS_ORDER)}
+
   def __init__(self, info, selected_abis=constant.ALL_TEST_ABIS):
     self.info = info
     self.selected_abis = selected_abis
-    self.result_tree = {}
     self.module_summaries = {}
 
+    # The names are interned in the tables and referred to by their index.
+    self._module_names = self.NameTable()
+    self._abis = self.NameTable()
+    self._class_names = self.NameTable()
+    self._test_names = self.NameTable()
+
+    # A group is a (module_name, abi, class_name), in the order they are added.
+    self._group_index = {}
+    self._group_modules = array.array('I')
+    self._group_abis = array.array('I')
+    self._group_classes = array.array('I')
+    # The index of (module_name, abi) of the groups, in the order they are
+    # added, so that the tests are listed by module, abi, then class.
+    self._module_abi_index = {}
+    self._group_module_abis = array.array('I')
+    # The index of the tests of each group, test name index -> row. The keys
+    # are the ints of self._test_names, so the index allocates no new objects
+    # for them.
+    self._group_tests = []
+
+    # The status codes of the tests, one row per test in the order they are
+    # added.
+    self._row_statuses = array.array('B')
+
   @staticmethod
   def is_fail(status):
     if status == constant.NO_DATA:
       return False
     else:
-      return CtsReport.STATUS_ORDER.index(status) >= CtsReport.FAIL_INDEX
+      return CtsReport.STATUS_CODES[status] >= CtsReport.FAIL_INDEX
 
-  def gen_keys_list(self):
-    """Generate a 2D-list of keys."""
+  @property
+  def result_tree(self):
+    """The test results as a dict of module_name -> abi -> class_name ->
+    test_name -> status."""
 
-    keys_list = []
+    result_tree = {}
+    for module_name, abi, class_name, test_name, status in self.gen_rows():
+      tests = (result_tree.setdefault(module_name, {})
+               .setdefault(abi, {})
+               .setdefault(class_name, {}))
+      tests[test_name] = status
+    return result_tree
 
-    modules = self.result_tree
+  def __len__(self):
+    return len(self._row_statuses)
 
-    for module_name, abis in modules.items():
-      for abi, test_classes in abis.items():
-        for class_name, tests in test_classes.items():
-          for test_name in tests.keys():
-            keys_list.append([module_name, abi, class_name, test_name])
+  def gen_rows(self):
+    """Generate (module_name, abi, class_name, test_name, status) of the tests.
 
-    return keys_list
+    The tests are grouped by module, abi and class, in the order they are first
+    added, and are in the order they are added within a class.
+    """
 
-  def is_compatible(self, info):
-    return self.info['build_fingerprint'] == info['build_fingerprint']
+    group_order = sorted(
+        range(len(self._group_tests)),
+        key=lambda group: (self._group_modules[group],
+                           self._group_module_abis[group], group))
 
-  def get_test_status(self, module_name, abi, class_name, test_name):
-    """Get test status from the CtsReport object."""
+    module_names = self._module_names.names
+    abis = self._abis.names
+    class_names = self._class_names.names
+    test_names = self._test_names.names
+    row_statuses = self._row_statuses
+    status_order = CtsReport.STATUS_ORDER
 
-    if module_name not in self.result_tree:
-      return constant.NO_DATA
-    abis = self.result_tree[module_name]
+    for group in group_order:
+      module_name = module_names[self._group_modules[group]]
+      abi = abis[self._group_abis[group]]
+      class_name = class_names[self._group_classes[group]]
+      for test, row in self._group_tests[group].items():
+        yield (module_name, abi, class_name, test_names[test],
+               status_order[row_statuses[row]])
 
-    if abi not in abis:
-      return constant.NO_DATA
-    test_classes = abis[abi]
+  def get_names(self):
+    """Return the lists of module names, abis, class names and test names."""
 
-    if class_name not in test_classes:
-      return constant.NO_DATA
+    return (self._module_names.names, self._abis.names,
+            self._class_names.names, self._test_names.names)
+
+  def gen_sorted_groups(self, name_ranks):
+    """Generate the tests grouped by module, abi and class, sorted by the ranks
+    of their names.
+
+    Args:
+      name_ranks: 4 dicts that map the names of get_names() to their ranks
+
+    Yields:
+      (ranks, (module_name, abi, class_name), tests), where ranks is the tuple
+      of the ranks of the module name, abi and class name, and tests is the
+      list of (rank, test_name, status) of the tests sorted by rank.
+    """
+
+    module_ranks, abi_ranks, class_ranks, test_ranks = [
+        [ranks[name] for name in names]
+        for ranks, names in zip(name_ranks, self.get_names())
+    ]
+
+    group_ranks = [
+        (module_ranks[module], abi_ranks[abi], class_ranks[class_name])
+        for module, abi, class_name in zip(
+            self._group_modules, self._group_abis, self._group_classes)
+    ]
+
+    test_names = self._test_names.names
+    row_statuses = self._row_statuses
+    status_order = CtsReport.STATUS_ORDER
+
+    for group in sorted(range(len(group_ranks)), key=group_ranks.__getitem__):
+      tests = sorted(
+          (test_ranks[test], test_names[test], status_order[row_statuses[row]])
+          for test, row in self._group_tests[group].items())
+      yield (group_ranks[group],
+             (self._module_names.names[self._group_modules[group]],
+              self._abis.names[self._group_abis[group]],
+              self._class_names.names[self._group_classes[group]]),
+             tests)
+
+  def gen_keys_list(self):
+    """Generate a 2D-list of keys."""
+
+    return [[module_name, abi, class_name, test_name]
+            for module_name, abi, class_name, test_name, _ in self.gen_rows()]
+
+  def is_compatible(self, info):
+    return self.info['build_fingerprint'] == info['build_fingerprint']
+
+  def _find_row(self, module_name, abi, class_name, test_name):
+    """Return the row of a test, or None if the test is not in the report."""
 
-    tests = test_classes[class_name]
+    group = self._group_index.get((self._module_names.find(module_name),
+                                   self._abis.find(abi),
+                                   self._class_names.find(class_name)))
+    if group is None:
+      return None
+    return self._group_tests[group].get(self._test_names.find(test_name))
+
+  def get_test_status(self, module_name, abi, class_name, test_name):
+    """Get test status from the CtsReport object."""
 
-    if test_name not in tests:
+    row = self._find_row(module_name, abi, class_name, test_name)
+    if row is None:
       return constant.NO_DATA
 
-    return tests[test_name]
+    return CtsReport.STATUS_ORDER[self._row_statuses[row]]
 
   def set_test_status(
       self, module_name, abi, class_name, test_name, test_status
   ):
     """Set test status to the CtsReport object."""
 
-    previous = self.get_test_status(module_name, abi, class_name, test_name)
+    status = CtsReport.STATUS_CODES[test_status]
 
-    abis = self.result_tree.setdefault(module_name, {})
-    test_classes = abis.setdefault(abi, {})
-    tests = test_classes.setdefault(class_name, {})
+    group_key = (self._module_names.add(module_name),
+                 self._abis.add(abi),
+                 self._class_names.add(class_name))
+    group = self._group_index.get(group_key)
+    if group is None:
+      group = self._add_group(group_key)
 
-    if previous == constant.NO_DATA:
-      tests[test_name] = test_status
+    tests = self._group_tests[group]
+    test = self._test_names.add(test_name)
+    row = tests.get(test)
 
-      module_summary = self.module_summaries.setdefault(module_name, {})
-      summary = module_summary.setdefault(abi, self.ModuleSummary())
+    if row is None:
+      tests[test] = len(self._row_statuses)
+      self._row_statuses.append(status)
+
+      summary = self.module_summaries[module_name][abi]
       summary.counter[test_status] += 1
 
-    elif (CtsReport.STATUS_ORDER.index(test_status)
-          < CtsReport.STATUS_ORDER.index(previous)):
+    elif status < self._row_statuses[row]:
       summary = self.module_summaries[module_name][abi]
 
-      tests[test_name] = test_status
+      previous = CtsReport.STATUS_ORDER[self._row_statuses[row]]
+      self._row_statuses[row] = status
 
       summary.counter[previous] -= 1
       summary.counter[test_status] += 1
 
+  def _add_group(self, group_key):
+    """Add a (module_name, abi, class_name) group of tests."""
+
+    module, abi, class_name = group_key
+    module_abi = self._module_abi_index.setdefault(
+        (module, abi), len(self._module_abi_index))
+
+    group = self._group_index[group_key] = len(self._group_modules)
+    self._group_modules.append(module)
+    self._group_abis.append(abi)
+    self._group_classes.append(class_name)
+    self._group_module_abis.append(module_abi)
+    self._group_tests.append({})
+
+    module_summary = self.module_summaries.setdefault(
+        self._module_names.names[module], {})
+    module_summary.setdefault(self._abis.names[abi], self.ModuleSummary())
+
+    return group
+
+  def merge_report(self, report):
+    """Merge the test results of another CtsReport object into this one.
+
+    The status of a test in both reports follows the STATUS_ORDER priority, as
+    if the tests of report were set one by one.
+    """
+
+    for row in report.gen_rows():
+      self.set_test_status(*row)
+
+  def get_columns(self):
+    """Return the report as a dict of plain lists and arrays.
+
+    The tests are in the order of gen_rows(), and from_columns() turns the
+    columns back into a CtsReport object without setting the tests one by one.
+    """
+
+    group_order = sorted(
+        range(len(self._group_tests)),
+        key=lambda group: (self._group_modules[group],
+                           self._group_module_abis[group], group))
+
+    group_sizes = array.array('I')
+    row_tests = array.array('I')
+    row_statuses = array.array('B')
+    for group in group_order:
+      tests = self._group_tests[group]
+      group_sizes.append(len(tests))
+      row_tests.extend(tests.keys())
+      row_statuses.extend(map(self._row_statuses.__getitem__, tests.values()))
+
+    def group_column(column):
+      return array.array(column.typecode, map(column.__getitem__, group_order))
+
+    summaries = [(module_name, abi, summary.summary_list())
+                 for module_name, abis in self.module_summaries.items()
+                 for abi, summary in abis.items()]
+
+    return {
+        'info': self.info,
+        'selected_abis': list(self.selected_abis),
+        'module_names': self._module_names.names,
+        'abis': self._abis.names,
+        'class_names': self._class_names.names,
+        'test_names': self._test_names.names,
+        'group_modules': group_column(self._group_modules),
+        'group_abis': group_column(self._group_abis),
+        'group_classes': group_column(self._group_classes),
+        'group_sizes': group_sizes,
+        'row_tests': row_tests,
+        'row_statuses': row_statuses,
+        'summaries': summaries,
+    }
+
+  @classmethod
+  def from_columns(cls, columns):
+    """Create a CtsReport object from the columns of get_columns()."""
+
+    report = cls(columns['info'], columns['selected_abis'])
+
+    for table, names in [(report._module_names, columns['module_names']),
+                         (report._abis, columns['abis']),
+                         (report._class_names, columns['class_names']),
+                         (report._test_names, columns['test_names'])]:
+      table.names = names
+      table.indices = dict(zip(names, range(len(names))))
+
+    report._group_modules = columns['group_modules']
+    report._group_abis = columns['group_abis']
+    report._group_classes = columns['group_classes']
+    report._group_index = dict(zip(
+        zip(report._group_modules, report._group_abis, report._group_classes),
+        range(len(report._group_modules))))
+
+    # The groups are in order, so the (module_name, abi) of each group is in
+    # order too.
+    report._group_module_abis = array.array('I')
+    for group_key in zip(report._group_modules, report._group_abis):
+      report._group_module_abis.append(report._module_abi_index.setdefault(
+          group_key, len(report._module_abi_index)))
+
+    row_tests = columns['row_tests']
+    start = 0
+    for size in columns['group_sizes']:
+      end = start + size
+      report._group_tests.append(dict(zip(row_tests[start:end],
+                                          range(start, end))))
+      start = end
+    report._row_statuses = columns['row_statuses']
+
+    for module_name, abi, summary_list in columns['summaries']:
+      summary = report.ModuleSummary()
+      summary.counter.update(zip(CtsReport.STATUS_ORDER, summary_list))
+      report.module_summaries.setdefault(module_name, {})[abi] = summary
+
+    return report
+
   def read_test_result_xml(self, test_result_path, ignore_abi=False):
-    """Read the result from test_result.xml into a CtsReport object."""
+    """Read the result from test_result.xml into a CtsReport object.
 
-    tree = ET.parse(test_result_path)
-    root = tree.getroot()
+    Args:
+      test_result_path: path to test_result.xml, or a file object of it
+      ignore_abi: if specified, load the test ABI name as constant.ABI_IGNORED
+    """
 
-    for module in root.iter('Module'):
-      module_name = module.attrib['name']
-      abi = module.attrib['abi']
-      if abi not in self.selected_abis:
-        continue
-      if ignore_abi:
-        abi = constant.ABI_IGNORED
+    self.read_test_result_events(iterparse_test_result(test_result_path),
+                                 ignore_abi)
+
+  def read_test_result_events(self, events, ignore_abi=False):
+    """Read the result from the events of iterparse_test_result().
 
-      for testcase in module.iter('TestCase'):
-        class_name = testcase.attrib['name']
+    The events may have been partially consumed by read_test_info(), the
+    tests of all the remaining Module elements are read.
+    """
 
-        for test in testcase.iter('Test'):
-          test_name = test.attrib['name']
-          result = test.attrib['result']
-          self.set_test_status(module_name, abi, class_name, test_name, result)
+    module_name = None
+    abi = None
+    class_name = None
+
+    for event, elem in events:
+      tag = elem.tag
+      if event == 'start':
+        if tag == 'Module':
+          module_name = elem.attrib['name']
+          abi = elem.attrib['abi']
+          if abi not in self.selected_abis:
+            module_name = None
+          elif ignore_abi:
+            abi = constant.ABI_IGNORED
+        elif tag == 'TestCase':
+          class_name = elem.attrib['name']
+      elif tag == 'Test':
+        if module_name is not None:
+          attrib = elem.attrib
+          self.set_test_status(module_name, abi, class_name, attrib['name'],
+                               attrib['result'])
+      elif tag == 'Module':
+        module_name = None
 
   def load_from_csv(self, result_csvfile, ignore_abi=False):
     """Read the information of the report from the csv files.
@@ -189,22 +435,18 @@ class CtsReport:
         ['module_name', 'abi', 'class_name', 'test_name', 'result']
     )
 
-    modules = self.result_tree
-
-    for module_name, abis in modules.items():
-      for abi, test_classes in abis.items():
+    previous = None
+    for row in self.gen_rows():
+      module_name, abi = row[:2]
+      if (module_name, abi) != previous:
+        previous = (module_name, abi)
         module_summary = self.module_summaries[module_name][abi]
 
         summary = module_summary.summary_list()
 
-        row = [module_name, abi] + summary
-        summary_writer.writerow(row)
+        summary_writer.writerow([module_name, abi] + summary)
 
-        for class_name, tests in test_classes.items():
-          for test_name, result in tests.items():
-            result_writer.writerow(
-                [module_name, abi, class_name, test_name, result]
-            )
+      result_writer.writerow(row)
 
   def output_files(self, output_dir):
     """Produce output files into the directory."""
@@ -233,6 +475,25 @@ class CtsReport:
 
     return files
 
+  class NameTable:
+    """Interned names, each referred to by its index in the table."""
+
+    def __init__(self):
+      self.names = []
+      self.indices = {}
+
+    def add(self, name):
+      """Return the index of the name, adding it if needed."""
+      index = self.indices.get(name)
+      if index is None:
+        index = self.indices[name] = len(self.names)
+        self.names.append(name)
+      return index
+
+    def find(self, name):
+      """Return the index of the name, or None if it is not in the table."""
+      return self.indices.get(name)
+
   class ModuleSummary:
     """Record the result summary of each (module, abi) pair."""
 
@@ -293,31 +554,72 @@ def parse_attrib_path(attrib_path):
   return tags, attr_name
 
 
-def get_test_info_xml(test_result_path):
-  """Get test info from xml file."""
+def iterparse_test_result(xml_file):
+  """Yield the (event, element) pairs of the start and end events of an xml.
 
-  tree = ET.parse(test_result_path)
-  root = tree.getroot()
+  Each Module element is cleared and removed from the tree after its end event,
+  so the memory used is proportional to one module instead of the whole report.
+
+  Args:
+    xml_file: path to test_result.xml, or a file object of it
+  """
+
+  parents = []
+  for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+    if event == 'start':
+      parents.append(elem)
+      yield event, elem
+    else:
+      parents.pop()
+      yield event, elem
+      if elem.tag == 'Module':
+        elem.clear()
+        if parents:
+          parents[-1].remove(elem)
+
+
+def read_test_info(events, source_path):
+  """Read test info from the events of iterparse_test_result().
+
+  Only the events up to the last element in ATTRS_TO_SHOW are consumed, so the
+  test results can be read from the same events afterwards.
+  """
+
+  wanted = {}
+  for attrib_path in ATTRS_TO_SHOW:
+    tags, attr_name = parse_attrib_path(attrib_path)
+    wanted.setdefault(tuple(tags), []).append(attr_name)
+
+  found = {}
+  path = []
+  for event, elem in events:
+    if event == 'end':
+      path.pop()
+      continue
+    path.append(elem.tag)
+    tags = tuple(path)
+    if tags in wanted and tags not in found:
+      found[tags] = elem.attrib
+      if len(found) == len(wanted):
+        break
 
   test_info = {
       'tool_version': constant.VERSION,
-      'source_path': test_result_path,
+      'source_path': source_path,
   }
 
   for attrib_path in ATTRS_TO_SHOW:
     tags, attr_name = parse_attrib_path(attrib_path)
-    node = root
+    test_info[attr_name] = found[tuple(tags)][attr_name]
 
-    while True:
-      tags = tags[1:]
-      if tags:
-        node = node.find(tags[0])
-      else:
-        break
+  return test_info
 
-    test_info[attr_name] = node.attrib[attr_name]
 
-  return test_info
+def get_test_info_xml(test_result_path):
+  """Get test info from xml file."""
+
+  return read_test_info(iterparse_test_result(test_result_path),
+                        test_result_path)
 
 
 def print_test_info(info):
@@ -336,39 +638,69 @@ def print_test_info(info):
   print()
 
 
+def get_test_result_name_in_zip(myzip, zip_file_path):
+  """Get the name of test_result.xml in the zip file."""
+
+  result_name = 'test_result.xml'
+  result_list = [f for f in myzip.namelist() if result_name in f]
+  if len(result_list) != 1:
+    raise RuntimeError(f'Cannot extract {result_name} from {zip_file_path}, '
+                       f'matched files: {" ".join(result_list)}')
+  return result_list[0]
+
+
 def extract_test_result_from_zip(zip_file_path, dest_dir):
   """Extract test_result.xml from the zip file."""
 
-  result_name = 'test_result.xml'
-  extracted = os.path.join(dest_dir, result_name)
+  extracted = os.path.join(dest_dir, 'test_result.xml')
   with zipfile.ZipFile(zip_file_path) as myzip:
-    result_list = [f for f in myzip.namelist() if result_name in f]
-    if len(result_list) != 1:
-      raise RuntimeError(f'Cannot extract {result_name} from {zip_file_path}, '
-                         f'matched files: {" ".join(result_list)}')
-    with myzip.open(result_list[0]) as source, open(extracted, 'wb') as target:
+    result_name = get_test_result_name_in_zip(myzip, zip_file_path)
+    with myzip.open(result_name) as source, open(extracted, 'wb') as target:
       shutil.copyfileobj(source, target)
   return extracted
 
 
+@contextlib.contextmanager
+def open_test_result(report_file):
+  """Open test_result.xml of a cts report for reading.
+
+  A cts report could be a zip file or test_result.xml. The xml in a zip file is
+  read from the zip member stream without being extracted.
+  """
+
+  if zipfile.is_zipfile(report_file):
+    with zipfile.ZipFile(report_file) as myzip:
+      result_name = get_test_result_name_in_zip(myzip, report_file)
+      with myzip.open(result_name) as xml_file:
+        yield xml_file
+  else:
+    with open(report_file, 'rb') as xml_file:
+      yield xml_file
+
+
+def read_report_info(report_file):
+  """Read the test info of a cts report without reading the test results."""
+
+  with open_test_result(report_file) as xml_file:
+    return read_test_info(iterparse_test_result(xml_file), report_file)
+
+
 def parse_report_file(report_file,
                       selected_abis=constant.ALL_TEST_ABIS,
-                      ignore_abi=False):
+                      ignore_abi=False,
+                      print_info=True):
   """Turn one cts report into a CtsReport object."""
 
-  with tempfile.TemporaryDirectory() as temp_dir:
-    xml_path = (
-        extract_test_result_from_zip(report_file, temp_dir)
-        if zipfile.is_zipfile(report_file)
-        else report_file
-    )
+  with open_test_result(report_file) as xml_file:
+    events = iterparse_test_result(xml_file)
 
-    test_info = get_test_info_xml(xml_path)
-    print(f'Parsing {selected_abis} test results from: ')
-    print_test_info(test_info)
+    test_info = read_test_info(events, report_file)
+    if print_info:
+      print(f'Parsing {selected_abis} test results from: ')
+      print_test_info(test_info)
 
     report = CtsReport(test_info, selected_abis)
-    report.read_test_result_xml(xml_path, ignore_abi)
+    report.read_test_result_events(events, ignore_abi)
 
   return report
 
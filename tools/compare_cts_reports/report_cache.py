@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+#
+"""Cache of parsed cts reports.
+
+A parsed CtsReport is stored in its columnar layout (CtsReport.get_columns())
+in a binary file. The file is keyed by the hash of the report files and by the
+options that change the parsed result, so loading a report that was parsed
+before only costs reading the file.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import constant
+import parse_cts_report
+
+
+# Increase when the columns of CtsReport.get_columns() change.
+CACHE_VERSION = 1
+
+_MAGIC = b'CTSREPORTCACHE'
+
+
+def hash_files(paths):
+  """Return the sha256 hex digest of the contents of the files."""
+
+  digest = hashlib.sha256()
+  for path in paths:
+    file_digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+        file_digest.update(chunk)
+    digest.update(file_digest.digest())
+  return digest.hexdigest()
+
+
+def get_cache_path(cache_dir, report_paths, selected_abis, ignore_abi):
+  """Return the path of the cache file of a report."""
+
+  digest = hashlib.sha256()
+  digest.update(hash_files(report_paths).encode())
+  digest.update(repr((sorted(selected_abis), ignore_abi)).encode())
+  return os.path.join(cache_dir, f'v{CACHE_VERSION}-{digest.hexdigest()}.bin')
+
+
+def load(cache_path):
+  """Load a CtsReport object from a cache file, or None if it is not usable."""
+
+  try:
+    with open(cache_path, 'rb') as cache_file:
+      header = cache_file.read(len(_MAGIC) + 1)
+      if header != _MAGIC + bytes([CACHE_VERSION]):
+        return None
+      columns = pickle.load(cache_file)
+    return parse_cts_report.CtsReport.from_columns(columns)
+  # A corrupted or an incompatible file can fail in many ways, e.g. with a
+  # ValueError or an AttributeError, and the report is just parsed again.
+  except Exception:
+    return None
+
+
+def save(cache_path, report):
+  """Save a CtsReport object to a cache file."""
+
+  cache_dir = os.path.dirname(cache_path)
+  os.makedirs(cache_dir, exist_ok=True)
+
+  cache_file = tempfile.NamedTemporaryFile(dir=cache_dir, delete=False)
+  try:
+    with cache_file:
+      cache_file.write(_MAGIC + bytes([CACHE_VERSION]))
+      pickle.dump(report.get_columns(), cache_file, pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_file.name, cache_path)
+  finally:
+    # Don't leave a partial file behind if the report could not be saved.
+    if os.path.exists(cache_file.name):
+      os.unlink(cache_file.name)
+
+
+def get_report(cache_dir, report_paths, parse, selected_abis, ignore_abi):
+  """Get a report from the cache, or parse it and add it to the cache.
+
+  Args:
+    cache_dir: directory of the cache files, or None to always parse
+    report_paths: paths to the files the report is parsed from
+    parse: function that returns the parsed CtsReport object
+    selected_abis: the ABIs selected when parsing
+    ignore_abi: whether the ABIs are ignored when parsing
+
+  Returns:
+    The CtsReport object.
+  """
+
+  if not cache_dir:
+    return parse()
+
+  cache_path = get_cache_path(cache_dir, report_paths, selected_abis,
+                              ignore_abi)
+  report = load(cache_path)
+  if report is None:
+    report = parse()
+    save(cache_path, report)
+  return report
+
+
+def parse_report_file(report_file,
+                      selected_abis=constant.ALL_TEST_ABIS,
+                      ignore_abi=False,
+                      cache_dir=None,
+                      print_info=True):
+  """Turn one cts report into a CtsReport object, using the cache."""
+
+  report = get_report(
+      cache_dir, [report_file],
+      lambda: parse_cts_report.parse_report_file(report_file, selected_abis,
+                                                 ignore_abi, print_info),
+      selected_abis, ignore_abi)
+  # The cache is keyed by the contents, so the same report may have been
+  # cached from another path.
+  report.info['source_path'] = report_file
+  return report
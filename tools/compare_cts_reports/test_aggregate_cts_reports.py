@@ -14,6 +14,9 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 #
+import io
+import os
+import tempfile
 import unittest
 import aggregate_cts_reports
 
@@ -26,6 +29,34 @@ class TestParse(unittest.TestCase):
 
     self.check_ctsreport(report)
 
+  def test_aggregate_parallel(self):
+    report_files = ['testdata/test_result_1.xml', 'testdata/test_result_2.xml',
+                    'testdata/report.zip']
+    outputs = []
+    for num_jobs in [1, 3]:
+      report = aggregate_cts_reports.aggregate_cts_reports(
+          report_files, num_jobs=num_jobs)
+      result_csvfile = io.StringIO()
+      summary_csvfile = io.StringIO()
+      report.write_to_csv(result_csvfile, summary_csvfile)
+      outputs.append((result_csvfile.getvalue(), summary_csvfile.getvalue()))
+
+    self.check_ctsreport(report)
+    self.assertEqual(outputs[0], outputs[1])
+
+  def test_aggregate_incompatible(self):
+    with open('testdata/test_result_2.xml') as xml_file:
+      content = xml_file.read().replace('this_build_fingerprint',
+                                        'other_build_fingerprint')
+    with tempfile.TemporaryDirectory() as temp_dir:
+      other_report = os.path.join(temp_dir, 'test_result.xml')
+      with open(other_report, 'w') as xml_file:
+        xml_file.write(content)
+
+      with self.assertRaises(UserWarning):
+        aggregate_cts_reports.aggregate_cts_reports(
+            ['testdata/test_result_1.xml', other_report], num_jobs=2)
+
   def check_ctsreport(self, report):
     self.assertEqual(
         report.get_test_status('module_1', 'arm64-v8a', 'testcase_1', 'test_1'),
@@ -20,11 +20,30 @@ import tempfile
 import unittest
 
 import compare_cts_reports
+import constant
 import parse_cts_report
 
 
 class TestParse(unittest.TestCase):
 
+  def test_join_reports(self):
+    report_a = parse_cts_report.CtsReport({})
+    report_b = parse_cts_report.CtsReport({})
+    report_a.set_test_status('module_10', 'abi', 'class', 'test_1', 'pass')
+    report_a.set_test_status('module_9', 'abi', 'class', 'test_10', 'fail')
+    report_a.set_test_status('module_9', 'abi', 'class', 'test_9', 'pass')
+    report_b.set_test_status('module_9', 'abi', 'class', 'test_2', 'pass')
+    report_b.set_test_status('module_9', 'abi', 'class', 'test_10', 'pass')
+    report_b.set_test_status('module_9', 'abi', 'class_2', 'test_1', 'fail')
+
+    self.assertEqual(
+        list(compare_cts_reports.join_reports(report_a, report_b)),
+        [(('module_9', 'abi', 'class', 'test_2'), constant.NO_DATA, 'pass'),
+         (('module_9', 'abi', 'class', 'test_9'), 'pass', constant.NO_DATA),
+         (('module_9', 'abi', 'class', 'test_10'), 'fail', 'pass'),
+         (('module_9', 'abi', 'class_2', 'test_1'), constant.NO_DATA, 'fail'),
+         (('module_10', 'abi', 'class', 'test_1'), 'pass', constant.NO_DATA)])
+
   def test_one_way(self):
     ctsreports = [
         parse_cts_report.parse_report_file('testdata/test_result_1.xml'),
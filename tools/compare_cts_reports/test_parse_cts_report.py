@@ -40,6 +40,31 @@ class TestParse(unittest.TestCase):
 
     self.assertEqual(report.get_test_status(*test_item), 'pass')
 
+  def test_keys_order(self):
+    report = parse_cts_report.CtsReport({})
+    report.set_test_status('module_1', 'abi_1', 'class_1', 'test_1', 'pass')
+    report.set_test_status('module_2', 'abi_1', 'class_1', 'test_1', 'fail')
+    report.set_test_status('module_1', 'abi_2', 'class_1', 'test_1', 'pass')
+    report.set_test_status('module_1', 'abi_1', 'class_2', 'test_2', 'pass')
+    report.set_test_status('module_1', 'abi_1', 'class_1', 'test_3', 'pass')
+    report.set_test_status('module_2', 'abi_1', 'class_1', 'test_1', 'pass')
+
+    self.assertEqual(len(report), 5)
+    self.assertEqual(report.gen_keys_list(), [
+        ['module_1', 'abi_1', 'class_1', 'test_1'],
+        ['module_1', 'abi_1', 'class_1', 'test_3'],
+        ['module_1', 'abi_1', 'class_2', 'test_2'],
+        ['module_1', 'abi_2', 'class_1', 'test_1'],
+        ['module_2', 'abi_1', 'class_1', 'test_1'],
+    ])
+    self.assertEqual(report.result_tree['module_2'],
+                     {'abi_1': {'class_1': {'test_1': 'pass'}}})
+    summary = report.module_summaries['module_2']['abi_1']
+    self.assertEqual(summary.counter['pass'], 1)
+    self.assertEqual(summary.counter['fail'], 0)
+    self.assertEqual(report.get_test_status('module_2', 'abi_2', 'class_1',
+                                            'test_1'), constant.NO_DATA)
+
   def test_select_abi(self):
     report_file = 'testdata/test_result_multiple_abis.xml'
     report_all_abi = parse_cts_report.parse_report_file(report_file)
@@ -66,6 +91,26 @@ class TestParse(unittest.TestCase):
 
     self.check_ctsreport(report)
 
+  def test_iterparse(self):
+    report_file = 'testdata/report.zip'
+    with parse_cts_report.open_test_result(report_file) as xml_file:
+      events = parse_cts_report.iterparse_test_result(xml_file)
+      info = parse_cts_report.read_test_info(events, report_file)
+      self.assertEqual(info['source_path'], report_file)
+      self.assertEqual(info['build_fingerprint'], 'this_build_fingerprint')
+
+      modules = 0
+      for event, elem in events:
+        if event == 'start' and elem.tag == 'Result':
+          self.fail('Result read twice')
+        if event == 'end' and elem.tag == 'Module':
+          modules += 1
+        if event == 'end' and elem.tag == 'Result':
+          root = elem
+
+    self.assertEqual(modules, 3)
+    self.assertEqual(root.findall('Module'), [])
+
   def check_ctsreport(self, report):
     self.assertEqual(
         report.get_test_status('module_1', 'arm64-v8a', 'testcase_1', 'test_1'),
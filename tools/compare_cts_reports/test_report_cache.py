@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+#
+
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import compare_cts_reports
+import constant
+import parse_cts_report
+import report_cache
+
+
+def write_csv(report):
+  result_csvfile = io.StringIO()
+  summary_csvfile = io.StringIO()
+  report.write_to_csv(result_csvfile, summary_csvfile)
+  return result_csvfile.getvalue(), summary_csvfile.getvalue()
+
+
+class TestReportCache(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+
+  def get_report(self, report_file, ignore_abi=False):
+    parsed = []
+
+    def parse():
+      parsed.append(report_file)
+      return parse_cts_report.parse_report_file(report_file,
+                                                ignore_abi=ignore_abi)
+
+    report = report_cache.get_report(self.cache_dir, [report_file], parse,
+                                     constant.ALL_TEST_ABIS, ignore_abi)
+    return report, bool(parsed)
+
+  def test_cache(self):
+    report_file = 'testdata/report.zip'
+    report, parsed = self.get_report(report_file)
+    self.assertTrue(parsed)
+
+    cached_report, parsed = self.get_report(report_file)
+    self.assertFalse(parsed)
+    self.assertEqual(write_csv(report), write_csv(cached_report))
+    self.assertEqual(report.info, cached_report.info)
+    self.assertEqual(
+        cached_report.get_test_status('module_1', 'arm64-v8a', 'testcase_1',
+                                      'test_2'),
+        'fail')
+
+    cached_report, parsed = self.get_report(report_file, ignore_abi=True)
+    self.assertTrue(parsed)
+    self.assertEqual(
+        cached_report.get_test_status('module_1', constant.ABI_IGNORED,
+                                      'testcase_1', 'test_2'),
+        'fail')
+
+  def test_moved_report(self):
+    report_file = os.path.join(self.temp_dir.name, 'test_result.xml')
+    shutil.copy('testdata/test_result_1.xml', report_file)
+    report_cache.parse_report_file(report_file, cache_dir=self.cache_dir)
+
+    report = report_cache.parse_report_file('testdata/test_result_1.xml',
+                                            cache_dir=self.cache_dir)
+    self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+    self.assertEqual(report.info['source_path'], 'testdata/test_result_1.xml')
+
+  def test_invalid_cache(self):
+    report_file = 'testdata/test_result_1.xml'
+    self.get_report(report_file)
+
+    cache_path = report_cache.get_cache_path(
+        self.cache_dir, [report_file], constant.ALL_TEST_ABIS, False)
+    with open(cache_path, 'wb') as cache_file:
+      cache_file.write(b'CTSREPORTCACHE\0')
+
+    report, parsed = self.get_report(report_file)
+    self.assertTrue(parsed)
+    self.assertIsNotNone(report_cache.load(cache_path))
+
+    # A file that unpickles, but not to the columns of a report.
+    with open(cache_path, 'wb') as cache_file:
+      cache_file.write(b'CTSREPORTCACHE' + bytes([report_cache.CACHE_VERSION]))
+      pickle.dump(('not', 'columns'), cache_file)
+    self.assertIsNone(report_cache.load(cache_path))
+
+  def test_save_failure(self):
+    report = parse_cts_report.parse_report_file('testdata/test_result_1.xml')
+    cache_path = os.path.join(self.cache_dir, 'report.bin')
+    report.get_columns = lambda: lambda: None  # Can't be pickled.
+
+    with self.assertRaises(Exception):
+      report_cache.save(cache_path, report)
+    self.assertEqual(os.listdir(self.cache_dir), [])
+
+  def test_parsed_report(self):
+    report = parse_cts_report.parse_report_file('testdata/test_result_1.xml')
+    report_dir = os.path.join(self.temp_dir.name, 'parsed')
+    os.mkdir(report_dir)
+    report.output_files(report_dir)
+
+    loaded = compare_cts_reports.load_parsed_report(report_dir,
+                                                    cache_dir=self.cache_dir)
+    self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    cached = compare_cts_reports.load_parsed_report(report_dir,
+                                                    cache_dir=self.cache_dir)
+    self.assertEqual(write_csv(report), write_csv(loaded))
+    self.assertEqual(write_csv(report), write_csv(cached))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -2,9 +2,11 @@
 
 import argparse
 import datetime
+import heapq
 import re
 import subprocess
 import sys
+import time
 
 import logs
 import ps
@@ -12,42 +14,86 @@ import ps
 DURATION_RE = re.compile("((\\d+)w)?((\\d+)d)?((\\d+)h)?((\\d+)m)?((\\d+)s)?")
 
 class Bucket(object):
-  """Bucket of stats for a particular key managed by the Stats object."""
-  def __init__(self):
+  """Bucket of stats for a particular key managed by the Stats object.
+
+  Only the first log line of the key is kept, as a sample for the report.
+  error is the amount by which count may be overestimated when the Stats
+  object has a limited capacity.
+  """
+  def __init__(self, sample):
     self.count = 0
     self.memory = 0
-    self.lines = []
+    self.error = 0
+    self.sample = sample
 
   def __str__(self):
     return "(%s,%s)" % (self.count, self.memory)
 
 
 class Stats(object):
-  """A group of stats with a particular key, where both memory and count are tracked."""
-  def __init__(self):
+  """A group of stats with a particular key, where both memory and count are tracked.
+
+  With a capacity, at most that many keys are tracked with the Space-Saving
+  algorithm: a new key replaces the key with the lowest count and inherits its
+  count and memory. The keys that occur more often than 1/capacity of the
+  time are always tracked, so the top keys stay accurate in constant memory.
+  """
+  def __init__(self, capacity=None):
     self._data = dict()
+    self._capacity = capacity
+    # Heap of (count, key), may contain stale entries with an old count.
+    self._heap = []
 
   def add(self, key, logLine):
     bucket = self._data.get(key)
     if not bucket:
-      bucket = Bucket()
-      self._data[key] = bucket
+      if self._capacity and len(self._data) >= self._capacity:
+        bucket = self._replaceMin(key, logLine)
+      else:
+        bucket = Bucket(logLine)
+        self._data[key] = bucket
+        if self._capacity:
+          heapq.heappush(self._heap, (0, key))
     bucket.count += 1
     bucket.memory += logLine.memory()
-    bucket.lines.append(logLine)
+
+  def _replaceMin(self, key, logLine):
+    """Evict the key with the lowest count and give its counts to a new bucket."""
+    while True:
+      count, minKey = heapq.heappop(self._heap)
+      minBucket = self._data[minKey]
+      if count == minBucket.count:
+        break
+      heapq.heappush(self._heap, (minBucket.count, minKey))
+    del self._data[minKey]
+    bucket = Bucket(logLine)
+    bucket.count = minBucket.count
+    bucket.memory = minBucket.memory
+    bucket.error = minBucket.count
+    self._data[key] = bucket
+    # The bucket will be counted once more by add().
+    heapq.heappush(self._heap, (bucket.count + 1, key))
+    return bucket
 
   def __iter__(self):
     return self._data.iteritems()
 
+  def __len__(self):
+    return len(self._data)
+
   def data(self):
     return [(key, bucket) for key, bucket in self._data.iteritems()]
 
-  def byCount(self):
+  def byCount(self, n=None):
+    if n:
+      return heapq.nlargest(n, self._data.iteritems(), key=lambda item: item[1].count)
     result = self.data()
     result.sort(lambda a, b: -cmp(a[1].count, b[1].count))
     return result
 
-  def byMemory(self):
+  def byMemory(self, n=None):
+    if n:
+      return heapq.nlargest(n, self._data.iteritems(), key=lambda item: item[1].memory)
     result = self.data()
     result.sort(lambda a, b: -cmp(a[1].memory, b[1].memory))
     return result
@@ -125,6 +171,13 @@ def ParseArgs(argv):
                       help="how long to run for (XdXhXmXs)")
   parser.add_argument("--rawlogs", type=str, nargs=1,
                       help="file to put the rawlogs into")
+  parser.add_argument("--interval", type=int, default=0,
+                      help="print a live report every INTERVAL seconds")
+  parser.add_argument("--process-cache", type=str,
+                      help="file to remember the process and uid names in across runs")
+  parser.add_argument("--max-keys", type=int, default=10000,
+                      help="max number of tags, pids and texts to track, "
+                           "0 to track all of them exactly")
 
   args = parser.parse_args()
 
@@ -136,7 +189,7 @@ def ParseArgs(argv):
 def main(argv):
   args = ParseArgs(argv)
 
-  processes = ps.ProcessSet()
+  processes = ps.ProcessSet(args.process_cache)
 
   if args.rawlogs:
     rawlogs = file(args.rawlogs[0], "w")
@@ -162,20 +215,23 @@ def main(argv):
     infile = logcat.stdout
 
     # Do one update because we know we'll need it, but then don't do it again
-    # if we're not streaming them.
+    # if we're not streaming them. While streaming, new processes are looked up
+    # in the background so that reading the logs never waits for adb.
     processes.Update(True)
     if args.durationSec:
-      processes.doUpdates = True
+      processes.StartRefresher()
 
   totalCount = 0
   totalMemory = 0
-  byTag = Stats()
-  byPid = Stats()
-  byText = Stats()
+  capacity = args.max_keys or None
+  byTag = Stats(capacity)
+  byPid = Stats(capacity)
+  byText = Stats(capacity)
 
   startTime = datetime.datetime.now()
+  nextReport = time.time() + args.interval
 
-  # Read the log lines from the parser and build a big mapping of everything
+  # Read the log lines from the parser and count them without keeping them
   for logLine in logs.ParseLogcat(infile, processes, args.durationSec):
     if rawlogs:
       rawlogs.write("%-10s %s %-6s %-6s %-6s %s/%s: %s\n" %(logLine.buf, logLine.timestamp,
@@ -187,74 +243,72 @@ def main(argv):
     byPid.add(logLine.pid, logLine)
     byText.add(logLine.text, logLine)
 
+    if args.interval and time.time() >= nextReport:
+      nextReport = time.time() + args.interval
+      print "=== Report after %s ===" % FormateTimeDelta(datetime.datetime.now() - startTime)
+      print
+      WriteReport(totalCount, totalMemory, byTag, byPid, byText, processes)
+      print
+      sys.stdout.flush()
+
   endTime = datetime.datetime.now()
 
   # Print the log analysis
 
-  # At this point, everything is loaded, don't bother looking
-  # for new processes
-  processes.doUpdates = False
+  # At this point, everything is loaded, look up the processes that are still
+  # unknown once more and don't bother looking for new processes
+  processes.StopRefresher()
+  processes.ResolveUnknown(update=not args.input)
+  processes.SaveCache()
+
+  WriteReport(totalCount, totalMemory, byTag, byPid, byText, processes)
+
+  print
+  print "Totals"
+  print "------"
+  print "%7d  %s" % (totalCount, FormatMemory(totalMemory))
+
+  print "Actual duration: %s" % FormateTimeDelta(endTime-startTime)
+
+
+def WriteReport(totalCount, totalMemory, byTag, byPid, byText, processes, n=11):
+  """Write the top n tags, processes and duplicates."""
+  if not totalCount:
+    return
 
   print "Top tags by count"
   print "-----------------"
-  i = 0
-  for k,v in byTag.byCount():
+  for k,v in byTag.byCount(n):
     WriteResult(totalCount, totalMemory, v, k)
-    if i >= 10:
-      break
-    i += 1
 
   print
   print "Top tags by memory"
   print "------------------"
-  i = 0
-  for k,v in byTag.byMemory():
+  for k,v in byTag.byMemory(n):
     WriteResult(totalCount, totalMemory, v, k)
-    if i >= 10:
-      break
-    i += 1
 
   print
   print "Top Processes by memory"
   print "-----------------------"
-  i = 0
-  for k,v in byPid.byMemory():
+  for k,v in byPid.byMemory(n):
     WriteResult(totalCount, totalMemory, v,
         "%-8s %s" % (k, processes.FindPid(k).DisplayName()))
-    if i >= 10:
-      break
-    i += 1
 
   print
   print "Top Duplicates by count"
   print "-----------------------"
-  i = 0
-  for k,v in byText.byCount():
-    logLine = v.lines[0]
+  for k,v in byText.byCount(n):
+    logLine = v.sample
     WriteResult(totalCount, totalMemory, v,
         "%s/%s: %s" % (logLine.level, logLine.tag, logLine.text))
-    if i >= 10:
-      break
-    i += 1
 
   print
   print "Top Duplicates by memory"
   print "-----------------------"
-  i = 0
-  for k,v in byText.byCount():
-    logLine = v.lines[0]
+  for k,v in byText.byMemory(n):
+    logLine = v.sample
     WriteResult(totalCount, totalMemory, v,
         "%s/%s: %s" % (logLine.level, logLine.tag, logLine.text))
-    if i >= 10:
-      break
-    i += 1
-
-  print
-  print "Totals"
-  print "------"
-  print "%7d  %s" % (totalCount, FormatMemory(totalMemory))
-
-  print "Actual duration: %s" % FormateTimeDelta(endTime-startTime)
 
 if __name__ == "__main__":
   main(sys.argv)
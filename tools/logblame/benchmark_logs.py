@@ -0,0 +1,149 @@
+#!/usr/bin/env python2.7 -B
+
+"""Measures how fast logs.ParseLogcat parses a logcat.
+
+Compares the parser with the line by line regex parser it replaced, checks
+that both give the same log lines, and compares the memory used by a list of
+LogLine objects and by ParseLogcatColumns. Without a FILE, sample.txt is used.
+"""
+
+import argparse
+import cStringIO
+import os
+import sys
+import time
+
+import logs
+import ps
+
+
+def ReferenceParseLogcatInner(f, processes):
+  """The previous parser, which tries every regex on every line."""
+  buf = None
+  state = logs.STATE_BEGIN
+  logLine = None
+
+  for line in f:
+    if len(line) > 0 and line[-1] == '\n':
+      line = line[0:-1]
+
+    m = logs.BUFFER_BEGIN.match(line) or logs.BUFFER_SWITCH.match(line)
+    if m:
+      if logLine:
+        yield logLine
+        logLine = None
+      buf = m.group(1)
+      state = logs.STATE_BUFFER
+      continue
+
+    m = logs.HEADER.match(line)
+    if m:
+      if logLine:
+        yield logLine
+      logLine = logs.LogLine(buf, m.group(1), m.group(2), m.group(3), m.group(4), m.group(5),
+          m.group(6))
+      logLine.process = processes.FindPid(logLine.pid, logLine.uid)
+      state = logs.STATE_HEADER
+      continue
+
+    m = logs.HEADER_TYPE2.match(line)
+    if m:
+      if logLine:
+        yield logLine
+      logLine = logs.LogLine(buf, m.group(1), "0", m.group(2), m.group(3), m.group(4),
+          m.group(5), m.group(6))
+      logLine.process = processes.FindPid(logLine.pid, logLine.uid)
+      state = logs.STATE_BEGIN
+      continue
+
+    if not len(line):
+      if state == logs.STATE_BLANK:
+        if logLine:
+          logLine.text += "\n"
+      state = logs.STATE_BLANK
+      continue
+
+    if logLine:
+      if state == logs.STATE_HEADER:
+        logLine.text += line
+      elif state == logs.STATE_TEXT:
+        logLine.text += "\n"
+        logLine.text += line
+      elif state == logs.STATE_BLANK:
+        if len(logLine.text):
+          logLine.text += "\n"
+        logLine.text += "\n"
+        logLine.text += line
+    state = logs.STATE_TEXT
+
+  if logLine:
+    yield logLine
+
+
+def Time(func, text):
+  """Return the best time of 3 runs of func over text, and its last result."""
+  best = None
+  for i in range(3):
+    start = time.time()
+    result = func(cStringIO.StringIO(text), ps.ProcessSet())
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best, result
+
+
+def FieldsSize(objects):
+  """Return the total size of the distinct field objects."""
+  seen = {}
+  for obj in objects:
+    seen[id(obj)] = obj
+  return sum(sys.getsizeof(obj) for obj in seen.itervalues())
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("file", metavar="FILE", nargs="?",
+                      default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "sample.txt"),
+                      help="a logcat dump (default: sample.txt)")
+  parser.add_argument("-n", "--repeat", type=int, default=200,
+                      help="number of copies of FILE to parse (default: 200)")
+  args = parser.parse_args()
+
+  with open(args.file) as f:
+    text = f.read() * args.repeat
+  print "bytes: %d" % len(text)
+
+  referenceTime, expected = Time(lambda f, processes:
+      list(ReferenceParseLogcatInner(f, processes)), text)
+  innerTime, actual = Time(lambda f, processes:
+      list(logs.ParseLogcatInner(f, processes)), text)
+  if actual != expected:
+    sys.stderr.write("error: ParseLogcatInner disagrees with the reference parser\n")
+    sys.exit(1)
+  print "log lines: %d" % len(actual)
+  print "reference parser:  %.3fs" % referenceTime
+  print "ParseLogcatInner:  %.3fs (%.1fx, %.1f MB/s)" % (innerTime, referenceTime / innerTime,
+      len(text) / innerTime / 1e6)
+
+  listTime, logLines = Time(lambda f, processes: list(logs.ParseLogcat(f, processes)), text)
+  columnsTime, columns = Time(logs.ParseLogcatColumns, text)
+  print "ParseLogcat:        %.3fs" % listTime
+  print "ParseLogcatColumns: %.3fs" % columnsTime
+
+  listSize = sum(sys.getsizeof(logLine) for logLine in logLines) + sys.getsizeof(logLines)
+  columnsSize = 0
+  for name in logs.LogColumns.FIELDS:
+    if name == "process":
+      continue
+    listSize += FieldsSize(getattr(logLine, name) for logLine in logLines)
+    column = getattr(columns, name)
+    columnsSize += FieldsSize(column) + sys.getsizeof(column)
+  print "LogLine list: %.1f MB" % (listSize / 1e6)
+  print "LogColumns:   %.1f MB" % (columnsSize / 1e6)
+
+
+if __name__ == "__main__":
+  main()
+
+# vim: set ts=2 sw=2 sts=2 tw=100 nocindent autoindent smartindent expandtab:
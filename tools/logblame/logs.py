@@ -1,12 +1,16 @@
 
-import datetime
 import re
+import time
 
 BUFFER_BEGIN = re.compile("^--------- beginning of (.*)$")
 BUFFER_SWITCH = re.compile("^--------- switch to (.*)$")
 HEADER = re.compile("^\\[ (\\d\\d-\\d\\d \\d\\d:\\d\\d:\\d\\d.\\d\\d\\d) +(.+?): *(\\d+): *(\\d+) *([EWIDV])/(.*?) *\\]$")
 HEADER_TYPE2 = re.compile("^(\\d\\d-\\d\\d \\d\\d:\\d\\d:\\d\\d.\\d\\d\\d) *(\\d+) *(\\d+) *([EWIDV]) ([^ :]*?): (.*?)$")
 CHATTY_IDENTICAL = re.compile("^.* identical (\\d+) lines$")
+BUFFER = re.compile("^--------- (?:beginning of|switch to) (.*)$")
+
+# The first characters of the lines that can match BUFFER, HEADER or HEADER_TYPE2.
+LINE_START_CHARS = frozenset("-[0123456789")
 
 STATE_BEGIN = 0
 STATE_BUFFER = 1
@@ -16,6 +20,8 @@ STATE_BLANK = 4
 
 class LogLine(object):
   """Represents a line of android logs."""
+  __slots__ = ("buf", "timestamp", "uid", "pid", "tid", "level", "tag", "text", "process")
+
   def __init__(self, buf=None, timestamp=None, uid=None, pid=None, tid=None, level=None,
       tag=None, text=""):
     self.buf = buf
@@ -57,126 +63,192 @@ class LogLine(object):
     return 32 + 8 + len(self.tag) + 1 + len(self.text) + 1
 
 
+class LogColumns(object):
+  """Log lines stored as one list per LogLine field, for analysis of many lines.
+
+  The short repeated fields are interned, so this takes much less memory than
+  a list of LogLine objects.
+  """
+  FIELDS = LogLine.__slots__
+
+  def __init__(self):
+    for name in self.FIELDS:
+      setattr(self, name, [])
+
+  def append(self, logLine):
+    self.buf.append(logLine.buf)
+    self.timestamp.append(logLine.timestamp)
+    self.uid.append(_Intern(logLine.uid))
+    self.pid.append(_Intern(logLine.pid))
+    self.tid.append(_Intern(logLine.tid))
+    self.level.append(logLine.level)
+    self.tag.append(_Intern(logLine.tag))
+    self.text.append(logLine.text)
+    self.process.append(logLine.process)
+
+  def __len__(self):
+    return len(self.text)
+
+  def __getitem__(self, i):
+    logLine = LogLine(self.buf[i], self.timestamp[i], self.uid[i], self.pid[i], self.tid[i],
+        self.level[i], self.tag[i], self.text[i])
+    logLine.process = self.process[i]
+    return logLine
+
+  def memory(self):
+    """Return the sum of LogLine.memory() of the lines."""
+    return (len(self.text) * (32 + 8 + 1 + 1) + sum(len(tag) for tag in self.tag)
+        + sum(len(text) for text in self.text))
+
+
+def _Intern(s):
+  return intern(s) if type(s) is str else s
+
+
 def ParseLogcat(f, processes, duration=None):
   previous = None
   for logLine in ParseLogcatInner(f, processes, duration):
     if logLine.tag == "chatty" and logLine.level == "I":
       m = CHATTY_IDENTICAL.match(logLine.text)
       if m:
+        timestamp = logLine.timestamp
         for i in range(int(m.group(1))):
           clone = previous.clone()
-          clone.timestamp = logLine.timestamp
+          clone.timestamp = timestamp
           yield clone
         continue
     previous = logLine
     yield logLine
 
 
+def ParseLogcatColumns(f, processes, duration=None):
+  """Parses a file object containing log text and returns a LogColumns object."""
+  columns = LogColumns()
+  for logLine in ParseLogcat(f, processes, duration):
+    columns.append(logLine)
+  return columns
+
+
 def ParseLogcatInner(f, processes, duration=None):
-  """Parses a file object containing log text and returns a list of LogLine objects."""
-  result = []
+  """Parses a file object containing log text and returns a list of LogLine objects.
 
+  Only the lines that start with one of LINE_START_CHARS can be buffer markers
+  or headers, so the regexes are only tried on those. The other lines after a
+  header are collected as they are and turned into the text of the log line
+  once it is complete.
+  """
   buf = None
-  timestamp = None
-  uid = None
-  pid = None
-  tid = None
-  level = None
-  tag = None
-
-  state = STATE_BEGIN
+
   logLine = None
-  previous = None
+  # The state after the header of logLine, and the raw lines after it.
+  headerState = STATE_BEGIN
+  lines = None
+  # {pid: Process}, the processes never change once found.
+  pidProcesses = {}
+
+  headerMatch = HEADER.match
+  header2Match = HEADER_TYPE2.match
+  bufferMatch = BUFFER.match
+  findPid = processes.FindPid
 
   if duration:
-    endTime = datetime.datetime.now() + datetime.timedelta(seconds=duration)
+    endTime = time.time() + duration
 
   # TODO: use a nonblocking / timeout read so we stop if there are
   # no logs coming out (haha joke, right!)
   for line in f:
-    if duration and endTime <= datetime.datetime.now():
+    if duration and endTime <= time.time():
       break
 
-    if len(line) > 0 and line[-1] == '\n':
-      line = line[0:-1]
-
-    m = BUFFER_BEGIN.match(line)
-    if m:
-      if logLine:
-        yield logLine
-        logLine = None
-      buf = m.group(1)
-      state = STATE_BUFFER
-      continue
+    first = line[:1]
+    if first in LINE_START_CHARS:
+      if first == "[":
+        m = headerMatch(line)
+      elif first == "-":
+        m = bufferMatch(line)
+      else:
+        m = header2Match(line)
+      if m:
+        if logLine:
+          if lines:
+            # Most log lines have one line of text and a blank line.
+            if headerState == STATE_HEADER and len(lines) == 2 and lines[1] == "\n" and \
+                lines[0] != "\n":
+              logLine.text = lines[0][:-1]
+            else:
+              logLine.text = _JoinText(logLine.text, "".join(lines), headerState)
+          yield logLine
+          logLine = None
+
+        if first == "[":
+          timestamp, uid, pid, tid, level, tag = m.groups()
+          logLine = LogLine(buf, timestamp, uid, pid, tid, level, tag)
+          headerState = STATE_HEADER
+        elif first == "-":
+          buf = m.group(1)
+          continue
+        else:
+          timestamp, pid, tid, level, tag, text = m.groups()
+          uid = "0"
+          logLine = LogLine(buf, timestamp, uid, pid, tid, level, tag, text)
+          headerState = STATE_BEGIN
+        process = pidProcesses.get(pid)
+        if process is None:
+          process = pidProcesses[pid] = findPid(pid, uid)
+        logLine.process = process
+        lines = []
+        continue
 
-    m = BUFFER_SWITCH.match(line)
-    if m:
-      if logLine:
-        yield logLine
-        logLine = None
-      buf = m.group(1)
-      state = STATE_BUFFER
-      continue
+    # Lines that are not part of a log line are dropped.
+    if logLine:
+      lines.append(line)
 
-    m = HEADER.match(line)
-    if m:
-      if logLine:
-        yield logLine
-      logLine = LogLine(
-            buf=buf,
-            timestamp=m.group(1),
-            uid=m.group(2),
-            pid=m.group(3),
-            tid=m.group(4),
-            level=m.group(5),
-            tag=m.group(6)
-          )
-      previous = logLine
-      logLine.process = processes.FindPid(logLine.pid, logLine.uid)
-      state = STATE_HEADER
-      continue
+  if logLine:
+    if lines:
+      logLine.text = _JoinText(logLine.text, "".join(lines), headerState)
+    yield logLine
 
-    m = HEADER_TYPE2.match(line)
-    if m:
-      if logLine:
-        yield logLine
-      logLine = LogLine(
-            buf=buf,
-            timestamp=m.group(1),
-            uid="0",
-            pid=m.group(2),
-            tid=m.group(3),
-            level=m.group(4),
-            tag=m.group(5),
-            text=m.group(6)
-          )
-      previous = logLine
-      logLine.process = processes.FindPid(logLine.pid, logLine.uid)
-      state = STATE_BEGIN
-      continue
 
+def _JoinText(text, raw, state):
+  """Return the text of a log line given the text of its header, the raw lines
+  after the header, and the state after the header."""
+  if not raw:
+    return text
+
+  # The common case: text lines, maybe followed by one blank line.
+  if state == STATE_HEADER:
+    body = raw[:-1] if raw == "\n" or raw.endswith("\n\n") else raw
+    if not body.startswith("\n") and "\n\n" not in body:
+      return body[:-1] if body.endswith("\n") else body
+
+  lines = raw.split("\n")
+  if raw.endswith("\n"):
+    lines.pop()
+  hasText = len(text) > 0
+  parts = [text]
+  for line in lines:
     if not len(line):
       if state == STATE_BLANK:
-        if logLine:
-          logLine.text += "\n"
+        parts.append("\n")
+        hasText = True
       state = STATE_BLANK
       continue
 
-    if logLine:
-      if state == STATE_HEADER:
-        logLine.text += line
-      elif state == STATE_TEXT:
-        logLine.text += "\n"
-        logLine.text += line
-      elif state == STATE_BLANK:
-        if len(logLine.text):
-          logLine.text += "\n"
-        logLine.text += "\n"
-        logLine.text += line
+    if state == STATE_HEADER:
+      parts.append(line)
+      hasText = True
+    elif state == STATE_TEXT:
+      parts.append("\n")
+      parts.append(line)
+      hasText = True
+    elif state == STATE_BLANK:
+      if hasText:
+        parts.append("\n")
+      parts.append("\n")
+      parts.append(line)
+      hasText = True
     state = STATE_TEXT
-
-  if logLine:
-    yield logLine
+  return "".join(parts)
 
 
 # vim: set ts=2 sw=2 sts=2 tw=100 nocindent autoindent smartindent expandtab:
@@ -1,6 +1,8 @@
 import csv
+import json
 import re
 import subprocess
+import threading
 
 HEADER_RE = re.compile("USER\\s*PID\\s*PPID\\s*VSIZE\\s*RSS\\s*WCHAN\\s*PC\\s*NAME")
 PROCESS_RE = re.compile("(\\S+)\\s+(\\d+)\\s+(\\d+)\\s+\\d+\\s+\\d+\\s+\\S+\\s+.\\S+\\s+\\S+\\s+(.*)")
@@ -34,43 +36,103 @@ class Uid(object):
     return "Uid(id=%s, name=%s)" % (self.uid, self.name)
 
 class ProcessSet(object):
-  def __init__(self):
+  """The processes and uids of the device, found with ps and dumpsys.
+
+  By default unknown pids are looked up synchronously when doUpdates is set.
+  After StartRefresher(), a background thread polls the device instead and
+  FindPid never blocks on adb: it returns a placeholder Process that is filled
+  in when the pid shows up. With a cachePath, the processes and uids seen in
+  earlier runs name the pids that exited before they could be looked up. The
+  cached processes are only used on the same device since the same boot, and
+  the cached uids on the same device.
+  """
+  _CACHE_VERSION = 2
+
+  def __init__(self, cachePath=None):
     self._processes = dict()
     self._uids = dict()
     self._pidUpdateCount = 0
     self._uidUpdateCount = 0
     self.doUpdates = False
+    self._lock = threading.RLock()
+    self._unknownPids = set()
+    self._refresher = None
+    self._stopEvent = threading.Event()
+    self._wakeEvent = threading.Event()
+    self._cachePath = cachePath
+    self._deviceId = None
+    # Processes and uids from earlier runs: {pid: (uid, uidName, ppid, name)}, {uid: name}
+    self._cachedProcesses = dict()
+    self._cachedUids = dict()
+    if cachePath:
+      self.LoadCache(cachePath)
 
   def Update(self, force=False):
     self.UpdateUids(force)
     self.UpdateProcesses(force)
 
+  def ReadPs(self):
+    """Return the output of ps on the device, or None."""
+    try:
+      return subprocess.check_output(["adb", "shell", "ps"])
+    except (subprocess.CalledProcessError, OSError):
+      return None
+
+  def ReadUids(self):
+    """Return the output of dumpsys package --checkin on the device, or None."""
+    try:
+      return subprocess.check_output(["adb", "shell", "dumpsys", "package", "--checkin"])
+    except (subprocess.CalledProcessError, OSError):
+      return None
+
+  def ReadDeviceId(self):
+    """Return the [serial, boot id] of the device, or None."""
+    try:
+      serial = subprocess.check_output(["adb", "get-serialno"]).strip()
+      bootId = subprocess.check_output(["adb", "shell", "cat",
+                                        "/proc/sys/kernel/random/boot_id"]).strip()
+    except (subprocess.CalledProcessError, OSError):
+      return None
+    if not serial or not bootId:
+      return None
+    return [serial, bootId]
+
   def UpdateProcesses(self, force=False):
     if not (self.doUpdates or force):
       return
     self._pidUpdateCount += 1
-    try:
-      text = subprocess.check_output(["adb", "shell", "ps"])
-    except subprocess.CalledProcessError:
+    text = self.ReadPs()
+    if text is None:
       return # oh well. we won't get the pid
     lines = ParsePs(text)
     for line in lines:
-      if not self._processes.has_key(line[1]):
-        uid = self.FindUid(ParseUid(line[0]))
-        self._processes[line[1]] = Process(uid, line[1], line[2], line[3])
+      process = self._processes.get(line[1])
+      if process and not (process.name is None and line[1] in self._unknownPids):
+        continue
+      uid = self.FindUid(ParseUid(line[0]))
+      with self._lock:
+        process = self._processes.get(line[1])
+        if not process:
+          self._processes[line[1]] = Process(uid, line[1], line[2], line[3])
+        elif line[1] in self._unknownPids:
+          # A placeholder handed out by FindPid, fill it in.
+          process.uid = uid
+          process.ppid = line[2]
+          process.name = line[3]
+          self._unknownPids.discard(line[1])
 
   def UpdateUids(self, force=False):
     if not (self.doUpdates or force):
       return
     self._uidUpdateCount += 1
-    try:
-      text = subprocess.check_output(["adb", "shell", "dumpsys", "package", "--checkin"])
-    except subprocess.CalledProcessError:
+    text = self.ReadUids()
+    if text is None:
       return # oh well. we won't get the pid
     lines = ParseUids(text)
-    for line in lines:
-      if not self._uids.has_key(line[0]):
-        self._uids[line[1]] = Uid(*line)
+    with self._lock:
+      for line in lines:
+        if not self._uids.has_key(line[0]):
+          self._uids[line[1]] = Uid(*line)
 
   def FindPid(self, pid, uid=None):
     """Try to find the Process object for the given pid.
@@ -78,28 +140,127 @@ class ProcessSet(object):
     create a syntheitc Process object, add that to the list, and return that.
     That can only happen after the process has died, and we just missed our
     chance to find it.  The pid won't come back.
+
+    If the refresher is running, the update is left to it and the synthetic
+    Process object is filled in if the pid is found later, or by
+    ResolveUnknown().
     """
-    result = self._processes.get(pid)
-    if not result:
+    with self._lock:
+      result = self._processes.get(pid)
+      if result:
+        return result
+      if self._refresher:
+        self._unknownPids.add(pid)
+        self._wakeEvent.set()
+    if not self._refresher:
       self.UpdateProcesses()
+    with self._lock:
       result = self._processes.get(pid)
       if not result:
         if uid:
           uid = self._uids.get(uid)
         result = Process(uid, pid, None, None)
         self._processes[pid] = result
+        self._unknownPids.add(pid)
     return result
 
   def FindUid(self, uid):
-    result = self._uids.get(uid)
+    with self._lock:
+      result = self._uids.get(uid)
     if not result:
       self.UpdateUids()
-      result = self._uids.get(uid)
-      if not result:
-        result = Uid(uid, uid)
-        self._uids[uid] = result
+      with self._lock:
+        result = self._uids.get(uid)
+        if not result:
+          result = Uid(uid, self._cachedUids.get(uid, uid))
+          self._uids[uid] = result
     return result
 
+  def StartRefresher(self, interval=10, minInterval=1):
+    """Poll the device every interval seconds, or sooner when an unknown pid
+    is seen, but at most once every minInterval seconds."""
+    if self._refresher:
+      return
+    self._stopEvent.clear()
+    self._refresher = threading.Thread(target=self._Refresh, args=(interval, minInterval))
+    self._refresher.daemon = True
+    self._refresher.start()
+
+  def StopRefresher(self):
+    if not self._refresher:
+      return
+    self._stopEvent.set()
+    self._wakeEvent.set()
+    self._refresher.join()
+    self._refresher = None
+
+  def _Refresh(self, interval, minInterval):
+    while not self._stopEvent.is_set():
+      self._wakeEvent.wait(interval)
+      self._wakeEvent.clear()
+      if self._stopEvent.is_set():
+        break
+      self.Update(True)
+      self._stopEvent.wait(minInterval)
+
+  def ResolveUnknown(self, update=True):
+    """Look up the pids that are still unknown, e.g. at report time. The ones
+    that are gone are named from the cache of earlier runs."""
+    if update and self._unknownPids:
+      self.UpdateProcesses(True)
+    with self._lock:
+      for pid in list(self._unknownPids):
+        cached = self._cachedProcesses.get(pid)
+        if cached:
+          process = self._processes[pid]
+          uid, uidName, process.ppid, process.name = cached
+          if uid is not None:
+            process.uid = Uid(uid, uidName)
+      self._unknownPids.clear()
+
+  def LoadCache(self, path):
+    """Load the cache of an earlier run. The pids are reused since the device
+    booted, the uids until the device changes. If the device is unknown, only
+    the uids are used."""
+    self._deviceId = self.ReadDeviceId()
+    try:
+      with open(path) as f:
+        data = json.load(f)
+    except (IOError, ValueError):
+      return
+    if not isinstance(data, dict) or data.get("version") != self._CACHE_VERSION:
+      return
+    cachedId = data.get("device")
+    if self._deviceId and cachedId:
+      if cachedId[0] != self._deviceId[0]:
+        return
+      if cachedId[1] == self._deviceId[1]:
+        self._cachedProcesses = dict((pid, tuple(entry))
+                                     for pid, entry in data.get("pids", {}).iteritems())
+    self._cachedUids = data.get("uids", {})
+
+  def SaveCache(self, path=None):
+    """Save the processes and uids for later runs, merged with the earlier ones."""
+    path = path or self._cachePath
+    if not path:
+      return
+    with self._lock:
+      pids = dict(self._cachedProcesses)
+      for pid, process in self._processes.iteritems():
+        if process.name is not None:
+          uid = process.uid
+          pids[pid] = (uid.uid if uid else None, uid.name if uid else None, process.ppid,
+                       process.name)
+      uids = dict(self._cachedUids)
+      for uid in self._uids.itervalues():
+        uids[uid.uid] = uid.name
+    try:
+      with open(path, "w") as f:
+        json.dump({"version": self._CACHE_VERSION, "device": self._deviceId, "pids": pids,
+                   "uids": uids}, f)
+    except IOError:
+      pass
+
   def UpdateCount(self):
     return (self._pidUpdateCount, self._uidUpdateCount)
 
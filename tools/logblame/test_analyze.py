@@ -1,6 +1,7 @@
 #!/usr/bin/env python2.7 -B
 
 import analyze_logs
+import logs
 
 
 def test_ParseDuration(s, expected):
@@ -8,7 +9,29 @@ def test_ParseDuration(s, expected):
   if actual != expected:
     raise Exception("expected %s, actual %s" % (expected, actual))
 
+def test_Stats(capacity):
+  """Count 10 heavy keys among 1000 keys that occur once."""
+  stats = analyze_logs.Stats(capacity)
+  for i in range(1000):
+    stats.add("rare%d" % i, logs.LogLine(tag="t", text="rare"))
+    stats.add("heavy%d" % (i % 10), logs.LogLine(tag="t", text="heavy"))
+  if capacity and len(stats) > capacity:
+    raise Exception("expected at most %d keys, actual %d" % (capacity, len(stats)))
+  top = stats.byCount(10)
+  actual = sorted(key for key, bucket in top)
+  expected = sorted("heavy%d" % i for i in range(10))
+  if actual != expected:
+    raise Exception("expected %s, actual %s" % (expected, actual))
+  for key, bucket in top:
+    if not bucket.count - bucket.error <= 100 <= bucket.count:
+      raise Exception("count of %s is %d (error %d), expected 100" % (key, bucket.count,
+          bucket.error))
+  if stats.byMemory(1)[0][0] not in expected:
+    raise Exception("expected a heavy key, actual %s" % stats.byMemory(1)[0][0])
+
 def main():
+  test_Stats(None)
+  test_Stats(50)
   test_ParseDuration("1w", 604800)
   test_ParseDuration("1d", 86400)
   test_ParseDuration("1h", 3600)
@@ -150,6 +150,28 @@ def test_normal():
 
 
 
+def test_columns():
+  """Test that the columns give back the parsed log lines."""
+  text = """--------- beginning of main
+[ 03-29 00:46:58.857  1000: 1815: 1816 I/Noisy ]
+Message
+
+03-29 00:46:58.872  1815  1816 W Type2: Other message
+[ 03-29 00:46:58.873  1000: 1815: 1816 I/Noisy ]
+Another message
+
+"""
+  expected = list(logs.ParseLogcat(StringIO.StringIO(text), ps.ProcessSet()))
+  columns = logs.ParseLogcatColumns(StringIO.StringIO(text), ps.ProcessSet())
+  if [columns[i] for i in range(len(columns))] != expected:
+    raise Exception("test failed: columns differ from the log lines")
+  if columns.memory() != sum(logLine.memory() for logLine in expected):
+    raise Exception("test failed: columns memory %d" % columns.memory())
+  if columns.tag[0] is not columns.tag[2]:
+    raise Exception("test failed: tags are not interned")
+
+
+
 def check_parsing(expected, text):
   """Parse the text and see if it parsed as expected."""
   processes = ps.ProcessSet()
@@ -170,6 +192,7 @@ def main():
   test_two_blanks()
   test_chatty()
   test_normal()
+  test_columns()
 
 
 if __name__ == "__main__":
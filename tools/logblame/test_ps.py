@@ -2,6 +2,12 @@
 
 import ps
 
+import os
+import shutil
+import tempfile
+import threading
+import time
+
 
 def test_pids():
   text = """USER      PID   PPID  VSIZE  RSS   WCHAN              PC  NAME
@@ -68,6 +74,93 @@ pkg-usr,0,IbsusL,0,?
     raise Exception("test failed")
 
 
+PS_TEXT = """USER      PID   PPID  VSIZE  RSS   WCHAN              PC  NAME
+root      1     0     10632  776   SyS_epoll_ 0000000000 S /init
+u0_a22    7308  633   1808572 79760 SyS_epoll_ 0000000000 S com.google.android.dialer
+"""
+
+UIDS_TEXT = """pkg,com.google.android.dialer,10022,1,1,1,1
+"""
+
+
+class FakeProcessSet(ps.ProcessSet):
+  """A ProcessSet with a fake device that records the threads calling ps."""
+  def __init__(self, psText, cachePath=None, uidsText="", deviceId=("serial", "boot1")):
+    self.deviceId = list(deviceId) if deviceId else None
+    ps.ProcessSet.__init__(self, cachePath)
+    self.psText = psText
+    self.uidsText = uidsText
+    self.psThreads = []
+
+  def ReadDeviceId(self):
+    return self.deviceId
+
+  def ReadPs(self):
+    self.psThreads.append(threading.current_thread())
+    time.sleep(0.1)
+    return self.psText
+
+  def ReadUids(self):
+    return self.uidsText
+
+
+def test_refresher():
+  """FindPid returns a placeholder without calling adb, filled in later."""
+  processes = FakeProcessSet(PS_TEXT)
+  processes.StartRefresher(interval=10, minInterval=0)
+  try:
+    process = processes.FindPid("7308")
+    if process.name is not None or processes.psThreads:
+      raise Exception("FindPid waited for adb")
+    deadline = time.time() + 5
+    while process.name is None and time.time() < deadline:
+      time.sleep(0.01)
+  finally:
+    processes.StopRefresher()
+  if process.name != "com.google.android.dialer" or process.ppid != "633":
+    raise Exception("process not resolved: %s" % process)
+  if threading.current_thread() in processes.psThreads:
+    raise Exception("ps ran on the parsing thread")
+  if processes.FindPid("7308") is not process:
+    raise Exception("expected the same process")
+
+
+def test_cache():
+  """Processes that exited are named from the cache of an earlier run."""
+  cacheDir = tempfile.mkdtemp()
+  try:
+    cachePath = os.path.join(cacheDir, "processes.json")
+    processes = FakeProcessSet(PS_TEXT, cachePath, UIDS_TEXT)
+    processes.Update(True)
+    processes.SaveCache()
+
+    processes = FakeProcessSet("", cachePath)
+    process = processes.FindPid("7308")
+    if process.name is not None:
+      raise Exception("expected an unknown process, actual %s" % process)
+    processes.ResolveUnknown(update=False)
+    if process.DisplayName() != "com.google.android.dialer":
+      raise Exception("process not resolved from the cache: %s" % process)
+    if processes.psThreads:
+      raise Exception("unexpected ps call")
+
+    # After a reboot the pids are reused, only the uids are still valid.
+    processes = FakeProcessSet("", cachePath, deviceId=("serial", "boot2"))
+    process = processes.FindPid("7308")
+    processes.ResolveUnknown(update=False)
+    if process.name is not None:
+      raise Exception("process resolved from the cache of another boot: %s" % process)
+    if processes.FindUid("10022").name != "com.google.android.dialer":
+      raise Exception("uid not resolved from the cache")
+
+    # Nothing is used on another device.
+    processes = FakeProcessSet("", cachePath, deviceId=("other", "boot1"))
+    if processes.FindUid("10022").name != "10022":
+      raise Exception("uid resolved from the cache of another device")
+  finally:
+    shutil.rmtree(cacheDir)
+
+
 def test_update():
   """Requires an attached device."""
   processes = ps.ProcessSet()
@@ -87,6 +180,8 @@ def test_update():
 def main():
   #test_uids()
   #test_pids()
+  test_refresher()
+  test_cache()
   test_update()
 
 
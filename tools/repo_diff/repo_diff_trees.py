@@ -14,15 +14,170 @@ from __future__ import print_function
 import argparse
 import csv
 import datetime
+import json
 import multiprocessing
 import multiprocessing.pool
 import os
 import re
 import subprocess
+import time
 import xml.etree.ElementTree as et
 import git_commits_not_upstreamed
 
 
+# The git operations mostly wait for the disk and for the git processes, so
+# run more of them than there are CPUs, but not so many that they thrash.
+DEFAULT_JOBS = 2 * multiprocessing.cpu_count()
+
+
+def _to_native(value):
+  """Converts the unicode strings decoded from JSON to str."""
+  if isinstance(value, dict):
+    return {_to_native(k): _to_native(v) for k, v in value.items()}
+  if isinstance(value, list):
+    return [_to_native(v) for v in value]
+  if not isinstance(value, str) and isinstance(value, type(u'')):
+    return value.encode('utf-8')
+  return value
+
+
+class Checkpoint(object):
+  """Records the results of finished tasks so that a rerun skips them.
+
+  The first line of the checkpoint file is a JSON header that identifies the
+  run, e.g. the source trees. A file with another header is ignored and
+  overwritten. Each following line is a JSON list of the stage, the key of
+  the task and its result. The file is appended to as the tasks finish, so
+  the results survive a crash.
+  """
+
+  def __init__(self, path, header=None):
+    self.path = path
+    self.results = {}
+    self._file = None
+
+    if not path:
+      return
+    header_line = json.dumps(header, sort_keys=True) + '\n'
+    line = ''
+    if os.path.exists(path):
+      with open(path) as f:
+        line = f.readline()
+        if line == header_line:
+          for line in f:
+            try:
+              stage, key, result = json.loads(line)
+            except ValueError:
+              # The last line may be cut short by a crash.
+              continue
+            self.results[(stage, key)] = _to_native(result)
+          print('Loaded %d results from checkpoint %s' % (len(self.results),
+                                                          path))
+        else:
+          print('Ignoring checkpoint %s of another run' % path)
+          line = ''
+    if line:
+      self._file = open(path, 'a')
+      if not line.endswith('\n'):
+        self._file.write('\n')
+    else:
+      self._file = open(path, 'w')
+      self._file.write(header_line)
+      self._file.flush()
+
+  def get(self, stage, key):
+    """Returns the result of a task, or None if it did not finish."""
+    return self.results.get((stage, key))
+
+  def add(self, stage, key, result):
+    """Records the result of a finished task."""
+    self.results[(stage, key)] = result
+    if self._file:
+      self._file.write(json.dumps([stage, key, result]) + '\n')
+      self._file.flush()
+
+  def close(self):
+    if self._file:
+      self._file.close()
+      self._file = None
+
+
+class Progress(object):
+  """Prints the progress, the throughput and the time left of a stage."""
+
+  def __init__(self, stage, total, done=0):
+    self.stage = stage
+    self.total = total
+    self.done = done
+    self.skipped = done
+    self.start = time.time()
+
+  def update(self):
+    """Records that one more task is done and prints the progress."""
+    self.done += 1
+    elapsed = max(time.time() - self.start, 1e-6)
+    rate = (self.done - self.skipped) / elapsed
+    eta = datetime.timedelta(seconds=int((self.total - self.done) / rate))
+    print('%s: %d/%d done, %.2f/s, ETA %s' % (
+        self.stage, self.done, self.total, rate, eta))
+
+
+def run_tasks(stage, func, tasks, keys, checkpoint, jobs=None, is_valid=None):
+  """Runs func on each task in a bounded pool of threads.
+
+  The tasks run git commands, so threads are enough to run them in parallel.
+  The tasks with a valid result in the checkpoint are skipped, and the result
+  of each task is recorded in the checkpoint as soon as it finishes.
+
+  Args:
+    stage: A string with the name of the stage in the checkpoint.
+    func: The function to run on each task.
+    tasks: A list of tasks.
+    keys: A list of unique string keys of the tasks.
+    checkpoint: A Checkpoint.
+    jobs: The maximum number of tasks to run at the same time.
+    is_valid: A function of a task and its result in the checkpoint that
+      returns whether the result can be reused. All results are reused if
+      it is None.
+
+  Returns:
+    A list of the results in the order of the tasks.
+  """
+  results = {}
+  pending = []
+  for key, task in zip(keys, tasks):
+    result = checkpoint.get(stage, key)
+    if result is None or (is_valid and not is_valid(task, result)):
+      pending.append((key, task))
+    else:
+      results[key] = result
+
+  if results:
+    print('%s: %d/%d done in a previous run' % (stage, len(results),
+                                               len(tasks)))
+
+  def run(item):
+    key, task = item
+    return key, func(task)
+
+  if pending:
+    progress = Progress(stage, len(tasks), len(results))
+    pool = multiprocessing.pool.ThreadPool(
+        processes=min(jobs or DEFAULT_JOBS, len(pending)))
+    try:
+      for key, result in pool.imap_unordered(run, pending):
+        checkpoint.add(stage, key, result)
+        results[key] = result
+        progress.update()
+    except:
+      pool.terminate()
+      raise
+    pool.close()
+    pool.join()
+
+  return [results[key] for key in keys]
+
+
 def get_projects(source_tree):
   """Retrieve the dict of projects names and paths.
 
@@ -72,6 +227,21 @@ def git(args):
     return subprocess.check_output(command, stderr=devull)
 
 
+def get_revisions(directory):
+  """Returns the shas of HEAD and FETCH_HEAD of a git project.
+
+  Args:
+    directory: A path to the git directory.
+
+  Returns:
+    A list of the shas, or None if FETCH_HEAD does not exist.
+  """
+  try:
+    return git(['-C', directory, 'rev-parse', 'HEAD', 'FETCH_HEAD']).split()
+  except subprocess.CalledProcessError:
+    return None
+
+
 def get_revision_diff_stats(directory, rev_a, rev_b):
   """Retrieves stats of diff between two git revisions.
 
@@ -113,18 +283,21 @@ def get_project_stats(upstream_dir, downstream_dir):
 
   Returns:
     A dict with the count of files modified, lines added
-    and lines removed.
+    and lines removed, and the shas of the downstream HEAD and FETCH_HEAD
+    that were diffed.
   """
   stats = {
       'file': 0,
       'insertion': 0,
       'deletion': 0,
+      'revisions': None,
   }
 
   if upstream_dir and downstream_dir:
     print('Diffing %s vs %s' % (downstream_dir, upstream_dir))
     git(['-C', downstream_dir, 'fetch', '--update-shallow', upstream_dir])
     stats = get_revision_diff_stats(downstream_dir, 'FETCH_HEAD', 'HEAD')
+    stats['revisions'] = get_revisions(downstream_dir)
 
   return stats
 
@@ -230,7 +403,9 @@ def filter_exclusion_list(projects, exclusion_file):
 
 def get_all_projects_stats(upstream_source_tree,
                            downstream_source_tree,
-                           exclusion_file):
+                           exclusion_file,
+                           checkpoint=None,
+                           jobs=None):
   """Finds the stats of all project in a source tree.
 
   Args:
@@ -239,6 +414,8 @@ def get_all_projects_stats(upstream_source_tree,
     downstream_source_tree: A string with the path to the downstream gerrit
       source tree.
     exclusion_file: A string with the path to the exclusion file.
+    checkpoint: A Checkpoint with the stats of the projects already diffed.
+    jobs: The maximum number of projects to diff at the same time.
 
   Returns:
     A list of dicts of matching upstream and downstream projects
@@ -249,15 +426,29 @@ def get_all_projects_stats(upstream_source_tree,
     (upstream_source_tree, downstream_source_tree),
   )
 
-  return multiprocessing.pool.ThreadPool(
-    processes=multiprocessing.cpu_count()
-  ).map(
+  matches = match_projects(upstream_projects, downstream_projects)
+
+  def is_valid(match, stats):
+    # The commits not upstreamed are found from the HEAD and the FETCH_HEAD
+    # of the downstream project, so they must not have moved since the diff.
+    if not stats['revisions']:
+      return True
+    path = downstream_projects.get(match['downstream'])
+    return path and get_revisions(path) == stats['revisions']
+
+  return run_tasks(
+    'Diffing projects',
     lambda match: stats_from_match(
       upstream_projects,
       downstream_projects,
       match,
     ),
-    match_projects(upstream_projects, downstream_projects),
+    matches,
+    [json.dumps([match['upstream'], match['downstream']])
+     for match in matches],
+    checkpoint or Checkpoint(None),
+    jobs,
+    is_valid,
   )
 
 
@@ -366,12 +557,14 @@ def get_commit_stats_in_project(project):
   }
 
 
-def get_all_commits_stats(project_stats):
+def get_all_commits_stats(project_stats, checkpoint=None, jobs=None):
   """Extract commits that have not been upstreamed in all projects.
 
   Args:
     project_stats: A dict of matching upstream and downstream projects
       including stats for projects that matches.
+    checkpoint: A Checkpoint with the commits of the projects already analyzed.
+    jobs: The maximum number of projects to analyze at the same time.
 
   Returns:
     A dict of commits not upstreamed.
@@ -386,9 +579,15 @@ def get_all_commits_stats(project_stats):
       stats['name'] = name
       modified_projects.append(stats)
 
-  pool = multiprocessing.Pool()
-
-  commit_stats = pool.map(get_commit_stats_in_project, modified_projects)
+  commit_stats = run_tasks(
+      'Finding commits',
+      get_commit_stats_in_project,
+      modified_projects,
+      [json.dumps([stats['name'], stats['revisions']])
+       for stats in modified_projects],
+      checkpoint or Checkpoint(None),
+      jobs,
+  )
 
   commit_stats = {stats['name']: stats['stats'] for stats in commit_stats}
 
@@ -468,7 +667,7 @@ def write_project_csv(project_stats, commit_stats, project_output_file):
 
 
 def diff(upstream_source_tree, downstream_source_tree, project_output_file,
-         commit_output_file, exclusions_file):
+         commit_output_file, exclusions_file, checkpoint_file=None, jobs=None):
   """Diff one repo source tree against another.
 
   Args:
@@ -477,11 +676,25 @@ def diff(upstream_source_tree, downstream_source_tree, project_output_file,
     project_output_file: Path to the project output file.
     commit_output_file: Path to the commit output file.
     exclusions_file: Path to exclusions file.
+    checkpoint_file: Path to the checkpoint file. The projects with results
+      in it are not diffed again if their HEAD and FETCH_HEAD did not move,
+      and the new results are added to it. The file is ignored if it was
+      written for other source trees.
+    jobs: The maximum number of projects to process at the same time.
   """
-  project_stats = get_all_projects_stats(upstream_source_tree,
-                                         downstream_source_tree,
-                                         exclusions_file)
-  commit_stats = get_all_commits_stats(project_stats)
+  checkpoint = Checkpoint(checkpoint_file, {
+      'upstream': os.path.abspath(upstream_source_tree),
+      'downstream': os.path.abspath(downstream_source_tree),
+  })
+  try:
+    project_stats = get_all_projects_stats(upstream_source_tree,
+                                           downstream_source_tree,
+                                           exclusions_file,
+                                           checkpoint,
+                                           jobs)
+    commit_stats = get_all_commits_stats(project_stats, checkpoint, jobs)
+  finally:
+    checkpoint.close()
   write_commit_csv(commit_stats, commit_output_file)
   write_project_csv(project_stats, commit_stats, project_output_file)
 
@@ -510,6 +723,20 @@ def main():
       'described in https://docs.python.org/2/howto/regex.html',
       default='',
   )
+  parser.add_argument(
+      '--checkpoint_file',
+      help='Path to a file to record the results of each project. A rerun'
+      ' with the same file skips the projects that already finished.',
+      default='',
+  )
+  parser.add_argument(
+      '-j',
+      '--jobs',
+      type=int,
+      help='Number of projects to process at the same time (default: %d)' %
+      DEFAULT_JOBS,
+      default=DEFAULT_JOBS,
+  )
   args = parser.parse_args()
   upstream_source_tree = os.path.abspath(args.upstream_path)
   downstream_source_tree = os.path.abspath(args.downstream_path)
@@ -518,9 +745,12 @@ def main():
   exclusions_file = ''
   if args.exclusions_file:
     exclusions_file = os.path.abspath(args.exclusions_file)
+  checkpoint_file = ''
+  if args.checkpoint_file:
+    checkpoint_file = os.path.abspath(args.checkpoint_file)
 
   diff(upstream_source_tree, downstream_source_tree, project_output_file,
-       commit_output_file, exclusions_file)
+       commit_output_file, exclusions_file, checkpoint_file, args.jobs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,133 @@
+"""Tests for the checkpoint and the task runner of repo_diff_trees."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+import repo_diff_trees
+
+
+class CheckpointTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp_dir, 'checkpoint.json')
+    self.header = {'upstream': '/up', 'downstream': '/down'}
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_resume(self):
+    checkpoint = repo_diff_trees.Checkpoint(self.path, self.header)
+    checkpoint.add('stage', 'a', {'file': 1})
+    checkpoint.add('stage', 'b', {'file': 2})
+    checkpoint.close()
+
+    checkpoint = repo_diff_trees.Checkpoint(self.path, self.header)
+    self.assertEqual({'file': 1}, checkpoint.get('stage', 'a'))
+    self.assertEqual({'file': 2}, checkpoint.get('stage', 'b'))
+    self.assertIsNone(checkpoint.get('other stage', 'a'))
+    checkpoint.close()
+
+  def test_truncated_line(self):
+    checkpoint = repo_diff_trees.Checkpoint(self.path, self.header)
+    checkpoint.add('stage', 'a', {'file': 1})
+    checkpoint.close()
+    with open(self.path, 'a') as f:
+      f.write('["stage", "b", {"fi')
+
+    checkpoint = repo_diff_trees.Checkpoint(self.path, self.header)
+    self.assertEqual({'file': 1}, checkpoint.get('stage', 'a'))
+    self.assertIsNone(checkpoint.get('stage', 'b'))
+    checkpoint.add('stage', 'c', {'file': 3})
+    checkpoint.close()
+
+    # The record after the truncated line is not lost.
+    checkpoint = repo_diff_trees.Checkpoint(self.path, self.header)
+    self.assertEqual({'file': 1}, checkpoint.get('stage', 'a'))
+    self.assertEqual({'file': 3}, checkpoint.get('stage', 'c'))
+    checkpoint.close()
+
+  def test_other_header(self):
+    checkpoint = repo_diff_trees.Checkpoint(self.path, self.header)
+    checkpoint.add('stage', 'a', {'file': 1})
+    checkpoint.close()
+
+    header = {'upstream': '/up', 'downstream': '/other'}
+    checkpoint = repo_diff_trees.Checkpoint(self.path, header)
+    self.assertIsNone(checkpoint.get('stage', 'a'))
+    checkpoint.close()
+
+    # The file is overwritten for the new header.
+    checkpoint = repo_diff_trees.Checkpoint(self.path, self.header)
+    self.assertIsNone(checkpoint.get('stage', 'a'))
+    checkpoint.close()
+
+  def test_no_path(self):
+    checkpoint = repo_diff_trees.Checkpoint(None)
+    checkpoint.add('stage', 'a', {'file': 1})
+    self.assertEqual({'file': 1}, checkpoint.get('stage', 'a'))
+    checkpoint.close()
+
+
+class RunTasksTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp_dir, 'checkpoint.json')
+    self.calls = []
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def square(self, task):
+    self.calls.append(task)
+    return task * task
+
+  def run_tasks(self, tasks, is_valid=None):
+    checkpoint = repo_diff_trees.Checkpoint(self.path)
+    try:
+      return repo_diff_trees.run_tasks(
+          'Squaring', self.square, tasks, [str(task) for task in tasks],
+          checkpoint, 2, is_valid)
+    finally:
+      checkpoint.close()
+
+  def test_results_in_task_order(self):
+    self.assertEqual([1, 4, 9, 16], self.run_tasks([1, 2, 3, 4]))
+    self.assertEqual([1, 2, 3, 4], sorted(self.calls))
+
+  def test_resume(self):
+    self.run_tasks([1, 2])
+    self.calls = []
+
+    self.assertEqual([1, 4, 9], self.run_tasks([1, 2, 3]))
+    self.assertEqual([3], self.calls)
+
+  def test_resume_after_truncated_line(self):
+    self.run_tasks([1])
+    with open(self.path, 'a') as f:
+      f.write('["Squaring", "2", ')
+    self.calls = []
+
+    self.assertEqual([1, 4, 9], self.run_tasks([1, 2, 3]))
+    self.assertEqual([2, 3], sorted(self.calls))
+    self.calls = []
+
+    self.assertEqual([1, 4, 9], self.run_tasks([1, 2, 3]))
+    self.assertEqual([], self.calls)
+
+  def test_invalid_result(self):
+    self.run_tasks([1, 2])
+    self.calls = []
+
+    is_valid = lambda task, result: task != 2
+    self.assertEqual([1, 4], self.run_tasks([1, 2], is_valid))
+    self.assertEqual([2], self.calls)
+
+
+if __name__ == '__main__':
+  unittest.main()
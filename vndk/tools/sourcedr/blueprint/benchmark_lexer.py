@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (C) 2018 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This script compares the per-token Lexer.lex() loop with Lexer.tokenize()
+over the blueprint files in a directory tree."""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+from blueprint import Lexer, Token
+
+
+def _lex_all(buf):
+    """Tokenize a buffer with Lexer.lex() and collect non-comment non-space
+    tokens."""
+    result = []
+    offset = 0
+    while offset < len(buf):
+        token, end, literal = Lexer.lex(buf, offset)
+        if token != Token.SPACE and token != Token.COMMENT:
+            result.append((token, offset, end, literal))
+        offset = end
+    return result
+
+
+def _tokenize_all(buf):
+    """Tokenize a buffer with Lexer.tokenize()."""
+    return list(Lexer.tokenize(buf))
+
+
+def _read_files(root_dir, file_name):
+    """Read the files with file_name (or all files if file_name is None)
+    under root_dir."""
+    contents = []
+    for basedir, dirnames, filenames in os.walk(root_dir):
+        dirnames[:] = [name for name in dirnames
+                       if name not in {'.git', '.repo'}]
+        for name in filenames:
+            if file_name is None or name == file_name:
+                with open(os.path.join(basedir, name), 'r') as bp_file:
+                    contents.append(bp_file.read())
+    return contents
+
+
+def _parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'root_dir', nargs='?',
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'tests', 'testdata'),
+        help='directory to scan (default: tests/testdata)')
+    parser.add_argument('--file-name',
+                        help='blueprint file name (default: all files)')
+    parser.add_argument('-n', '--repeat', type=int, default=200,
+                        help='number of times to tokenize the files')
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+
+    args = _parse_args()
+
+    contents = _read_files(args.root_dir, args.file_name)
+    if not contents:
+        print('error: no files found in', args.root_dir, file=sys.stderr)
+        sys.exit(1)
+
+    num_tokens = 0
+    for content in contents:
+        tokens = _tokenize_all(content)
+        if tokens != _lex_all(content):
+            print('error: token streams differ', file=sys.stderr)
+            sys.exit(1)
+        num_tokens += len(tokens)
+
+    print('files:', len(contents))
+    print('bytes:', sum(len(content) for content in contents))
+    print('tokens:', num_tokens)
+
+    results = []
+    for name, func in (('lex', _lex_all), ('tokenize', _tokenize_all)):
+        elapsed = min(timeit.repeat(
+            lambda func=func: [func(content) for content in contents],
+            repeat=3, number=args.repeat))
+        results.append(elapsed)
+        print('{:<10} {:.3f}s ({:.0f} tokens/s)'.format(
+            name, elapsed, num_tokens * args.repeat / elapsed))
+
+    print('speedup: {:.2f}x'.format(results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,12 +18,16 @@
 
 """This module implements a Android.bp parser."""
 
+import bisect
 import collections
 import glob
 import itertools
+import multiprocessing
 import os
+import pickle
 import re
 import sys
+import tempfile
 
 
 #------------------------------------------------------------------------------
@@ -117,11 +121,12 @@ class Token(Enum):  # pylint: disable=too-few-public-methods
 class LexerError(ValueError):
     """Lexer error exception class."""
 
-    def __init__(self, buf, pos, message):
+    def __init__(self, buf, pos, message, line_offsets=None):
         """Create a lexer error exception object."""
         super(LexerError, self).__init__(message)
         self.message = message
-        self.line, self.column = Lexer.compute_line_column(buf, pos)
+        self.line, self.column = \
+            Lexer.compute_line_column(buf, pos, line_offsets)
 
 
     def __str__(self):
@@ -149,6 +154,10 @@ class Lexer(object):
         self.literal = None
         self.path = path
 
+        self._tokens = self.tokenize(buf, offset)
+        self._eof = max(offset, len(buf))
+        self._line_offsets = None
+
         self._next()
 
 
@@ -160,28 +169,58 @@ class Lexer(object):
                 self._next()
             else:
                 raise LexerError(self.buf, self.start,
-                                 'unexpected token ' + self.token.name)
+                                 'unexpected token ' + self.token.name,
+                                 self.line_offsets)
 
 
     def _next(self):
         """Read next non-comment non-space token."""
 
-        buf_len = len(self.buf)
-        while self.end < buf_len:
-            self.start = self.end
-            self.token, self.end, self.literal = self.lex(self.buf, self.start)
-            if self.token != Token.SPACE and self.token != Token.COMMENT:
-                return
+        try:
+            self.token, self.start, self.end, self.literal = \
+                next(self._tokens)
+        except StopIteration:
+            self.start = self._eof
+            self.end = self._eof
+            self.token = Token.EOF
+            self.literal = None
 
-        self.start = self.end
-        self.token = Token.EOF
-        self.literal = None
 
+    @property
+    def line_offsets(self):
+        """The start positions of the lines in the buffer (computed on first
+        use)."""
+        if self._line_offsets is None:
+            self._line_offsets = self.compute_line_offsets(self.buf)
+        return self._line_offsets
 
-    @staticmethod
-    def compute_line_column(buf, pos):
+
+    def get_line_column(self, pos):
         """Compute the line number and the column number of a given position in
         the buffer."""
+        return self.compute_line_column(self.buf, pos, self.line_offsets)
+
+
+    @staticmethod
+    def compute_line_offsets(buf):
+        """Compute the start positions of the lines in the buffer."""
+        offsets = [0]
+        pos = buf.find('\n')
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = buf.find('\n', pos + 1)
+        return offsets
+
+
+    @staticmethod
+    def compute_line_column(buf, pos, line_offsets=None):
+        """Compute the line number and the column number of a given position in
+        the buffer.  If line_offsets (from compute_line_offsets()) is given,
+        the line is found with a binary search."""
+
+        if line_offsets is not None:
+            line = bisect.bisect_right(line_offsets, pos)
+            return (line, pos - line_offsets[line - 1] + 1)
 
         prior = buf[0:pos]
         newline_pos = prior.rfind('\n')
@@ -344,6 +383,66 @@ class Lexer(object):
         '(' + pattern + ')' for _, pattern in LEXER_PATTERNS))
 
 
+    # The token patterns used by tokenize().  Unlike LEXER_PATTERNS, the string
+    # pattern matches whole string literals, so that the whole buffer can be
+    # scanned with one finditer() call.  Interpreted strings with escape
+    # sequences are decoded by lex_interpreted_string().
+    STRING_PATTERN = '`[^`]*`|"[^"\\\\\\n]*(?:\\\\.[^"\\\\\\n]*)*"'
+
+
+    TOKEN_PATTERNS = ((Token.STRING, STRING_PATTERN),) + tuple(
+        (token, pattern) for token, pattern in LEXER_PATTERNS
+        if token != Token.STRING)
+
+
+    TOKEN_MATCHER = re.compile('|'.join(
+        '(' + pattern + ')' for _, pattern in TOKEN_PATTERNS))
+
+
+    TOKEN_KINDS = tuple(token for token, _ in TOKEN_PATTERNS)
+
+
+    @classmethod
+    def tokenize(cls, buf, offset=0):
+        """Tokenize buf[offset:] and generate non-comment non-space tokens.
+
+        Args:
+            buf (string) The source code buffer.
+            offset (int) The position to start.
+
+        Yields:
+            Tuples with the token id, the start of the token, the end of the
+            token, and the value for strings or identifiers.
+        """
+
+        token_kinds = cls.TOKEN_KINDS
+        skipped_tokens = (Token.SPACE, Token.COMMENT)
+        pos = offset
+        for match in cls.TOKEN_MATCHER.finditer(buf, offset):
+            start = match.start()
+            if start != pos:
+                break
+            pos = match.end()
+            token = token_kinds[match.lastindex - 1]
+            if token in skipped_tokens:
+                continue
+            if token == Token.STRING:
+                if buf[start] == '"' and '\\' in match.group(match.lastindex):
+                    literal = cls.lex_interpreted_string(buf, start)[1]
+                else:
+                    literal = buf[start + 1:pos - 1]
+            elif token == Token.IDENT or token == Token.INTEGER:
+                literal = match.group(match.lastindex)
+            else:
+                literal = None
+            yield (token, start, pos, literal)
+
+        if pos < len(buf):
+            # finditer() skipped some characters.  Let lex() raise the error.
+            cls.lex(buf, pos)
+            raise LexerError(buf, pos, 'unknown token')
+
+
     @classmethod
     def lex(cls, buf, offset):
         """Tokenize a token from buf[offset].
@@ -560,8 +659,7 @@ class ParseError(ValueError):
         """Create a parser error exception object."""
         super(ParseError, self).__init__(message)
         self.message = message
-        self.line, self.column = \
-            Lexer.compute_line_column(lexer.buf, lexer.start)
+        self.line, self.column = lexer.get_line_column(lexer.start)
 
 
     def __str__(self):
@@ -757,11 +855,29 @@ class RecursiveParser(object):
     _DEFAULT_SUB_NAME = 'Android.bp'
 
 
-    def __init__(self):
-        """Initialize a recursive parser."""
+    # Version of the per-file parse cache format
+    _CACHE_VERSION = 1
+
+
+    def __init__(self, num_jobs=1, cache_path=None):
+        """Initialize a recursive parser.
+
+        If num_jobs is greater than 1, the blueprint files found by scanning
+        the source tree are parsed in a process pool.  If cache_path is
+        specified, the parsed files are kept in a per-file cache keyed by path,
+        mtime, and size, so that only the changed files are re-parsed.
+        """
         self.visited = set()
         self.modules = []
 
+        self.num_jobs = num_jobs
+        self.cache_path = cache_path
+
+        self._pool = None
+        self._pending_files = {}
+        self._cache = {}
+        self._next_cache = {}
+
 
     @staticmethod
     def glob_sub_files(pattern, sub_file_name):
@@ -813,9 +929,75 @@ class RecursiveParser(object):
         return (parser.modules, parser.vars)
 
 
+    def _use_unbound_files(self):
+        """Check whether blueprint files are parsed without the inherited
+        environment (and bound to it afterwards)."""
+        return self.num_jobs > 1 or self.cache_path is not None
+
+
+    def _get_unbound_file(self, path):
+        """Get the pickled unbound parse result of a blueprint file from the
+        process pool, from the cache, or by reading the file."""
+        result = None
+        pending = self._pending_files.pop(path, None)
+        if pending is not None:
+            result = pending.get()
+        if result is None:
+            result = self._cache.get(path)
+            if result is None or result[0] != _get_file_stamp(path):
+                # Read the file in this process so that IOError, LexerError,
+                # and ParseError are raised from here.
+                result = _read_unbound_file(path)
+        self._next_cache[path] = result
+        return result[1]
+
+
+    def _load_file(self, path, env):
+        """Load a blueprint file and return modules and the environment."""
+        if not self._use_unbound_files():
+            return self._read_file(path, env)
+        modules, local_vars = pickle.loads(self._get_unbound_file(path))
+        _bind_var_refs(
+            itertools.chain((attrs for _, attrs in modules),
+                            local_vars.values()), env)
+        sub_env = dict(env)
+        sub_env.update(local_vars)
+        return (modules, sub_env)
+
+
+    def _prefetch_file(self, path):
+        """Start parsing a blueprint file in the process pool unless the file
+        is in the cache and not changed."""
+        if self._pool is None or path in self._pending_files:
+            return
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == _get_file_stamp(path, None):
+            return
+        self._pending_files[path] = self._pool.apply_async(
+            _read_unbound_file_job, (path,))
+
+
+    def _load_cache(self):
+        """Load the per-file parse cache."""
+        try:
+            with open(self.cache_path, 'rb') as cache_file:
+                cache = pickle.load(cache_file)
+        except (IOError, OSError, EOFError, ValueError, pickle.PickleError):
+            return
+        if isinstance(cache, tuple) and len(cache) == 2 and \
+                cache[0] == self._CACHE_VERSION:
+            self._cache = cache[1]
+
+
+    def _save_cache(self):
+        """Save the parse results of the visited files to the cache."""
+        dump_pickle_file((self._CACHE_VERSION, self._next_cache),
+                         self.cache_path)
+
+
     def _parse_file(self, path, env, evaluate):
         """Parse a blueprint file and append to self.modules."""
-        modules, sub_env = self._read_file(path, env)
+        modules, sub_env = self._load_file(path, env)
         if evaluate:
             modules = [(ident, attrs.eval(env)) for ident, attrs in modules]
         self.modules += modules
@@ -851,15 +1033,12 @@ class RecursiveParser(object):
         rootdir = os.path.dirname(path)
         assert rootdir, 'rootdir is empty but must be non-empty'
 
-        envs = [(rootdir, env)]
         assert env is not None
 
-        # Scan directories for all blueprint files
+        # Scan directories for all blueprint files.  The files are handed to
+        # the process pool (if any) while the scan is still in progress.
+        bp_files = []
         for basedir, dirnames, filenames in os.walk(rootdir):
-            # Drop irrelevant environments
-            while not basedir.startswith(envs[-1][0]):
-                envs.pop()
-
             # Filter sub directories
             if '.out-dir' in filenames:
                 # Stop at OUT_DIR
@@ -874,17 +1053,26 @@ class RecursiveParser(object):
                 new_dirnames.append(name)
             dirnames[:] = new_dirnames
 
-            # Parse blueprint files
             if filename in filenames:
-                try:
-                    path = os.path.join(basedir, filename)
-                    sys.stdout.flush()
-                    sub_env = self._parse_file_recursive(path, envs[-1][1],
-                                                         evaluate, False)
-                    assert sub_env is not None
-                    envs.append((basedir, sub_env))
-                except IOError:
-                    pass
+                path = os.path.join(basedir, filename)
+                self._prefetch_file(path)
+                bp_files.append((basedir, path))
+
+        # Parse blueprint files
+        envs = [(rootdir, env)]
+        for basedir, path in bp_files:
+            # Drop irrelevant environments
+            while not basedir.startswith(envs[-1][0]):
+                envs.pop()
+
+            try:
+                sys.stdout.flush()
+                sub_env = self._parse_file_recursive(path, envs[-1][1],
+                                                     evaluate, False)
+                assert sub_env is not None
+                envs.append((basedir, sub_env))
+            except IOError:
+                pass
 
 
     def parse_file(self, path, env=None, evaluate=True,
@@ -898,11 +1086,100 @@ class RecursiveParser(object):
 
         sub_env = self._read_file(path, env)[1]
 
-        if 'subdirs' in sub_env or 'optional_subdirs' in sub_env:
-            self._parse_file_recursive(path, env, evaluate, True)
-        else:
-            self._scan_and_parse_all_file_recursive(
-                default_sub_name, path, env, evaluate)
+        if self.cache_path is not None:
+            self._load_cache()
+
+        if self.num_jobs > 1:
+            self._pool = multiprocessing.Pool(self.num_jobs)
+        try:
+            if 'subdirs' in sub_env or 'optional_subdirs' in sub_env:
+                self._parse_file_recursive(path, env, evaluate, True)
+            else:
+                self._scan_and_parse_all_file_recursive(
+                    default_sub_name, path, env, evaluate)
+        finally:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+            self._pending_files = {}
+
+        if self.cache_path is not None:
+            self._save_cache()
+
+
+def dump_pickle_file(obj, path):
+    """Pickle an object to a file.  The object is written to a temporary file
+    in the same directory, which then replaces the file, so that concurrent
+    writers and readers never see a partial file."""
+    tmp_file = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(path)), delete=False)
+    try:
+        with tmp_file:
+            pickle.dump(obj, tmp_file, pickle.HIGHEST_PROTOCOL)
+        # os.replace() is not available in Python 2, but os.rename() replaces
+        # the file on POSIX systems as well.
+        getattr(os, 'replace', os.rename)(tmp_file.name, path)
+    finally:
+        if os.path.exists(tmp_file.name):
+            os.unlink(tmp_file.name)
+
+
+def _get_file_stamp(path, default=None):
+    """Get the (mtime, size) stamp of a file, or default if the file can't be
+    stat'ed."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return default
+    return (stat.st_mtime, stat.st_size)
+
+
+def _read_unbound_file(path):
+    """Read a blueprint file without any inherited environment and return the
+    file stamp and the pickled (modules, vars) pair."""
+    with open(path, 'r') as bp_file:
+        stat = os.fstat(bp_file.fileno())
+        content = bp_file.read()
+    parser = Parser(Lexer(content, path=path))
+    parser.parse()
+    return ((stat.st_mtime, stat.st_size),
+            pickle.dumps((parser.modules, parser.vars),
+                         pickle.HIGHEST_PROTOCOL))
+
+
+def _read_unbound_file_job(path):
+    """Read a blueprint file in a worker process.  Return None on errors, so
+    that the file is read again (and the error is raised) by the main
+    process."""
+    try:
+        return _read_unbound_file(path)
+    except (IOError, ValueError):
+        return None
+
+
+def _bind_var_refs(exprs, env):
+    """Bind the variable references that were not defined in the file (when
+    they were parsed) to the values in the inherited environment."""
+    visited = set()
+    stack = list(exprs)
+    while stack:
+        expr = stack.pop()
+        if id(expr) in visited:
+            continue
+        visited.add(id(expr))
+        if isinstance(expr, VarRef):
+            if expr.value is None:
+                expr.value = env.get(expr.name)
+            else:
+                stack.append(expr.value)
+        elif isinstance(expr, Concat):
+            stack.append(expr.lhs)
+            stack.append(expr.rhs)
+        elif isinstance(expr, List):
+            stack.extend(expr)
+        elif isinstance(expr, Dict):
+            stack.extend(expr.values())
 
 
 #------------------------------------------------------------------------------
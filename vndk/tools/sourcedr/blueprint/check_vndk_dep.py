@@ -22,73 +22,11 @@ correctness of dependencies."""
 from __future__ import print_function
 
 import argparse
-import itertools
 import sys
 
 import vndk
 
 
-def _check_module_deps(all_libs, llndk_libs, module):
-    """Check the dependencies of a module."""
-
-    bad_deps = set()
-    shared_deps, static_deps, header_deps = module.get_dependencies()
-
-    # Check vendor module dependencies requirements.
-    for dep_name in itertools.chain(shared_deps, static_deps, header_deps):
-        if dep_name in llndk_libs:
-            continue
-        dep_module = all_libs[dep_name]
-        if dep_module.is_vendor():
-            continue
-        if dep_module.is_vendor_available():
-            continue
-        if dep_module.is_vndk():
-            # dep_module is a VNDK-Private module.
-            if not module.is_vendor():
-                # VNDK-Core may link to VNDK-Private.
-                continue
-        bad_deps.add(dep_name)
-
-    # Check VNDK dependencies requirements.
-    if module.is_vndk() and not module.is_vendor():
-        is_vndk_sp = module.is_vndk_sp()
-        for dep_name in shared_deps:
-            if dep_name in llndk_libs:
-                continue
-            dep_module = all_libs[dep_name]
-            if not dep_module.is_vndk():
-                # VNDK must be self-contained.
-                bad_deps.add(dep_name)
-                break
-            if is_vndk_sp and not dep_module.is_vndk_sp():
-                # VNDK-SP must be self-contained.
-                bad_deps.add(dep_name)
-                break
-
-    return bad_deps
-
-
-def _check_modules_deps(module_dicts):
-    """Check the dependencies of modules."""
-
-    all_libs = module_dicts.all_libs
-    llndk_libs = module_dicts.llndk_libs
-
-    # Check the dependencies of modules
-    all_bad_deps = []
-    for name, module in all_libs.items():
-        if not module.has_vendor_variant() and not module.is_vendor():
-            continue
-
-        bad_deps = _check_module_deps(all_libs, llndk_libs, module)
-
-        if bad_deps:
-            all_bad_deps.append((name, sorted(bad_deps)))
-
-    return sorted(all_bad_deps)
-
-
 def _parse_args():
     """Parse command line options."""
     parser = argparse.ArgumentParser()
@@ -96,18 +34,46 @@ def _parse_args():
                         help='path to Android.bp in ANDROID_BUILD_TOP')
     parser.add_argument('--namespace', action='append', default=[''],
                         help='extra module namespaces')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes to parse Android.bp files')
+    parser.add_argument('--cache-file',
+                        help='per-file parse cache (re-parse changed '
+                             'Android.bp files only)')
+    parser.add_argument('--graph-file',
+                        help='module graph file (re-used if the parsed '
+                             'Android.bp files and namespaces are unchanged)')
     return parser.parse_args()
 
 
+def _load_module_graph(args):
+    """Load the module graph from the graph file or create it from the
+    Android.bp files."""
+
+    namespaces = sorted(set(args.namespace))
+
+    if args.graph_file:
+        graph = vndk.ModuleGraph.load(args.graph_file)
+        if graph is not None and graph.namespaces == namespaces and \
+                graph.is_up_to_date():
+            return graph
+
+    graph = vndk.ModuleGraph.create_from_root_bp(
+        args.root_bp, namespaces, args.jobs, args.cache_file)
+
+    if args.graph_file:
+        graph.save(args.graph_file)
+
+    return graph
+
+
 def main():
     """Main function."""
 
     args = _parse_args()
 
-    module_dicts = vndk.ModuleClassifier.create_from_root_bp(
-        args.root_bp, args.namespace)
+    graph = _load_module_graph(args)
 
-    all_bad_deps = _check_modules_deps(module_dicts)
+    all_bad_deps = graph.check_vndk_deps()
     for name, bad_deps in all_bad_deps:
         print('ERROR: {!r} must not depend on {}'.format(name, bad_deps),
               file=sys.stderr)
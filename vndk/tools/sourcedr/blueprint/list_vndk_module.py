@@ -40,6 +40,11 @@ def _parse_args():
                         help='regular expression for the selected directories')
     parser.add_argument('--namespace', action='append', default=[''],
                         help='extra module namespaces')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes to parse Android.bp files')
+    parser.add_argument('--cache-file',
+                        help='per-file parse cache (re-parse changed '
+                             'Android.bp files only)')
     return parser.parse_args()
 
 
@@ -85,7 +90,7 @@ def main():
 
     # Parse Blueprint files and get VNDK libs
     module_dicts = vndk.ModuleClassifier.create_from_root_bp(
-        args.root_bp, args.namespace)
+        args.root_bp, args.namespace, args.jobs, args.cache_file)
 
     root_dir = os.path.dirname(args.root_bp)
 
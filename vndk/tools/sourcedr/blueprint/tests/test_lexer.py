@@ -18,6 +18,7 @@
 
 """This module contains the unit tests to check the Lexer class."""
 
+import os
 import sys
 import unittest
 
@@ -602,5 +603,90 @@ class LexerTest(unittest.TestCase):
         self.assertEqual(lexer.path, 'test_path')
 
 
+#------------------------------------------------------------------------------
+# Lexer.tokenize() test
+#------------------------------------------------------------------------------
+
+def _lex_all(buf, offset=0):
+    """Tokenize a buffer with Lexer.lex() and collect non-comment non-space
+    tokens."""
+    result = []
+    while offset < len(buf):
+        token, end, literal = Lexer.lex(buf, offset)
+        if token not in {Token.SPACE, Token.COMMENT}:
+            result.append((token, offset, end, literal))
+        offset = end
+    return result
+
+
+class TokenizeTest(unittest.TestCase):
+    """Unit tests for the Lexer.tokenize() method."""
+
+    def _check_same_tokens(self, buf, offset=0):
+        """Check whether tokenize() generates the same tokens as lex()."""
+        self.assertEqual(_lex_all(buf, offset),
+                         list(Lexer.tokenize(buf, offset)))
+
+
+    def _check_same_error(self, buf):
+        """Check whether tokenize() raises the same error as lex()."""
+        with self.assertRaises(LexerError) as expected:
+            _lex_all(buf)
+        with self.assertRaises(LexerError) as actual:
+            list(Lexer.tokenize(buf))
+        self.assertEqual(str(expected.exception), str(actual.exception))
+
+
+    def test_tokenize(self):
+        """Test tokens, positions, and literals."""
+        self._check_same_tokens('')
+        self._check_same_tokens('a = ["b", `c\nd`] + -12 // e\n')
+        self._check_same_tokens('m { a: 1, b: (c += d) } /* e\n * f */ ')
+        self._check_same_tokens('"a\\tb\\x41\\101\\u00e9\\"" "" ``')
+        self._check_same_tokens('a b', 2)
+
+
+    def test_tokenize_errors(self):
+        """Test the errors raised from tokenize()."""
+        self._check_same_error('a %')
+        self._check_same_error('a\n"b')
+        self._check_same_error('"a\nb"')
+        self._check_same_error('"\\q"')
+        self._check_same_error('"\\x4"')
+        self._check_same_error('`a')
+        self._check_same_error('a /')
+        self._check_same_error('a /* b')
+
+
+    def test_tokenize_testdata(self):
+        """Test the files in the testdata directory."""
+        testdata_dir = os.path.join(os.path.dirname(__file__), 'testdata')
+        for basedir, _, filenames in os.walk(testdata_dir):
+            for filename in filenames:
+                with open(os.path.join(basedir, filename), 'r') as bp_file:
+                    self._check_same_tokens(bp_file.read())
+
+
+    def test_lexer_error_line_column(self):
+        """Test the line and column of the errors raised from a Lexer."""
+        lexer = Lexer('a\nbc\n d')
+        with self.assertRaises(LexerError) as ctx:
+            lexer.consume(Token.IDENT, Token.IDENT, Token.STRING)
+        self.assertEqual((ctx.exception.line, ctx.exception.column), (3, 2))
+
+
+class LexComputeLineColumnWithOffsets(unittest.TestCase):
+    """Unit tests for Lexer.compute_line_column() with line offsets."""
+
+    def test_compute_line_column(self):
+        """Test whether the binary search gives the same results."""
+        for buf in ('', 'a', '\n', 'ab\ncde\nfg\n', '\n\na\n\nb'):
+            line_offsets = Lexer.compute_line_offsets(buf)
+            for pos in range(len(buf) + 2):
+                self.assertEqual(
+                    Lexer.compute_line_column(buf, pos),
+                    Lexer.compute_line_column(buf, pos, line_offsets))
+
+
 if __name__ == '__main__':
     unittest.main()
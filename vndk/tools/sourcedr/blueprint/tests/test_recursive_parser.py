@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (C) 2018 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the unit tests to check the RecursiveParser class."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from blueprint import RecursiveParser
+
+
+#------------------------------------------------------------------------------
+# Recursive Parser
+#------------------------------------------------------------------------------
+
+class RecursiveParserTest(unittest.TestCase):
+    """Test cases for scanning and parsing a source tree."""
+
+    FILES = {
+        'Android.bp': 'cflags = ["-Wall"]\n'
+                      'cc_library { name: "libroot", cflags: cflags }\n',
+        'a/Android.bp': 'cflags += ["-Werror"]\n'
+                        'cc_library { name: "liba", cflags: cflags }\n',
+        'a/b/Android.bp': 'cc_library {\n'
+                          '    name: "libb",\n'
+                          '    cflags: cflags + ["-O2"],\n'
+                          '}\n',
+        'c/Android.bp': 'cc_library { name: "libc", cflags: cflags }\n',
+        'out/Android.bp': 'cc_library { name: "libout" }\n',
+        'd/.out-dir': '',
+        'd/Android.bp': 'cc_library { name: "libd" }\n',
+        'e/.git/Android.bp': 'cc_library { name: "libgit" }\n',
+    }
+
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        for path, content in self.FILES.items():
+            self._write_file(path, content)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+    def _write_file(self, path, content):
+        path = os.path.join(self.test_dir, path)
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(path, 'w') as bp_file:
+            bp_file.write(content)
+
+
+    def _parse(self, **kwargs):
+        parser = RecursiveParser(**kwargs)
+        parser.parse_file(os.path.join(self.test_dir, 'Android.bp'))
+        return sorted((attrs['name'], list(attrs['cflags']))
+                      for ident, attrs in parser.modules)
+
+
+    def test_scan(self):
+        """Test env inheritance and the pruned directories."""
+        self.assertEqual(
+            [('liba', ['-Wall', '-Werror']),
+             ('libb', ['-Wall', '-Werror', '-O2']),
+             ('libc', ['-Wall']),
+             ('libroot', ['-Wall'])],
+            self._parse())
+
+
+    def test_scan_parallel(self):
+        """Test whether the process pool gives the same modules."""
+        self.assertEqual(self._parse(), self._parse(num_jobs=2))
+
+
+    def test_scan_cache(self):
+        """Test whether the cached files are re-used and the changed files are
+        re-parsed."""
+        cache_path = os.path.join(self.test_dir, 'bp.cache')
+        expected = self._parse()
+
+        self.assertEqual(expected, self._parse(cache_path=cache_path))
+        self.assertTrue(os.path.exists(cache_path))
+        # The temporary file is renamed to the cache file.
+        self.assertFalse([name for name in os.listdir(self.test_dir)
+                          if name.startswith(tempfile.gettempprefix())])
+        self.assertEqual(expected, self._parse(cache_path=cache_path))
+
+        # Change a file and its size.
+        self._write_file('c/Android.bp',
+                         'cflags += ["-g"]\n'
+                         'cc_library { name: "libc", cflags: cflags }\n')
+        self.assertEqual(
+            [('liba', ['-Wall', '-Werror']),
+             ('libb', ['-Wall', '-Werror', '-O2']),
+             ('libc', ['-Wall', '-g']),
+             ('libroot', ['-Wall'])],
+            self._parse(num_jobs=2, cache_path=cache_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (C) 2018 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the unit tests to check the ModuleGraph class."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from vndk import ModuleGraph
+
+
+#------------------------------------------------------------------------------
+# Module Graph
+#------------------------------------------------------------------------------
+
+class ModuleGraphTest(unittest.TestCase):
+    """Test cases for the module graph."""
+
+    ROOT_BP = '''
+        llndk_library { name: "libllndk" }
+
+        cc_library { name: "libllndk" }
+
+        cc_library { name: "libsys" }
+
+        cc_library {
+            name: "libvndk_private",
+            vndk: { enabled: true },
+        }
+
+        cc_library {
+            name: "libvndk",
+            vendor_available: true,
+            vndk: { enabled: true },
+            shared_libs: ["libllndk", "libvndk_private", "libsys"],
+        }
+        '''
+
+    SUB_BP = '''
+        cc_library {
+            name: "libvndk_sp",
+            vendor_available: true,
+            vndk: { enabled: true, support_system_process: true },
+            shared_libs: ["libvndk"],
+        }
+
+        cc_library {
+            name: "libvendor",
+            vendor: true,
+            shared_libs: ["libvndk_private", "libvndk"],
+            static_libs: ["libsys"],
+            target: { vendor: { exclude_static_libs: ["libsys"] } },
+        }
+        '''
+
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.root_bp = os.path.join(self.test_dir, 'Android.bp')
+        self.sub_bp = os.path.join(self.test_dir, 'sub', 'Android.bp')
+        os.mkdir(os.path.dirname(self.sub_bp))
+        with open(self.root_bp, 'w') as bp_file:
+            bp_file.write(self.ROOT_BP)
+        with open(self.sub_bp, 'w') as bp_file:
+            bp_file.write(self.SUB_BP)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+    def test_flags(self):
+        """Test the classification flags."""
+        graph = ModuleGraph.create_from_root_bp(self.root_bp)
+        self.assertEqual(ModuleGraph.DEFINED | ModuleGraph.LLNDK,
+                         graph.get_flags('libllndk'))
+        self.assertEqual(ModuleGraph.DEFINED | ModuleGraph.VNDK |
+                         ModuleGraph.VNDK_SP | ModuleGraph.VENDOR_AVAILABLE,
+                         graph.get_flags('libvndk_sp'))
+        self.assertEqual(ModuleGraph.DEFINED | ModuleGraph.VENDOR,
+                         graph.get_flags('libvendor'))
+
+
+    def test_deps(self):
+        """Test the direct and transitive dependencies."""
+        graph = ModuleGraph.create_from_root_bp(self.root_bp)
+        self.assertEqual(['libllndk', 'libsys', 'libvndk_private'],
+                         graph.get_deps('libvndk'))
+        self.assertEqual(['libvndk', 'libvndk_private'],
+                         graph.get_deps('libvendor'))
+        self.assertEqual([], graph.get_deps('libvendor', [ModuleGraph.STATIC]))
+        self.assertEqual(
+            ['libllndk', 'libsys', 'libvndk', 'libvndk_private'],
+            graph.get_transitive_deps('libvndk_sp', [ModuleGraph.SHARED]))
+        self.assertEqual([], graph.get_transitive_deps('libsys'))
+
+
+    def test_check_vndk_deps(self):
+        """Test the VNDK dependency check."""
+        graph = ModuleGraph.create_from_root_bp(self.root_bp)
+        self.assertEqual([('libvendor', ['libvndk_private']),
+                          ('libvndk', ['libsys']),
+                          ('libvndk_sp', ['libvndk'])],
+                         graph.check_vndk_deps())
+
+
+    def test_check_vndk_deps_undefined(self):
+        """Test the VNDK dependency check with an undefined dependency."""
+        with open(self.sub_bp, 'a') as bp_file:
+            bp_file.write('cc_library { name: "libv", vendor: true, '
+                          'shared_libs: ["libundefined"] }\n')
+        graph = ModuleGraph.create_from_root_bp(self.root_bp)
+        with self.assertRaises(KeyError):
+            graph.check_vndk_deps()
+
+
+    def test_save_and_load(self):
+        """Test the serialization and the source file stamps."""
+        graph = ModuleGraph.create_from_root_bp(self.root_bp)
+        graph_path = os.path.join(self.test_dir, 'graph')
+        graph.save(graph_path)
+
+        loaded = ModuleGraph.load(graph_path)
+        self.assertEqual(graph.names, loaded.names)
+        self.assertEqual(graph.check_vndk_deps(), loaded.check_vndk_deps())
+        self.assertEqual([''], loaded.namespaces)
+        self.assertTrue(loaded.is_up_to_date())
+
+        with open(self.sub_bp, 'a') as bp_file:
+            bp_file.write('\n')
+        self.assertFalse(loaded.is_up_to_date())
+
+        self.assertIsNone(ModuleGraph.load(os.path.join(self.test_dir, 'x')))
+
+
+if __name__ == '__main__':
+    unittest.main()
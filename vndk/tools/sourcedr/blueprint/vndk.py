@@ -19,9 +19,14 @@
 """This script scans all Android.bp in an android source tree and check the
 correctness of dependencies."""
 
+import array
 import copy
+import os
+import pickle
 
-from blueprint import RecursiveParser, evaluate_defaults, fill_module_namespaces
+from blueprint import (
+    RecursiveParser, dump_pickle_file, evaluate_defaults,
+    fill_module_namespaces)
 
 
 class Module(object):
@@ -102,6 +107,8 @@ class ModuleClassifier(object):
         self.vndk_sp_libs = {}
         self.vendor_available_libs = {}
         self.llndk_libs = {}
+        self.namespaces = set()
+        self.source_files = set()
 
 
     def add_module(self, name, module):
@@ -173,13 +180,16 @@ class ModuleClassifier(object):
                 continue
 
 
-    def parse_root_bp(self, root_bp_path, namespaces=None):
+    def parse_root_bp(self, root_bp_path, namespaces=None, num_jobs=1,
+                      cache_path=None):
         """Parse blueprint files and add module definitions."""
 
         namespaces = {''} if namespaces is None else set(namespaces)
 
-        parser = RecursiveParser()
+        parser = RecursiveParser(num_jobs, cache_path)
         parser.parse_file(root_bp_path)
+        self.namespaces.update(namespaces)
+        self.source_files.update(parser.visited)
         parsed_items = evaluate_defaults(parser.modules)
         parsed_items = fill_module_namespaces(root_bp_path, parsed_items)
 
@@ -187,8 +197,273 @@ class ModuleClassifier(object):
 
 
     @classmethod
-    def create_from_root_bp(cls, root_bp_path, namespaces=None):
+    def create_from_root_bp(cls, root_bp_path, namespaces=None, num_jobs=1,
+                            cache_path=None):
         """Create a ModuleClassifier from a root blueprint file."""
         result = cls()
-        result.parse_root_bp(root_bp_path, namespaces)
+        result.parse_root_bp(root_bp_path, namespaces, num_jobs, cache_path)
         return result
+
+
+    def create_graph(self):
+        """Create a ModuleGraph from the classified modules."""
+        return ModuleGraph.create_from_classifier(self)
+
+
+def _get_file_stamp(path):
+    """Get the (mtime, size) stamp of a file or None if it can't be stat'ed."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+class ModuleGraph(object):
+    """Indexed module dependency graph.
+
+    Modules (including the LLNDK libraries and the undefined dependencies) are
+    numbered in the order of their names.  The classification of each module is
+    kept as bit flags and the shared/static/header dependencies are kept as
+    adjacency arrays (an offset array and a target array for each kind), so the
+    graph can be queried and pickled without the parsed blueprint files.
+    """
+
+    # Classification flags
+    DEFINED = 1 << 0
+    LLNDK = 1 << 1
+    VNDK = 1 << 2
+    VNDK_SP = 1 << 3
+    VENDOR = 1 << 4
+    VENDOR_AVAILABLE = 1 << 5
+
+    # Dependency kinds
+    SHARED = 0
+    STATIC = 1
+    HEADER = 2
+
+    ALL_DEP_KINDS = (SHARED, STATIC, HEADER)
+
+
+    # Version of the serialized graph format
+    _VERSION = 1
+
+
+    def __init__(self, names, flags, deps, namespaces=None,
+                 source_stamps=None):
+        """Create a module graph.
+
+        Args:
+            names (list) Sorted module names.
+            flags (array) Classification flags for each module.
+            deps (list) (offsets, targets) arrays for each dependency kind.
+            namespaces (list) Sorted namespaces of the modules.
+            source_stamps (dict) Stamps of the parsed blueprint files.
+        """
+        self.names = names
+        self.flags = flags
+        self.deps = deps
+        self.namespaces = [] if namespaces is None else namespaces
+        self.source_stamps = {} if source_stamps is None else source_stamps
+        self._ids = {name: i for i, name in enumerate(names)}
+
+
+    @classmethod
+    def create_from_classifier(cls, classifier):
+        """Create a module graph from a ModuleClassifier."""
+
+        dep_lists = {}
+        for name, module in classifier.all_libs.items():
+            dep_lists[name] = module.get_dependencies()
+
+        names = set(classifier.all_libs)
+        names.update(classifier.llndk_libs)
+        for deps in dep_lists.values():
+            for dep_names in deps:
+                names.update(dep_names)
+        names = sorted(names)
+        ids = {name: i for i, name in enumerate(names)}
+
+        flags = array.array('B', [0]) * len(names)
+        for name in classifier.llndk_libs:
+            flags[ids[name]] |= cls.LLNDK
+        for name, module in classifier.all_libs.items():
+            module_flags = cls.DEFINED
+            if module.is_vndk():
+                module_flags |= cls.VNDK
+            if module.is_vndk_sp():
+                module_flags |= cls.VNDK_SP
+            if module.is_vendor():
+                module_flags |= cls.VENDOR
+            if module.is_vendor_available():
+                module_flags |= cls.VENDOR_AVAILABLE
+            flags[ids[name]] |= module_flags
+
+        deps = []
+        for kind in cls.ALL_DEP_KINDS:
+            offsets = array.array('L', [0])
+            targets = array.array('L')
+            for name in names:
+                module_deps = dep_lists.get(name)
+                if module_deps is not None:
+                    # get_dependencies() returns sorted names, thus the
+                    # targets are sorted as well.
+                    targets.extend(ids[dep] for dep in module_deps[kind])
+                offsets.append(len(targets))
+            deps.append((offsets, targets))
+
+        source_stamps = {path: _get_file_stamp(path)
+                         for path in classifier.source_files}
+
+        return cls(names, flags, deps, sorted(classifier.namespaces),
+                   source_stamps)
+
+
+    @classmethod
+    def create_from_root_bp(cls, root_bp_path, namespaces=None, num_jobs=1,
+                            cache_path=None):
+        """Create a module graph from a root blueprint file."""
+        return ModuleClassifier.create_from_root_bp(
+            root_bp_path, namespaces, num_jobs, cache_path).create_graph()
+
+
+    def save(self, path):
+        """Serialize the module graph to a file.  The file is replaced at once,
+        so a concurrent load() never reads a partial graph."""
+        dump_pickle_file((self._VERSION, self.names, self.flags, self.deps,
+                          self.namespaces, self.source_stamps), path)
+
+
+    @classmethod
+    def load(cls, path):
+        """Load a module graph from a file.  Return None if the file does not
+        exist or it has a different format version."""
+        try:
+            with open(path, 'rb') as graph_file:
+                data = pickle.load(graph_file)
+        except (IOError, OSError, EOFError, ValueError, pickle.PickleError):
+            return None
+        if not isinstance(data, tuple) or data[0] != cls._VERSION:
+            return None
+        return cls(*data[1:])
+
+
+    def is_up_to_date(self):
+        """Check whether the parsed blueprint files are not changed.  Note
+        that the newly added blueprint files are not detected."""
+        if not self.source_stamps:
+            return False
+        for path, stamp in self.source_stamps.items():
+            if _get_file_stamp(path) != stamp:
+                return False
+        return True
+
+
+    def __len__(self):
+        """Get the number of modules."""
+        return len(self.names)
+
+
+    def __contains__(self, name):
+        """Check whether a name is a module name or a dependency name."""
+        return name in self._ids
+
+
+    def get_id(self, name):
+        """Get the module ID of a module name (raise KeyError if not found)."""
+        return self._ids[name]
+
+
+    def get_flags(self, name):
+        """Get the classification flags of a module."""
+        return self.flags[self._ids[name]]
+
+
+    def _iter_dep_ids(self, module_id, kinds):
+        """Iterate the dependency IDs of a module ID."""
+        for kind in kinds:
+            offsets, targets = self.deps[kind]
+            for i in range(offsets[module_id], offsets[module_id + 1]):
+                yield targets[i]
+
+
+    def get_deps(self, name, kinds=ALL_DEP_KINDS):
+        """Get the sorted direct dependencies of a module."""
+        module_id = self._ids[name]
+        return [self.names[dep_id]
+                for dep_id in sorted(set(self._iter_dep_ids(module_id, kinds)))]
+
+
+    def get_transitive_deps(self, name, kinds=ALL_DEP_KINDS):
+        """Get the sorted transitive dependencies of a module (excluding the
+        module itself unless there is a cycle)."""
+        visited = bytearray(len(self.names))
+        stack = [self._ids[name]]
+        while stack:
+            for dep_id in self._iter_dep_ids(stack.pop(), kinds):
+                if not visited[dep_id]:
+                    visited[dep_id] = 1
+                    stack.append(dep_id)
+        return [self.names[i] for i, bit in enumerate(visited) if bit]
+
+
+    def check_vndk_deps(self):
+        """Check the dependencies of the VNDK, vendor available, and vendor
+        modules in one pass.  Return the sorted (name, sorted bad deps) pairs.
+        Raise KeyError if a checked dependency is not defined."""
+
+        names = self.names
+        flags = self.flags
+        shared_offsets, shared_targets = self.deps[self.SHARED]
+
+        vendor_variant_flags = self.VNDK | self.VENDOR_AVAILABLE
+        vendor_accessible_flags = self.VENDOR | self.VENDOR_AVAILABLE
+
+        all_bad_deps = []
+        for module_id, module_flags in enumerate(flags):
+            if not module_flags & self.DEFINED:
+                continue
+            is_vendor = module_flags & self.VENDOR
+            if not is_vendor and not module_flags & vendor_variant_flags:
+                continue
+
+            bad_dep_ids = set()
+
+            # Check vendor module dependencies requirements.
+            for dep_id in self._iter_dep_ids(module_id, self.ALL_DEP_KINDS):
+                dep_flags = flags[dep_id]
+                if dep_flags & self.LLNDK:
+                    continue
+                if not dep_flags & self.DEFINED:
+                    raise KeyError(names[dep_id])
+                if dep_flags & vendor_accessible_flags:
+                    continue
+                if dep_flags & self.VNDK and not is_vendor:
+                    # VNDK-Core may link to VNDK-Private.
+                    continue
+                bad_dep_ids.add(dep_id)
+
+            # Check VNDK dependencies requirements.
+            if module_flags & self.VNDK and not is_vendor:
+                is_vndk_sp = module_flags & self.VNDK_SP
+                for i in range(shared_offsets[module_id],
+                               shared_offsets[module_id + 1]):
+                    dep_id = shared_targets[i]
+                    dep_flags = flags[dep_id]
+                    if dep_flags & self.LLNDK:
+                        continue
+                    if not dep_flags & self.VNDK:
+                        # VNDK must be self-contained.
+                        bad_dep_ids.add(dep_id)
+                        break
+                    if is_vndk_sp and not dep_flags & self.VNDK_SP:
+                        # VNDK-SP must be self-contained.
+                        bad_dep_ids.add(dep_id)
+                        break
+
+            if bad_dep_ids:
+                all_bad_deps.append(
+                    (names[module_id],
+                     [names[dep_id] for dep_id in sorted(bad_dep_ids)]))
+
+        return all_bad_deps
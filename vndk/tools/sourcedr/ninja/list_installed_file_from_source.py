@@ -23,6 +23,17 @@ def _parse_args():
     parser.add_argument('--cwd', help='working directory for ninja')
     parser.add_argument('--encoding', default='utf-8',
                         help='ninja file encoding')
+    parser.add_argument('--cache-file',
+                        help='manifest cache file (default: '
+                             '${input_file}.cache)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write manifest cache')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes to parse subninja files')
+    parser.add_argument('--no-incremental', dest='incremental',
+                        action='store_false',
+                        help='do not keep the parser state in '
+                             '${input_file}.state')
 
     # Options
     parser.add_argument(
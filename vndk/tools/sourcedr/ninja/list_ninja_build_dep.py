@@ -3,9 +3,9 @@
 """List all transitive build rules of a target."""
 
 import argparse
-import itertools
 import posixpath
 import re
+import sys
 
 try:
     import cPickle as pickle  # Python 2
@@ -26,6 +26,18 @@ def _parse_args():
     parser.add_argument('--cwd', help='working directory for ninja')
     parser.add_argument('--encoding', default='utf-8',
                         help='ninja file encoding')
+    parser.add_argument('--cache-file',
+                        help='manifest cache file (default: '
+                             '${input_file}.cache)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write manifest cache')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes to parse subninja files')
+    parser.add_argument('--incremental', action='store_true',
+                        help='re-parse changed files only (with the parser '
+                             'state in ${input_file}.state)')
+    parser.add_argument('--graph-file',
+                        help='graph index file (default: ${input_file}.graph)')
 
     # Options
     parser.add_argument('target', help='build target')
@@ -33,67 +45,66 @@ def _parse_args():
     return parser.parse_args()
 
 
-def collect_build_targets(graph, target):
-    """Collect the transitive build targets."""
+# Input labels in the order they are printed
+_IN_LABELS = (
+    (ninja.EDGE.EXPLICIT, 'explicit_in'),
+    (ninja.EDGE.IMPLICIT, 'implicit_in'),
+    (ninja.EDGE.ORDER_ONLY, 'prerequisites'),
+    (ninja.EDGE.DEPFILE, 'depfile_implicit_in'),
+)
 
-    # Search for the first target
-    build = graph[target]
+_ALL_EDGE_KINDS = frozenset(kind for kind, _ in _IN_LABELS)
 
-    # Collect all source files
-    dfs = [build]
 
-    visited = {build}
-    stack = [build]
-    while stack:
-        build = stack.pop()
-        for dep in itertools.chain(build.explicit_ins, build.implicit_ins,
-                                   build.depfile_implicit_ins):
-            dep = graph.get(dep)
-            if not dep:
-                continue
-            if dep not in visited:
-                visited.add(dep)
-                dfs.append(dep)
-                stack.append(dep)
+def get_build_ins(index, path):
+    """Get a dict from edge kinds to the inputs of a path."""
 
-    return dfs
+    ins = {}
+    for node_id, kind in index.iter_edges(index.get_node_id(path),
+                                          kinds=_ALL_EDGE_KINDS):
+        ins.setdefault(kind, []).append(index.get_path(node_id))
+    return ins
+
+
+def collect_build_targets(index, target):
+    """Collect the transitive build targets with the graph index.
+
+    Returns:
+        A list of (path, inputs) pairs of the target and its transitive
+        dependencies that are built, where inputs is from get_build_ins().
+
+    Raises:
+        KeyError: The target is not in the graph.
+    """
+
+    builds = []
+    for path in [target] + index.get_deps(target):
+        ins = get_build_ins(index, path)
+        if ins:
+            builds.append((path, ins))
+    return builds
 
 
 def main():
     args = _parse_args()
 
-    # Build lookup map
-    manifest = ninja.load_manifest_from_args(args)
-    graph = {}
-    for build in manifest.builds:
-        for path in build.explicit_outs:
-            graph[path] = build
-        for path in build.implicit_outs:
-            graph[path] = build
+    index = ninja.load_graph_index_from_args(args)
 
     # List all transitive targets
     try:
-        builds = collect_build_targets(graph, args.target)
+        builds = collect_build_targets(index, args.target)
     except KeyError:
-        print('error: Failed to find the target {}'.format(arg.target),
+        print('error: Failed to find the target {}'.format(args.target),
               file=sys.stderr)
         sys.exit(1)
 
     # Print all targets
-    for build in builds:
+    for path, ins in builds:
         print('build')
-        for path in build.explicit_outs:
-            print('  explicit_out:', path)
-        for path in build.implicit_outs:
-            print('  implicit_out:', path)
-        for path in build.explicit_ins:
-            print('  explicit_in:', path)
-        for path in build.implicit_ins:
-            print('  implicit_in:', path)
-        for path in build.prerequisites:
-            print('  prerequisites:', path)
-        for path in build.depfile_implicit_ins:
-            print('  depfile_implicit_in:', path)
+        print('  out:', path)
+        for kind, label in _IN_LABELS:
+            for dep in ins.get(kind, ()):
+                print('  {}:'.format(label), dep)
 
 
 if __name__ == '__main__':
@@ -6,7 +6,13 @@
 from __future__ import print_function
 
 import argparse
+import array
+import bisect
 import collections
+import hashlib
+import itertools
+import mmap
+import multiprocessing
 import os
 import re
 import struct
@@ -36,6 +42,11 @@ if sys.version_info < (3,):
     # Replace built-in zip() function with itertools.izip
     from itertools import izip as zip
 
+try:
+    from collections.abc import Sequence  # Python 3
+except ImportError:
+    from collections import Sequence  # Python 2
+
 
 class EvalEnv(dict):
     __slots__ = ('parent')
@@ -50,7 +61,7 @@ class EvalEnv(dict):
         try:
             return self[key]
         except KeyError:
-            if self.parent:
+            if self.parent is not None:
                 return self.parent.get_recursive(key, default)
             return default
 
@@ -76,7 +87,7 @@ class BuildEvalEnv(EvalEnv):
             except KeyError:
                 pass
 
-        if self._build_env.parent:
+        if self._build_env.parent is not None:
             return self._build_env.parent.get_recursive(key, default)
         return default
 
@@ -477,6 +488,32 @@ class Lexer(object):
 Manifest = collections.namedtuple('Manifest', 'builds rules pools defaults')
 
 
+class STMT(object):
+    """Statement kind enumerations.
+
+    The statements are represented as tuples whose first element is the
+    statement kind.  The rest elements are unevaluated ``EvalString`` objects
+    or ``EvalEnv`` objects for local bindings:
+
+    - ``(BINDING, key, value)``
+    - ``(BUILD, explicit_outs, implicit_outs, rule_token, explicit_ins,
+      implicit_ins, prerequisites, bindings)``
+    - ``(RULE, name, bindings)``
+    - ``(DEFAULT, outs)``
+    - ``(POOL, name, bindings)``
+    - ``(INCLUDE, path)``
+    - ``(SUBNINJA, path)``
+    """
+
+    BINDING = 0
+    BUILD = 1
+    RULE = 2
+    DEFAULT = 3
+    POOL = 4
+    INCLUDE = 5
+    SUBNINJA = 6
+
+
 class Parser(object):
     """Ninja Manifest Parser
 
@@ -500,15 +537,27 @@ class Parser(object):
         >>> manifest = Parser().parse('build.ninja', 'utf-8')
         >>> print(manifest.builds)
 
+    If ``num_jobs`` is greater than 1, the `subninja` files are parsed in a
+    process pool.  Each `subninja` file is parsed with a snapshot of the
+    parent scope and the rules declared so far, and the results are merged in
+    the order of the `subninja` statements.  Unlike the sequential mode, the
+    rules declared in a `subninja` file are not visible to the parent file,
+    which matches the scoping rule of ninja.
+
     """
 
 
-    def __init__(self, base_dir=None):
+    def __init__(self, base_dir=None, num_jobs=1):
         if base_dir is None:
             self._base_dir = os.getcwd()
         else:
             self._base_dir = base_dir
 
+        # Process pool for `subninja` files
+        self._num_jobs = num_jobs
+        self._pool = None
+        self._pending_subninjas = []
+
         # File context
         self._context = []
         self._lexer = None
@@ -522,6 +571,9 @@ class Parser(object):
 
         self._rules_dict = {}
 
+        # Paths of all parsed files (including the `.ninja_deps` file)
+        self.parsed_files = []
+
 
     def _push_context(self, lexer, env):
         """Push a parsing file context.
@@ -555,14 +607,48 @@ class Parser(object):
             Manifest: Parsed manifest for the given ninja-build manifest file.
         """
 
-        self._parse_internal(path, encoding, EvalEnv())
+        if self._num_jobs > 1:
+            self._pool = multiprocessing.Pool(self._num_jobs)
+        try:
+            self._parse_internal(path, encoding, EvalEnv())
+            self._merge_subninja_results()
+        finally:
+            if self._pool:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
         if depfile:
             self.parse_dep_file(depfile, encoding)
         return Manifest(self._builds, self._rules, self._pools, self._defaults)
 
 
+    def _merge_subninja_results(self):
+        """Merge the results from the `subninja` files parsed in the process
+        pool.  The results are spliced in the reversed order so that the
+        recorded insertion indexes remain valid."""
+
+        pending_subninjas = self._pending_subninjas
+        self._pending_subninjas = []
+
+        results = [(indexes, async_result.get())
+                   for indexes, async_result in pending_subninjas]
+
+        for indexes, result in reversed(results):
+            builds, rules, pools, defaults, parsed_files = result
+            build_idx, rule_idx, pool_idx, default_idx = indexes
+            self._builds[build_idx:build_idx] = builds
+            self._rules[rule_idx:rule_idx] = rules
+            self._pools[pool_idx:pool_idx] = pools
+            self._defaults[default_idx:default_idx] = defaults
+
+        for indexes, result in results:
+            self.parsed_files.extend(result[4])
+
+
     def _parse_internal(self, path, encoding, env):
         path = os.path.join(self._base_dir, path)
+        self.parsed_files.append(os.path.abspath(path))
         with open(path, 'r', encoding=encoding) as fp:
             self._push_context(Lexer(fp, path, encoding), env)
             try:
@@ -571,42 +657,135 @@ class Parser(object):
                 self._pop_context()
 
 
+    def iter_parse(self, path, encoding, depfile=None):
+        """Parse a ninja-build manifest file and yield the records in the
+        order of the statements.
+
+        Unlike ``parse()``, the records are not kept by the parser, thus the
+        memory usage does not grow with the number of builds.  The `subninja`
+        files are always parsed sequentially.
+
+        Args:
+            path (str): Input file path to be parsed.
+            encoding (str): Input file encoding.
+            depfile (str): Path to the `.ninja_deps` file.
+
+        Yields:
+            ``Build``, ``Rule``, ``Pool``, or ``Default`` objects.
+        """
+
+        deps = None
+        if depfile:
+            self.parsed_files.append(os.path.abspath(depfile))
+            deps = DepFileReader(depfile, encoding)
+
+        for record in self._iter_parse_internal(path, encoding, EvalEnv()):
+            if deps is not None and type(record) is Build:
+                self._set_depfile_implicit_ins(record, deps)
+            yield record
+
+
+    def _iter_parse_internal(self, path, encoding, env):
+        path = os.path.join(self._base_dir, path)
+        self.parsed_files.append(os.path.abspath(path))
+        with open(path, 'r', encoding=encoding) as fp:
+            self._push_context(Lexer(fp, path, encoding), env)
+            try:
+                while True:
+                    stmt = self._lex_top_level_stmt()
+                    if stmt is None:
+                        break
+
+                    kind = stmt[0]
+                    if kind in {STMT.INCLUDE, STMT.SUBNINJA}:
+                        sub_path = eval_string(stmt[1], self._env)
+                        if kind == STMT.SUBNINJA:
+                            sub_env = EvalEnv()
+                            sub_env.parent = self._env
+                        else:
+                            sub_env = self._env
+                        for record in self._iter_parse_internal(
+                                sub_path, self._lexer.encoding, sub_env):
+                            yield record
+                        continue
+
+                    # Take the record out of the intermediate results.
+                    self._eval_stmt(stmt)
+                    if kind == STMT.BUILD:
+                        yield self._builds.pop()
+                    elif kind == STMT.RULE:
+                        yield self._rules.pop()
+                    elif kind == STMT.POOL:
+                        yield self._pools.pop()
+                    elif kind == STMT.DEFAULT:
+                        yield self._defaults.pop()
+            finally:
+                self._pop_context()
+
+
     def _parse_all_top_level_stmts(self):
         """Parse all top-level statements in a file."""
-        while self._parse_top_level_stmt():
-            pass
+        while True:
+            stmt = self._lex_top_level_stmt()
+            if stmt is None:
+                break
+            self._eval_stmt(stmt)
 
 
-    def _parse_top_level_stmt(self):
-        """Parse a top level statement."""
+    def _lex_top_level_stmt(self):
+        """Lex a top level statement.
 
-        token = self._lexer.peek()
-        if not token:
-            # An unexpected non-trivial token occurs.  Raise an error.
-            self._lexer.raise_error()
+        Returns:
+            A statement tuple (see ``STMT``) or None if the end of file is
+            reached.
+        """
 
-        if token.kind == TK.EOF:
-            return False
-        elif token.kind == TK.NEWLINE:
-            self._lexer.lex()
-        elif token.kind == TK.IDENT:
-            ident = token.value
-            if ident == 'rule':
-                self._parse_rule_stmt()
-            elif ident == 'build':
-                self._parse_build_stmt()
-            elif ident == 'default':
-                self._parse_default_stmt()
-            elif ident == 'pool':
-                self._parse_pool_stmt()
-            elif ident in {'subninja', 'include'}:
-                self._parse_include_stmt()
+        while True:
+            token = self._lexer.peek()
+            if not token:
+                # An unexpected non-trivial token occurs.  Raise an error.
+                self._lexer.raise_error()
+
+            if token.kind == TK.EOF:
+                return None
+            elif token.kind == TK.NEWLINE:
+                self._lexer.lex()
+            elif token.kind == TK.IDENT:
+                ident = token.value
+                if ident == 'rule':
+                    return self._lex_rule_stmt()
+                elif ident == 'build':
+                    return self._lex_build_stmt()
+                elif ident == 'default':
+                    return self._lex_default_stmt()
+                elif ident == 'pool':
+                    return self._lex_pool_stmt()
+                elif ident in {'subninja', 'include'}:
+                    return self._lex_include_stmt()
+                else:
+                    return self._lex_global_binding_stmt()
             else:
-                self._parse_global_binding_stmt()
+                # An unexpected trivial token occurs.  Raise an error.
+                self._lexer.raise_error()
+
+
+    def _eval_stmt(self, stmt):
+        """Evaluate a statement tuple in the current context."""
+
+        kind = stmt[0]
+        if kind == STMT.BUILD:
+            self._eval_build_stmt(stmt)
+        elif kind == STMT.BINDING:
+            self._eval_global_binding_stmt(stmt)
+        elif kind == STMT.RULE:
+            self._eval_rule_stmt(stmt)
+        elif kind == STMT.DEFAULT:
+            self._eval_default_stmt(stmt)
+        elif kind == STMT.POOL:
+            self._eval_pool_stmt(stmt)
         else:
-            # An unexpected trivial token occurs.  Raise an error.
-            self._lexer.raise_error()
-        return True
+            assert kind in {STMT.INCLUDE, STMT.SUBNINJA}
+            self._eval_include_stmt(stmt)
 
 
     def _parse_path_list(self, end_set):
@@ -640,16 +819,20 @@ class Parser(object):
         return (key, value)
 
 
-    def _parse_global_binding_stmt(self):
-        """Parse a global variable binding statement.
+    def _lex_global_binding_stmt(self):
+        """Lex a global variable binding statement.
 
         Example:
             IDENT = STRING
         """
 
         key, value = self._parse_binding_stmt()
-        value = eval_string(value, self._env)
-        self._env[key] = value
+        return (STMT.BINDING, key, value)
+
+
+    def _eval_global_binding_stmt(self, stmt):
+        _, key, value = stmt
+        self._env[key] = eval_string(value, self._env)
 
 
     def _parse_local_binding_block(self):
@@ -670,8 +853,8 @@ class Parser(object):
         return result
 
 
-    def _parse_build_stmt(self):
-        """Parse `build` statement.
+    def _lex_build_stmt(self):
+        """Lex `build` statement.
 
         Example:
             build PATH1 PATH2 | PATH3 PATH4 : IDENT PATH5 PATH6 | $
@@ -683,8 +866,6 @@ class Parser(object):
         token = self._lexer.lex_match({TK.IDENT})
         assert token.value == 'build'
 
-        build = Build()
-
         # Parse explicit outs
         explicit_outs = self._parse_path_list({TK.PIPE, TK.COLON})
 
@@ -699,13 +880,7 @@ class Parser(object):
         self._lexer.lex_match({TK.COLON})
 
         # Parse rule name for this build statement
-        build.rule = self._lexer.lex_match({TK.IDENT}).value
-        try:
-            rule_env = self._rules_dict[build.rule].bindings
-        except KeyError:
-            if build.rule != 'phony':
-                self._lexer.raise_error('undeclared rule name')
-            rule_env = self._env
+        rule_token = self._lexer.lex_match({TK.IDENT})
 
         # Parse explicit ins
         explicit_ins = self._parse_path_list(
@@ -731,12 +906,37 @@ class Parser(object):
 
         # Parse local bindings
         bindings = self._parse_local_binding_block()
-        bindings.parent = self._env
+
+        return (STMT.BUILD, explicit_outs, implicit_outs, rule_token,
+                explicit_ins, implicit_ins, prerequisites, bindings)
+
+
+    def _eval_build_stmt(self, stmt):
+        (_, explicit_outs, implicit_outs, rule_token, explicit_ins, implicit_ins,
+         prerequisites, bindings) = stmt
+
+        build = Build()
+
+        build.rule = rule_token.value
+        try:
+            rule_env = self._rules_dict[build.rule].bindings
+        except KeyError:
+            if build.rule != 'phony':
+                raise ParseError(self._lexer.path, rule_token.line,
+                                 rule_token.column, 'undeclared rule name')
+            rule_env = self._env
+
+        # The statement may be evaluated more than once (see
+        # ``IncrementalParser``), thus the bindings must be copied before
+        # binding to the current scope.
         if bindings:
+            bindings = EvalEnv(bindings)
             build.bindings = bindings
         else:
             # Don't keep the empty ``dict`` object if there are no bindings
+            bindings = EvalEnv()
             build.bindings = None
+        bindings.parent = self._env
 
         # Evaluate all paths
         env = BuildEvalEnv(bindings, rule_env)
@@ -751,8 +951,8 @@ class Parser(object):
         self._builds.append(build)
 
 
-    def _parse_rule_stmt(self):
-        """Parse a `rule` statement.
+    def _lex_rule_stmt(self):
+        """Lex a `rule` statement.
 
         Example:
             rule IDENT
@@ -763,17 +963,23 @@ class Parser(object):
         token = self._lexer.lex_match({TK.IDENT})
         assert token.value == 'rule'
 
-        rule = Rule()
-        rule.name = self._lexer.lex_match({TK.IDENT}).value
+        name = self._lexer.lex_match({TK.IDENT}).value
         self._lexer.lex_match({TK.NEWLINE, TK.EOF})
-        rule.bindings = self._parse_local_binding_block()
+        bindings = self._parse_local_binding_block()
+
+        return (STMT.RULE, name, bindings)
+
+
+    def _eval_rule_stmt(self, stmt):
+        rule = Rule()
+        _, rule.name, rule.bindings = stmt
 
         self._rules.append(rule)
         self._rules_dict[rule.name] = rule
 
 
-    def _parse_default_stmt(self):
-        """Parse a `default` statement.
+    def _lex_default_stmt(self):
+        """Lex a `default` statement.
 
         Example:
             default PATH1 PATH2 PATH3
@@ -782,17 +988,22 @@ class Parser(object):
         token = self._lexer.lex_match({TK.IDENT})
         assert token.value == 'default'
 
-        default = Default()
         outs = self._parse_path_list({TK.NEWLINE, TK.EOF})
-        default.outs = eval_path_strings(outs, self._env)
 
         self._lexer.lex_match({TK.NEWLINE, TK.EOF})
 
+        return (STMT.DEFAULT, outs)
+
+
+    def _eval_default_stmt(self, stmt):
+        default = Default()
+        default.outs = eval_path_strings(stmt[1], self._env)
+
         self._defaults.append(default)
 
 
-    def _parse_pool_stmt(self):
-        """Parse a `pool` statement.
+    def _lex_pool_stmt(self):
+        """Lex a `pool` statement.
 
         Example:
             pool IDENT
@@ -802,21 +1013,26 @@ class Parser(object):
         token = self._lexer.lex_match({TK.IDENT})
         assert token.value == 'pool'
 
-        pool = Pool()
-
         token = self._lexer.lex()
         assert token.kind == TK.IDENT
-        pool.name = token.value
+        name = token.value
 
         self._lexer.lex_match({TK.NEWLINE, TK.EOF})
 
-        pool.bindings = self._parse_local_binding_block()
+        bindings = self._parse_local_binding_block()
+
+        return (STMT.POOL, name, bindings)
+
+
+    def _eval_pool_stmt(self, stmt):
+        pool = Pool()
+        _, pool.name, pool.bindings = stmt
 
         self._pools.append(pool)
 
 
-    def _parse_include_stmt(self):
-        """Parse an `include` or `subninja` statement.
+    def _lex_include_stmt(self):
+        """Lex an `include` or `subninja` statement.
 
         Example:
             include PATH
@@ -825,29 +1041,380 @@ class Parser(object):
 
         token = self._lexer.lex_match({TK.IDENT})
         assert token.value in {'include', 'subninja'}
-        wrap_env = token.value == 'subninja'
+        if token.value == 'subninja':
+            kind = STMT.SUBNINJA
+        else:
+            kind = STMT.INCLUDE
 
         token = self._lexer.lex_path()
-        path = eval_string(token.value, self._env)  # XXX: Check lookup order
         self._lexer.lex_match({TK.NEWLINE, TK.EOF})
 
-        if wrap_env:
-            env = EvalEnv()
-            env.parent = self._env
+        return (kind, token.value)
+
+
+    def _eval_include_stmt(self, stmt):
+        kind, path = stmt
+        path = eval_string(path, self._env)  # XXX: Check lookup order
+
+        if kind == STMT.SUBNINJA:
+            self._parse_subninja(path, self._lexer.encoding)
         else:
-            env = self._env
-        self._parse_internal(path, self._lexer.encoding, env)
+            self._parse_internal(path, self._lexer.encoding, self._env)
+
+
+    def _parse_subninja(self, path, encoding):
+        """Parse a `subninja` file with a new child scope."""
+
+        if self._pool:
+            self._parse_subninja_async(path, encoding)
+            return
+
+        env = EvalEnv()
+        env.parent = self._env
+        self._parse_internal(path, encoding, env)
+
+
+    def _parse_subninja_async(self, path, encoding):
+        """Parse a `subninja` file in the process pool."""
+
+        indexes = (len(self._builds), len(self._rules), len(self._pools),
+                   len(self._defaults))
+        async_result = self._pool.apply_async(
+                _parse_subninja_job,
+                (self._base_dir, path, encoding, _snapshot_env(self._env),
+                 self._rules_dict))
+        self._pending_subninjas.append((indexes, async_result))
 
 
     def parse_dep_file(self, path, encoding):
-        depfile = DepFileParser().parse(path, encoding)
+        self.parsed_files.append(os.path.abspath(path))
+        depfile = DepFileReader(path, encoding)
         for build in self._builds:
-            depfile_implicit_ins = set()
-            for explicit_out in build.explicit_outs:
-                deps = depfile.get(explicit_out)
-                if deps:
-                    depfile_implicit_ins.update(deps.implicit_ins)
-            build.depfile_implicit_ins = tuple(sorted(depfile_implicit_ins))
+            self._set_depfile_implicit_ins(build, depfile)
+
+
+    @staticmethod
+    def _set_depfile_implicit_ins(build, depfile):
+        depfile_implicit_ins = set()
+        for explicit_out in build.explicit_outs:
+            deps = depfile.get(explicit_out)
+            if deps:
+                depfile_implicit_ins.update(deps.implicit_ins)
+        build.depfile_implicit_ins = tuple(sorted(depfile_implicit_ins))
+
+
+if array.array('I').itemsize == 4:
+    _UINT32_TYPECODE = 'I'
+else:
+    _UINT32_TYPECODE = 'L'
+
+if array.array('L').itemsize == 8:
+    _UINT64_TYPECODE = 'L'
+else:
+    _UINT64_TYPECODE = 'Q'
+
+
+def _pack_uint32_array(values):
+    """Pack a sequence of integers into little-endian uint32 bytes."""
+    arr = array.array(_UINT32_TYPECODE, values)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    try:
+        return arr.tobytes()
+    except AttributeError:
+        return arr.tostring()  # Python 2
+
+
+def _unpack_uint32_array(buf, offset, size):
+    """Create a read-only uint32 sequence view for a little-endian buffer.
+
+    The view shares the memory with ``buf`` if it is supported by the Python
+    runtime.  Otherwise, the integers are copied into an ``array``.
+    """
+    if sys.byteorder == 'little' and hasattr(memoryview, 'cast'):
+        return memoryview(buf)[offset:offset + size].cast('I')
+    arr = array.array(_UINT32_TYPECODE)
+    data = buf[offset:offset + size]
+    try:
+        arr.frombytes(data)
+    except AttributeError:
+        arr.fromstring(data)  # Python 2
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+
+def _get_file_stamp(path):
+    """Get the (mtime in nanoseconds, size) pair of a file."""
+    stat = os.stat(path)
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(stat.st_mtime * 1000000000)  # Python 2
+    return (mtime_ns, stat.st_size)
+
+
+def _snapshot_env(env):
+    """Flatten an environment and its parents into one ``EvalEnv``."""
+    envs = []
+    while env is not None:
+        envs.append(env)
+        env = env.parent
+    snapshot = EvalEnv()
+    for env in reversed(envs):
+        snapshot.update(env)
+    return snapshot
+
+
+def _parse_subninja_job(base_dir, path, encoding, parent_env, rules_dict):
+    """Parse a `subninja` file in a worker process."""
+    parser = Parser(base_dir)
+    parser._rules_dict = dict(rules_dict)
+    env = EvalEnv()
+    env.parent = parent_env
+    parser._parse_internal(path, encoding, env)
+    return (parser._builds, parser._rules, parser._pools, parser._defaults,
+            parser.parsed_files)
+
+
+class IncrementalParser(Parser):
+    """Incremental Ninja Manifest Parser
+
+    This parser keeps a state file with the content hash and the lexed
+    statements of each parsed file.  On the next run, only the files whose
+    content hashes have been changed are lexed again.  The statements of the
+    other files are re-evaluated from the state file.
+
+    In addition, the evaluated results of each `subninja` file are kept with
+    the hash of the parent scope and the declared rules.  If neither the
+    files nor the parent scope of a `subninja` statement have been changed,
+    the results are reused without evaluation.
+
+    If ``num_jobs`` is greater than 1, the `subninja` files that cannot be
+    reused are parsed in a process pool as in ``Parser``.
+
+    Example:
+        >>> parser = IncrementalParser('build.ninja.state')
+        >>> manifest = parser.parse('build.ninja', 'utf-8')
+    """
+
+    STATE_VERSION = 1
+
+
+    def __init__(self, state_path, base_dir=None, num_jobs=1):
+        super(IncrementalParser, self).__init__(base_dir, num_jobs)
+
+        self._state_path = state_path
+
+        # States from the previous run
+        self._old_file_digests = {}
+        self._old_file_stmts = {}
+        self._old_subninjas = {}
+
+        # States for the next run
+        self._file_digests = {}
+        self._file_stmts = {}
+        self._subninjas = {}
+        self._pending_subninja_keys = []
+
+        self._rules_digest = None
+
+
+    def parse(self, path, encoding, depfile=None):
+        self._load_state()
+        manifest = super(IncrementalParser, self).parse(path, encoding)
+        # Save the builds before the deps log is applied, so that the reused
+        # builds never carry the `depfile_implicit_ins` of another run.
+        try:
+            self._save_state()
+        except (IOError, OSError) as e:
+            print('warning: Failed to write parser state:', e, file=sys.stderr)
+        if depfile:
+            self.parse_dep_file(depfile, encoding)
+        return manifest
+
+
+    def _load_state(self):
+        try:
+            with open(self._state_path, 'rb') as state_file:
+                state = pickle.load(state_file)
+        except (IOError, OSError, EOFError, ValueError, AttributeError,
+                ImportError, pickle.PickleError):
+            return
+        if not isinstance(state, dict) or \
+           state.get('version') != self.STATE_VERSION:
+            return
+        self._old_file_digests = state['file_digests']
+        self._old_file_stmts = state['file_stmts']
+        self._old_subninjas = state['subninjas']
+
+
+    def _save_state(self):
+        # Keep the states of the files that are parsed but not re-evaluated,
+        # e.g. the files included by the reused `subninja` files.
+        parsed_files = set(self.parsed_files)
+        for path, entry in self._old_file_digests.items():
+            if path in parsed_files:
+                self._file_digests.setdefault(path, entry)
+        for path, entry in self._old_file_stmts.items():
+            if path in parsed_files:
+                self._file_stmts.setdefault(path, entry)
+        subninja_paths = set(path for path, _ in self._subninjas)
+        for key, entry in self._old_subninjas.items():
+            if key[0] in parsed_files and key[0] not in subninja_paths:
+                self._subninjas[key] = entry
+
+        state = {
+            'version': self.STATE_VERSION,
+            'file_digests': self._file_digests,
+            'file_stmts': self._file_stmts,
+            'subninjas': self._subninjas,
+        }
+        tmp_path = self._state_path + '.tmp' + str(os.getpid())
+        with open(tmp_path, 'wb') as state_file:
+            pickle.dump(state, state_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self._state_path)
+
+
+    def _get_file_digest(self, path):
+        """Get the content hash of a file.  The hash from the previous run is
+        reused if the mtime and the size of the file are not changed."""
+
+        try:
+            return self._file_digests[path][1]
+        except KeyError:
+            pass
+
+        stamp = _get_file_stamp(path)
+        old = self._old_file_digests.get(path)
+        if old and old[0] == stamp:
+            digest = old[1]
+        else:
+            with open(path, 'rb') as fp:
+                digest = hashlib.sha1(fp.read()).hexdigest()
+        self._file_digests[path] = (stamp, digest)
+        return digest
+
+
+    def _parse_internal(self, path, encoding, env):
+        path = os.path.join(self._base_dir, path)
+        abs_path = os.path.abspath(path)
+        self.parsed_files.append(abs_path)
+
+        digest = self._get_file_digest(abs_path)
+        cached = self._file_stmts.get(abs_path) or \
+                 self._old_file_stmts.get(abs_path)
+
+        if cached and cached[0] == digest:
+            # Re-evaluate the statements from the previous run.  The lexer is
+            # only used for error reporting.
+            stmts = cached[1]
+            self._file_stmts[abs_path] = cached
+            self._push_context(Lexer((), path, encoding), env)
+            try:
+                for stmt in stmts:
+                    self._eval_stmt(stmt)
+            finally:
+                self._pop_context()
+            return
+
+        stmts = []
+        with open(path, 'r', encoding=encoding) as fp:
+            self._push_context(Lexer(fp, path, encoding), env)
+            try:
+                while True:
+                    stmt = self._lex_top_level_stmt()
+                    if stmt is None:
+                        break
+                    stmts.append(stmt)
+                    self._eval_stmt(stmt)
+            finally:
+                self._pop_context()
+        self._file_stmts[abs_path] = (digest, stmts)
+
+
+    def _eval_rule_stmt(self, stmt):
+        super(IncrementalParser, self)._eval_rule_stmt(stmt)
+        self._rules_digest = None
+
+
+    def _get_rules_digest(self):
+        if self._rules_digest is None:
+            rules = sorted((name, sorted(rule.bindings.items()))
+                           for name, rule in self._rules_dict.items())
+            self._rules_digest = \
+                    hashlib.sha1(repr(rules).encode('utf-8')).hexdigest()
+        return self._rules_digest
+
+
+    def _get_scope_digest(self):
+        """Get the hash of the parent scope for a `subninja` file."""
+        env = sorted(_snapshot_env(self._env).items())
+        return hashlib.sha1((repr(env) + self._get_rules_digest())
+                            .encode('utf-8')).hexdigest()
+
+
+    def _parse_subninja(self, path, encoding):
+        abs_path = os.path.abspath(os.path.join(self._base_dir, path))
+        scope_digest = self._get_scope_digest()
+        key = (abs_path, scope_digest)
+
+        # Reuse the results if the parent scope and the files are unchanged.
+        old = self._old_subninjas.get(key)
+        if old:
+            file_digests, results = old
+            try:
+                is_up_to_date = all(self._get_file_digest(p) == d
+                                    for p, d in file_digests)
+            except (IOError, OSError):
+                is_up_to_date = False
+            if is_up_to_date:
+                self._subninjas[key] = old
+                builds, rules, pools, defaults = results
+                self._builds.extend(builds)
+                self._pools.extend(pools)
+                self._defaults.extend(defaults)
+                self._rules.extend(rules)
+                # The rules of the `subninja` files parsed in the process pool
+                # are not visible to the parent file.
+                if not self._pool:
+                    for rule in rules:
+                        self._rules_dict[rule.name] = rule
+                    self._rules_digest = None
+                self.parsed_files.extend(p for p, d in file_digests)
+                return
+
+        if self._pool:
+            self._pending_subninja_keys.append(key)
+            self._parse_subninja_async(path, encoding)
+            return
+
+        # Evaluate the statements and keep the results.
+        indexes = (len(self._builds), len(self._rules), len(self._pools),
+                   len(self._defaults), len(self.parsed_files))
+
+        super(IncrementalParser, self)._parse_subninja(path, encoding)
+
+        build_idx, rule_idx, pool_idx, default_idx, file_idx = indexes
+        results = (self._builds[build_idx:], self._rules[rule_idx:],
+                   self._pools[pool_idx:], self._defaults[default_idx:])
+        file_digests = [(p, self._file_digests[p][1])
+                        for p in self.parsed_files[file_idx:]]
+        self._subninjas[key] = (file_digests, results)
+
+
+    def _merge_subninja_results(self):
+        pending_subninjas = self._pending_subninjas
+        keys = self._pending_subninja_keys
+        self._pending_subninja_keys = []
+
+        super(IncrementalParser, self)._merge_subninja_results()
+
+        for key, (indexes, async_result) in zip(keys, pending_subninjas):
+            builds, rules, pools, defaults, parsed_files = async_result.get()
+            file_digests = [(p, self._get_file_digest(p))
+                            for p in parsed_files]
+            self._subninjas[key] = \
+                    (file_digests, (builds, rules, pools, defaults))
 
 
 class DepFileError(ValueError):
@@ -982,6 +1549,907 @@ class DepFileParser(object):
         return self._path_deps
 
 
+class DepFileReader(object):
+    """Memory-mapped ninja deps log reader for ``.ninja_deps`` file.
+
+    Unlike ``DepFileParser``, this reader only builds an index of the record
+    offsets when the file is opened.  The paths and the implicit inputs of
+    an output are decoded when the output is looked up.
+
+    Example:
+        >>> deps = DepFileReader('out/.ninja_deps', 'utf-8')
+        >>> record = deps.get('out/soong/.intermediates/foo.o')
+        >>> print(record.implicit_ins)
+    """
+
+    MAX_RECORD_SIZE = (1 << 19) - 1
+
+
+    def __init__(self, path, encoding):
+        self._encoding = encoding
+
+        with open(path, 'rb') as fp:
+            try:
+                self._buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise DepFileError('bad magic word')  # Empty file
+
+        # Offsets and sizes of the path records
+        self._path_offsets = array.array(_UINT64_TYPECODE)
+        self._path_sizes = array.array(_UINT32_TYPECODE)
+
+        # Map from an output path ID to (offset, number of implicit inputs,
+        # mtime) of the latest deps record
+        self._deps = {}
+
+        # Lazily decoded paths
+        self._paths = {}
+        self._out_ids = None
+
+        self._build_index()
+
+
+    def _build_index(self):
+        buf = self._buf
+        end = len(buf)
+
+        # Check the magic word
+        magic = b'# ninjadeps\n'
+        if buf[0:len(magic)] != magic:
+            raise DepFileError('bad magic word')
+        pos = len(magic)
+
+        # Check the file format version
+        if pos + 4 > end:
+            raise DepFileError('truncated deps log')
+        version = struct.unpack_from('<I', buf, pos)[0]
+        if version != 3:
+            raise DepFileError('unsupported deps log version: ' + str(version))
+        pos += 4
+
+        # Index the records
+        unpack_from = struct.unpack_from
+        path_offsets = self._path_offsets
+        path_sizes = self._path_sizes
+        deps = self._deps
+        while pos < end:
+            if pos + 4 > end:
+                raise DepFileError('truncated deps log')
+            record_size = unpack_from('<I', buf, pos)[0]
+            pos += 4
+
+            is_dep = record_size >> 31
+            record_size &= (1 << 31) - 1
+
+            if record_size > self.MAX_RECORD_SIZE:
+                raise DepFileError('record size overflow')
+            if pos + record_size > end:
+                raise DepFileError('truncated deps log')
+
+            if is_dep:
+                if record_size % 4 != 0 or record_size < 8:
+                    raise DepFileError('corrupted deps record')
+                out_id, mtime = unpack_from('<II', buf, pos)
+                if out_id >= len(path_offsets):
+                    raise DepFileError('path index overflow')
+                old = deps.get(out_id)
+                if old is None or old[2] <= mtime:
+                    deps[out_id] = (pos + 8, (record_size - 8) // 4, mtime)
+            else:
+                if record_size < 4:
+                    raise DepFileError('corrupted path record')
+                checksum = 0xffffffff ^ unpack_from(
+                        '<I', buf, pos + record_size - 4)[0]
+                if len(path_offsets) != checksum:
+                    raise DepFileError('bad path record checksum')
+                path_offsets.append(pos)
+                path_sizes.append(record_size - 4)
+
+            pos += record_size
+
+
+    def _get_path(self, index):
+        try:
+            return self._paths[index]
+        except KeyError:
+            pass
+        try:
+            offset = self._path_offsets[index]
+        except IndexError:
+            raise DepFileError('path index overflow')
+        path = DepFileParser._extract_path(
+                self._buf[offset:offset + self._path_sizes[index]],
+                self._encoding)
+        self._paths[index] = path
+        return path
+
+
+    def _get_out_ids(self):
+        """Get the map from output paths to path IDs.  Only the paths of the
+        outputs with deps records are decoded."""
+        if self._out_ids is None:
+            self._out_ids = dict((self._get_path(out_id), out_id)
+                                 for out_id in self._deps)
+        return self._out_ids
+
+
+    def __len__(self):
+        return len(self._deps)
+
+
+    def __iter__(self):
+        return iter(self._get_out_ids())
+
+
+    def __contains__(self, explicit_out):
+        return explicit_out in self._get_out_ids()
+
+
+    def get(self, explicit_out, default=None):
+        """Look up the deps record of an output.
+
+        Returns:
+            DepFileRecord: The latest deps record of the output.
+        """
+        out_id = self._get_out_ids().get(explicit_out)
+        if out_id is None:
+            return default
+        offset, count, mtime = self._deps[out_id]
+        ids = _unpack_uint32_array(self._buf, offset, count * 4)
+        implicit_ins = [self._get_path(p) for p in ids]
+        return DepFileRecord(out_id, explicit_out, mtime, implicit_ins)
+
+
+def _write_section_file(path, magic, version, sections):
+    """Write a section file.
+
+    A section file starts with a magic line, a version number, and a section
+    table with the (offset, size) of each section.  All integers are
+    little-endian and all sections are aligned to 8 bytes.  The file is
+    written to a temporary file first and then renamed to ``path``, thus
+    readers never see partially written files.
+    """
+
+    offset = (len(magic) + 8 + 16 * len(sections) + 7) & ~7
+    table = []
+    for data in sections:
+        table.append(offset)
+        table.append(len(data))
+        offset = (offset + len(data) + 7) & ~7
+
+    tmp_path = path + '.tmp' + str(os.getpid())
+    try:
+        with open(tmp_path, 'wb') as fp:
+            fp.write(magic)
+            fp.write(struct.pack('<II', version, len(sections)))
+            fp.write(struct.pack('<' + 'QQ' * len(sections), *table))
+            for offset, data in zip(table[0::2], sections):
+                fp.write(b'\0' * (offset - fp.tell()))
+                fp.write(data)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _encode_str_table(strs):
+    """Encode strings into (offsets, data) sections.  The offsets section
+    has an extra end offset."""
+    offsets = [0]
+    data = []
+    size = 0
+    for s in strs:
+        if not isinstance(s, bytes):
+            s = s.encode('utf-8')
+        data.append(s)
+        size += len(s)
+        offsets.append(size)
+    return (_pack_uint32_array(offsets), b''.join(data))
+
+
+class _SectionFile(object):
+    """Memory-mapped section file reader (see ``_write_section_file``)."""
+
+
+    def __init__(self, path, magic, version, num_sections, error_class):
+        with open(path, 'rb') as fp:
+            try:
+                self.buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise error_class('empty file')
+
+        header_size = len(magic) + 8
+        if self.buf[0:len(magic)] != magic:
+            raise error_class('bad magic word')
+        if len(self.buf) < header_size:
+            raise error_class('truncated file')
+
+        file_version, file_num_sections = struct.unpack(
+                '<II', self.buf[len(magic):header_size])
+        if file_version != version:
+            raise error_class('unsupported version: ' + str(file_version))
+        if file_num_sections != num_sections:
+            raise error_class('bad section count')
+
+        table_size = 16 * num_sections
+        if len(self.buf) < header_size + table_size:
+            raise error_class('truncated file')
+        table = struct.unpack('<' + 'QQ' * num_sections,
+                              self.buf[header_size:header_size + table_size])
+        self.sections = list(zip(table[0::2], table[1::2]))
+        for offset, size in self.sections:
+            if offset + size > len(self.buf):
+                raise error_class('truncated file')
+
+        self._arrays = {}
+
+
+    def get_bytes(self, section):
+        offset, size = self.sections[section]
+        return self.buf[offset:offset + size]
+
+
+    def get_uint32_array(self, section):
+        try:
+            return self._arrays[section]
+        except KeyError:
+            offset, size = self.sections[section]
+            arr = _unpack_uint32_array(self.buf, offset, size)
+            self._arrays[section] = arr
+            return arr
+
+
+    def get_str_table(self, offsets_section, data_section):
+        return _SectionStrTable(self, offsets_section, data_section)
+
+
+class _SectionStrTable(Sequence):
+    """String table in a section file.  Strings are decoded on demand."""
+
+
+    def __init__(self, section_file, offsets_section, data_section):
+        self._buf = section_file.buf
+        self._offsets = section_file.get_uint32_array(offsets_section)
+        self._data_offset = section_file.sections[data_section][0]
+        self._strs = [None] * (len(self._offsets) - 1)
+
+
+    def __len__(self):
+        return len(self._strs)
+
+
+    def get_bytes(self, sid):
+        start = self._data_offset + self._offsets[sid]
+        end = self._data_offset + self._offsets[sid + 1]
+        return self._buf[start:end]
+
+
+    def __getitem__(self, sid):
+        s = self._strs[sid]
+        if s is None:
+            s = self.get_bytes(sid)
+            if sys.version_info >= (3,):
+                s = s.decode('utf-8')
+            s = intern(s)
+            self._strs[sid] = s
+        return s
+
+
+class ManifestCacheError(ValueError):
+    pass
+
+
+class _CacheSection(object):
+    """Section ID enumerations for the manifest cache file."""
+
+    META = 0  # String IDs of the manifest path, the encoding and the deps path
+    FILES = 1  # (string ID, mtime_ns, size) records of the parsed files
+    STR_OFFSETS = 2  # String start offsets (with an extra end offset)
+    STR_DATA = 3  # UTF-8 encoded string data
+    BUILD_RULES = 4  # Rule name string ID for each build
+    BUILD_PATH_INDEX = 5  # Offsets to BUILD_PATHS for each path list
+    BUILD_PATHS = 6  # Path string IDs of all builds
+    BUILD_BINDING_INDEX = 7  # Offsets to BINDINGS for each build
+    RULE_NAMES = 8  # Name string ID for each rule
+    RULE_BINDING_INDEX = 9  # Offsets to BINDINGS for each rule
+    POOL_NAMES = 10  # Name string ID for each pool
+    POOL_BINDING_INDEX = 11  # Offsets to BINDINGS for each pool
+    BINDINGS = 12  # Encoded variable bindings
+    DEFAULT_PATH_INDEX = 13  # Offsets to DEFAULT_PATHS for each default
+    DEFAULT_PATHS = 14  # Path string IDs of all defaults
+
+    COUNT = 15
+
+
+_BUILD_PATH_FIELDS = ('explicit_outs', 'implicit_outs', 'explicit_ins',
+                      'implicit_ins', 'prerequisites', 'depfile_implicit_ins')
+
+
+class ManifestCacheWriter(object):
+    """Ninja manifest cache writer.
+
+    A manifest cache file starts with a magic line and a version number,
+    followed by a section table and the sections.  All strings are interned
+    in a string table and referred by uint32 string IDs.  The path lists of
+    builds and defaults are stored in flat uint32 arrays with separate offset
+    arrays, thus the cache can be memory-mapped and decoded lazily.
+
+    Variable bindings are encoded as a sequence of ``key, count, segments``,
+    where ``segments`` are the string IDs of an ``EvalString``.  A plain
+    ``str`` value is encoded with ``count == 0`` and one string ID.  The
+    parent scopes of the build bindings are not kept.
+    """
+
+    MAGIC = b'# ninjacache\n'
+    VERSION = 1
+    NO_STR = 0xffffffff
+
+
+    def __init__(self):
+        self._strs = []
+        self._str_ids = {}
+        self._bindings = []
+
+
+    def _intern(self, s):
+        try:
+            return self._str_ids[s]
+        except KeyError:
+            sid = len(self._strs)
+            self._strs.append(s)
+            self._str_ids[s] = sid
+            return sid
+
+
+    def _encode_bindings(self, env):
+        """Encode variable bindings and return the end offset in BINDINGS."""
+        if env:
+            out = self._bindings
+            for key, value in env.items():
+                out.append(self._intern(key))
+                if type(value) is str:
+                    out.append(0)
+                    out.append(self._intern(value))
+                else:
+                    out.append(len(value))
+                    out.extend(self._intern(seg) for seg in value)
+        return len(self._bindings)
+
+
+    def write(self, path, manifest, parsed_files, manifest_path, encoding,
+              deps_path=None):
+        """Write the manifest cache file.
+
+        Args:
+            path (str): Output cache file path.
+            manifest (Manifest): Parsed manifest.
+            parsed_files (list): Paths of all files read by the parser.
+            manifest_path (str): Absolute path of the input manifest.
+            encoding (str): Encoding of the input manifest.
+            deps_path (str): Absolute path of the `.ninja_deps` file.
+        """
+
+        sections = [b''] * _CacheSection.COUNT
+
+        meta = [self._intern(manifest_path), self._intern(encoding),
+                self._intern(deps_path) if deps_path else self.NO_STR]
+        sections[_CacheSection.META] = _pack_uint32_array(meta)
+
+        sections[_CacheSection.FILES] = b''.join(
+                struct.pack('<Iqq', self._intern(file_path),
+                            *_get_file_stamp(file_path))
+                for file_path in parsed_files)
+
+        # Encode builds
+        build_rules = []
+        build_path_index = [0]
+        build_paths = []
+        build_binding_index = [0]
+        for build in manifest.builds:
+            build_rules.append(self._intern(build.rule))
+            for field in _BUILD_PATH_FIELDS:
+                build_paths.extend(
+                        self._intern(p) for p in getattr(build, field))
+                build_path_index.append(len(build_paths))
+            build_binding_index.append(self._encode_bindings(build.bindings))
+
+        sections[_CacheSection.BUILD_RULES] = _pack_uint32_array(build_rules)
+        sections[_CacheSection.BUILD_PATH_INDEX] = \
+                _pack_uint32_array(build_path_index)
+        sections[_CacheSection.BUILD_PATHS] = _pack_uint32_array(build_paths)
+        sections[_CacheSection.BUILD_BINDING_INDEX] = \
+                _pack_uint32_array(build_binding_index)
+
+        # Encode rules and pools
+        for records, names_id, index_id in (
+                (manifest.rules, _CacheSection.RULE_NAMES,
+                 _CacheSection.RULE_BINDING_INDEX),
+                (manifest.pools, _CacheSection.POOL_NAMES,
+                 _CacheSection.POOL_BINDING_INDEX)):
+            names = []
+            binding_index = [len(self._bindings)]
+            for record in records:
+                names.append(self._intern(record.name))
+                binding_index.append(self._encode_bindings(record.bindings))
+            sections[names_id] = _pack_uint32_array(names)
+            sections[index_id] = _pack_uint32_array(binding_index)
+
+        sections[_CacheSection.BINDINGS] = _pack_uint32_array(self._bindings)
+
+        # Encode defaults
+        default_path_index = [0]
+        default_paths = []
+        for default in manifest.defaults:
+            default_paths.extend(self._intern(p) for p in default.outs)
+            default_path_index.append(len(default_paths))
+        sections[_CacheSection.DEFAULT_PATH_INDEX] = \
+                _pack_uint32_array(default_path_index)
+        sections[_CacheSection.DEFAULT_PATHS] = \
+                _pack_uint32_array(default_paths)
+
+        # The string table must be encoded after all strings are interned.
+        sections[_CacheSection.STR_OFFSETS], sections[_CacheSection.STR_DATA] = \
+                _encode_str_table(self._strs)
+
+        _write_section_file(path, self.MAGIC, self.VERSION, sections)
+
+
+class _CachedRecordList(Sequence):
+    """Read-only sequence that decodes the records on demand."""
+
+
+    def __init__(self, size, decode):
+        self._size = size
+        self._decode = decode
+
+
+    def __len__(self):
+        return self._size
+
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if index < 0 or index >= self._size:
+            raise IndexError('record index out of range')
+        return self._decode(index)
+
+
+class ManifestCache(object):
+    """Memory-mapped ninja manifest cache reader.
+
+    Opening a cache only reads the section table.  The strings, builds,
+    rules, pools, and defaults are decoded when they are accessed.
+
+    Example:
+        >>> cache = ManifestCache('combined.ninja.cache')
+        >>> if cache.is_up_to_date('/path/to/combined.ninja', 'utf-8'):
+        ...     manifest = cache.get_manifest()
+    """
+
+
+    def __init__(self, path):
+        self._file = _SectionFile(
+                path, ManifestCacheWriter.MAGIC, ManifestCacheWriter.VERSION,
+                _CacheSection.COUNT, ManifestCacheError)
+        self._buf = self._file.buf
+        self._sections = self._file.sections
+        self._get_uint32_section = self._file.get_uint32_array
+        self._strs = self._file.get_str_table(
+                _CacheSection.STR_OFFSETS, _CacheSection.STR_DATA)
+
+
+    def _get_str(self, sid):
+        return self._strs[sid]
+
+
+    def is_up_to_date(self, manifest_path, encoding, deps_path=None):
+        """Check whether the cache was created from the same input files and
+        none of the parsed files have been changed since then."""
+
+        meta = self._get_uint32_section(_CacheSection.META)
+        if self._get_str(meta[0]) != manifest_path:
+            return False
+        if self._get_str(meta[1]) != encoding:
+            return False
+        if meta[2] == ManifestCacheWriter.NO_STR:
+            if deps_path:
+                return False
+        elif self._get_str(meta[2]) != deps_path:
+            return False
+
+        offset, size = self._sections[_CacheSection.FILES]
+        record_size = struct.calcsize('<Iqq')
+        for pos in range(offset, offset + size, record_size):
+            sid, mtime_ns, file_size = struct.unpack(
+                    '<Iqq', self._buf[pos:pos + record_size])
+            try:
+                if _get_file_stamp(self._get_str(sid)) != (mtime_ns, file_size):
+                    return False
+            except OSError:
+                return False
+        return True
+
+
+    def _decode_bindings(self, index_section, index):
+        binding_index = self._get_uint32_section(index_section)
+        start = binding_index[index]
+        end = binding_index[index + 1]
+        if start == end:
+            return None
+
+        bindings = self._get_uint32_section(_CacheSection.BINDINGS)
+        env = EvalEnv()
+        pos = start
+        while pos < end:
+            key = self._get_str(bindings[pos])
+            count = bindings[pos + 1]
+            pos += 2
+            if count == 0:
+                env[key] = self._get_str(bindings[pos])
+                pos += 1
+            else:
+                env[key] = EvalString(
+                        self._get_str(sid) for sid in bindings[pos:pos + count])
+                pos += count
+        return env
+
+
+    def _decode_build(self, index):
+        path_index = self._get_uint32_section(_CacheSection.BUILD_PATH_INDEX)
+        paths = self._get_uint32_section(_CacheSection.BUILD_PATHS)
+        rules = self._get_uint32_section(_CacheSection.BUILD_RULES)
+
+        build = Build()
+        build.rule = self._get_str(rules[index])
+
+        base = index * len(_BUILD_PATH_FIELDS)
+        for i, field in enumerate(_BUILD_PATH_FIELDS):
+            start = path_index[base + i]
+            end = path_index[base + i + 1]
+            setattr(build, field,
+                    [self._get_str(sid) for sid in paths[start:end]])
+        build.depfile_implicit_ins = tuple(build.depfile_implicit_ins)
+
+        build.bindings = self._decode_bindings(
+                _CacheSection.BUILD_BINDING_INDEX, index)
+        return build
+
+
+    def _decode_rule(self, index):
+        rule = Rule()
+        names = self._get_uint32_section(_CacheSection.RULE_NAMES)
+        rule.name = self._get_str(names[index])
+        rule.bindings = self._decode_bindings(
+                _CacheSection.RULE_BINDING_INDEX, index) or EvalEnv()
+        return rule
+
+
+    def _decode_pool(self, index):
+        pool = Pool()
+        names = self._get_uint32_section(_CacheSection.POOL_NAMES)
+        pool.name = self._get_str(names[index])
+        pool.bindings = self._decode_bindings(
+                _CacheSection.POOL_BINDING_INDEX, index) or EvalEnv()
+        return pool
+
+
+    def _decode_default(self, index):
+        path_index = self._get_uint32_section(_CacheSection.DEFAULT_PATH_INDEX)
+        paths = self._get_uint32_section(_CacheSection.DEFAULT_PATHS)
+        default = Default()
+        default.outs = [self._get_str(sid) for sid in
+                        paths[path_index[index]:path_index[index + 1]]]
+        return default
+
+
+    def _get_section_count(self, section):
+        offset, size = self._sections[section]
+        return size // 4
+
+
+    def get_manifest(self):
+        """Create a ``Manifest`` whose records are decoded on demand."""
+        return Manifest(
+                _CachedRecordList(
+                        self._get_section_count(_CacheSection.BUILD_RULES),
+                        self._decode_build),
+                _CachedRecordList(
+                        self._get_section_count(_CacheSection.RULE_NAMES),
+                        self._decode_rule),
+                _CachedRecordList(
+                        self._get_section_count(_CacheSection.POOL_NAMES),
+                        self._decode_pool),
+                _CachedRecordList(
+                        self._get_section_count(
+                                _CacheSection.DEFAULT_PATH_INDEX) - 1,
+                        self._decode_default))
+
+
+def load_manifest_cache(cache_path, manifest_path, encoding, deps_path=None):
+    """Load a manifest from a cache file.
+
+    Returns:
+        Manifest: The cached manifest, or None if the cache file does not
+        exist, is corrupted, or is out of date.
+    """
+    try:
+        cache = ManifestCache(cache_path)
+    except (IOError, OSError, ManifestCacheError, struct.error):
+        return None
+    if not cache.is_up_to_date(manifest_path, encoding, deps_path):
+        return None
+    return cache.get_manifest()
+
+
+class GraphIndexError(ValueError):
+    pass
+
+
+class EDGE(object):
+    """Edge kind enumerations for ``GraphIndex``."""
+
+    EXPLICIT = 0
+    IMPLICIT = 1
+    DEPFILE = 2
+    ORDER_ONLY = 3
+
+    NAMES = ('explicit', 'implicit', 'depfile', 'order_only')
+
+    # Edge kinds that are followed by default (same as the list_*.py tools)
+    DEFAULT_KINDS = frozenset((EXPLICIT, IMPLICIT, DEPFILE))
+
+
+class _GraphSection(object):
+    """Section ID enumerations for the graph index file."""
+
+    SOURCE_STAMP = 0  # (mtime_ns, size) of the manifest cache file
+    STR_OFFSETS = 1  # Node path start offsets (with an extra end offset)
+    STR_DATA = 2  # UTF-8 encoded node paths in sorted order
+    FWD_OFFSETS = 3  # Offsets to FWD_TARGETS for each node
+    FWD_TARGETS = 4  # Node IDs of the inputs
+    FWD_KINDS = 5  # Edge kind (uint8) for each FWD_TARGETS entry
+    REV_OFFSETS = 6  # Offsets to REV_TARGETS for each node
+    REV_TARGETS = 7  # Node IDs of the outputs that depend on a node
+    REV_KINDS = 8  # Edge kind (uint8) for each REV_TARGETS entry
+
+    COUNT = 9
+
+
+def _unpack_uint8_array(buf):
+    """Create a read-only uint8 sequence for a buffer."""
+    if sys.version_info >= (3,):
+        return memoryview(buf)
+    return array.array('B', buf)  # Python 2
+
+
+class GraphIndex(object):
+    """File dependency graph with forward and reverse adjacency arrays.
+
+    Each path is a node identified by its index in the sorted path table.
+    There is an edge from every output of a build to each of its inputs,
+    labeled with an ``EDGE`` kind.  The adjacency lists are stored in
+    compressed sparse row arrays, thus a saved index can be memory-mapped and
+    queried without decoding the whole graph.
+
+    Example:
+        >>> index = GraphIndex.from_manifest(manifest)
+        >>> index.get_deps('out/target/product/generic/system/bin/ls')
+        >>> index.get_rdeps('external/toybox/main.c')
+    """
+
+    MAGIC = b'# ninjagraph\n'
+    VERSION = 1
+
+
+    def __init__(self, paths, fwd, rev, source_stamp=None):
+        """Create a graph index.
+
+        Args:
+            paths: Sorted sequence of node paths.
+            fwd: (offsets, targets, kinds) arrays of the forward edges.
+            rev: (offsets, targets, kinds) arrays of the reverse edges.
+            source_stamp: (mtime_ns, size) of the manifest cache file.
+        """
+        self._paths = paths
+        self._fwd = fwd
+        self._rev = rev
+        self.source_stamp = source_stamp
+
+
+    @classmethod
+    def from_manifest(cls, manifest, source_stamp=None):
+        """Build a graph index from a manifest."""
+
+        edges = collections.defaultdict(dict)
+        for build in manifest.builds:
+            ins = []
+            for kind, paths in ((EDGE.EXPLICIT, build.explicit_ins),
+                                (EDGE.IMPLICIT, build.implicit_ins),
+                                (EDGE.DEPFILE, build.depfile_implicit_ins),
+                                (EDGE.ORDER_ONLY, build.prerequisites)):
+                ins.extend((path, kind) for path in paths)
+            for out in itertools.chain(build.explicit_outs,
+                                       build.implicit_outs):
+                out_edges = edges[out]
+                for path, kind in ins:
+                    # Keep the strongest edge kind if there are duplicates.
+                    if out_edges.get(path, kind) >= kind:
+                        out_edges[path] = kind
+
+        # Assign node IDs in the sorted order so that the paths can be looked
+        # up with binary search.
+        paths = set(edges)
+        for out_edges in edges.values():
+            paths.update(out_edges)
+        paths = sorted(paths)
+        node_ids = dict((path, i) for i, path in enumerate(paths))
+
+        fwd_lists = [[] for _ in paths]
+        rev_lists = [[] for _ in paths]
+        for out, out_edges in edges.items():
+            out_id = node_ids[out]
+            for path, kind in out_edges.items():
+                in_id = node_ids[path]
+                fwd_lists[out_id].append((in_id, kind))
+                rev_lists[in_id].append((out_id, kind))
+
+        return cls(paths, cls._to_csr(fwd_lists), cls._to_csr(rev_lists),
+                   source_stamp)
+
+
+    @staticmethod
+    def _to_csr(adjacency_lists):
+        offsets = array.array(_UINT32_TYPECODE, [0])
+        targets = array.array(_UINT32_TYPECODE)
+        kinds = array.array('B')
+        for node_edges in adjacency_lists:
+            node_edges.sort()
+            for target, kind in node_edges:
+                targets.append(target)
+                kinds.append(kind)
+            offsets.append(len(targets))
+        return (offsets, targets, kinds)
+
+
+    def save(self, path):
+        """Save the graph index to a file."""
+
+        sections = [b''] * _GraphSection.COUNT
+        sections[_GraphSection.SOURCE_STAMP] = \
+                struct.pack('<qq', *(self.source_stamp or (-1, -1)))
+        sections[_GraphSection.STR_OFFSETS], sections[_GraphSection.STR_DATA] = \
+                _encode_str_table(self._paths)
+        for (offsets, targets, kinds), base in (
+                (self._fwd, _GraphSection.FWD_OFFSETS),
+                (self._rev, _GraphSection.REV_OFFSETS)):
+            sections[base] = _pack_uint32_array(offsets)
+            sections[base + 1] = _pack_uint32_array(targets)
+            sections[base + 2] = bytes(bytearray(kinds))
+        _write_section_file(path, self.MAGIC, self.VERSION, sections)
+
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a graph index file."""
+
+        section_file = _SectionFile(path, cls.MAGIC, cls.VERSION,
+                                    _GraphSection.COUNT, GraphIndexError)
+        paths = section_file.get_str_table(
+                _GraphSection.STR_OFFSETS, _GraphSection.STR_DATA)
+
+        def _load_csr(base):
+            offset, size = section_file.sections[base + 2]
+            return (section_file.get_uint32_array(base),
+                    section_file.get_uint32_array(base + 1),
+                    _unpack_uint8_array(
+                            section_file.buf[offset:offset + size]))
+
+        source_stamp = struct.unpack(
+                '<qq', section_file.get_bytes(_GraphSection.SOURCE_STAMP))
+        if source_stamp == (-1, -1):
+            source_stamp = None
+
+        return cls(paths, _load_csr(_GraphSection.FWD_OFFSETS),
+                   _load_csr(_GraphSection.REV_OFFSETS), source_stamp)
+
+
+    def __len__(self):
+        return len(self._paths)
+
+
+    def get_node_id(self, path):
+        """Find the node ID of a path with binary search."""
+        index = bisect.bisect_left(self._paths, path)
+        if index < len(self._paths) and self._paths[index] == path:
+            return index
+        return None
+
+
+    def get_path(self, node_id):
+        return self._paths[node_id]
+
+
+    def iter_edges(self, node_id, reverse=False, kinds=EDGE.DEFAULT_KINDS):
+        """Iterate the (node ID, edge kind) pairs adjacent to a node."""
+        offsets, targets, edge_kinds = self._rev if reverse else self._fwd
+        for i in range(offsets[node_id], offsets[node_id + 1]):
+            kind = edge_kinds[i]
+            if kind in kinds:
+                yield (targets[i], kind)
+
+
+    def _collect(self, path, reverse, transitive, kinds):
+        node_id = self.get_node_id(path)
+        if node_id is None:
+            raise KeyError(path)
+
+        visited = {node_id}
+        stack = [node_id]
+        while stack:
+            for next_id, _ in self.iter_edges(stack.pop(), reverse, kinds):
+                if next_id not in visited:
+                    visited.add(next_id)
+                    if transitive:
+                        stack.append(next_id)
+        visited.remove(node_id)
+        return sorted(self._paths[i] for i in visited)
+
+
+    def get_deps(self, path, transitive=True, kinds=EDGE.DEFAULT_KINDS):
+        """List the (transitive) inputs of a path.
+
+        Raises:
+            KeyError: The path is not in the graph.
+        """
+        return self._collect(path, False, transitive, kinds)
+
+
+    def get_rdeps(self, path, transitive=True, kinds=EDGE.DEFAULT_KINDS):
+        """List the (transitive) outputs that depend on a path.
+
+        Raises:
+            KeyError: The path is not in the graph.
+        """
+        return self._collect(path, True, transitive, kinds)
+
+
+    def find_path(self, src, dst, kinds=EDGE.DEFAULT_KINDS):
+        """Find the shortest dependency path from ``src`` to ``dst``.
+
+        Returns:
+            A list of paths starting with ``src`` and ending with ``dst``, or
+            None if ``src`` does not depend on ``dst``.
+
+        Raises:
+            KeyError: ``src`` or ``dst`` is not in the graph.
+        """
+        src_id = self.get_node_id(src)
+        if src_id is None:
+            raise KeyError(src)
+        dst_id = self.get_node_id(dst)
+        if dst_id is None:
+            raise KeyError(dst)
+
+        prev = {src_id: None}
+        queue = collections.deque([src_id])
+        while queue:
+            node_id = queue.popleft()
+            if node_id == dst_id:
+                result = []
+                while node_id is not None:
+                    result.append(self._paths[node_id])
+                    node_id = prev[node_id]
+                result.reverse()
+                return result
+            for next_id, _ in self.iter_edges(node_id, False, kinds):
+                if next_id not in prev:
+                    prev[next_id] = node_id
+                    queue.append(next_id)
+        return None
+
+
 def _parse_args():
     """Parse command line options."""
 
@@ -995,8 +2463,23 @@ def _parse_args():
         parser.add_argument('--encoding', default='utf-8',
                             help='ninja file encoding')
 
+    # The dump sub-command streams the records with Parser.iter_parse(), so
+    # the options to load the whole manifest only apply to the others.
+    def _register_manifest_load_args(parser):
+        parser.add_argument('--cache-file',
+                            help='manifest cache file (default: '
+                                 '${input_file}.cache)')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='do not read or write manifest cache')
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='number of processes to parse subninja files')
+        parser.add_argument('--incremental', action='store_true',
+                            help='re-parse changed files only (with the '
+                                 'parser state in ${input_file}.state)')
+
     # dump sub-command
-    parser_dump = subparsers.add_parser('dump', help='dump dependency graph')
+    parser_dump = subparsers.add_parser(
+            'dump', help='dump dependency graph (in the order of statements)')
     _register_input_file_args(parser_dump)
     parser_dump.add_argument('-o', '--output', help='output file')
 
@@ -1004,6 +2487,7 @@ def _parse_args():
     parser_pickle = subparsers.add_parser(
             'pickle', help='serialize dependency graph with pickle')
     _register_input_file_args(parser_pickle)
+    _register_manifest_load_args(parser_pickle)
     parser_pickle.add_argument('-o', '--output', required=True,
                                help='output file')
 
@@ -1016,64 +2500,188 @@ def _parse_args():
     return args
 
 
-def load_manifest_from_args(args):
-    """Load the input manifest specified by command line options."""
+def get_cache_path_from_args(args):
+    """Get the manifest cache file path specified by command line options."""
+
+    if getattr(args, 'no_cache', False):
+        return None
+    cache_file = getattr(args, 'cache_file', None)
+    if cache_file:
+        return cache_file
+    return os.path.join(args.cwd or os.getcwd(), args.input_file) + '.cache'
+
+
+def get_state_path_from_args(args):
+    """Get the incremental parser state file path specified by command line
+    options."""
+
+    if not getattr(args, 'incremental', False):
+        return None
+    return os.path.join(args.cwd or os.getcwd(), args.input_file) + '.state'
+
+
+def _load_manifest_and_cache_stamp_from_args(args):
+    """Load the input manifest specified by command line options.
+
+    Returns:
+        A (manifest, cache_stamp) pair where cache_stamp is the (mtime_ns,
+        size) of the up-to-date manifest cache file or None if the manifest
+        is not backed by a cache file.
+    """
 
     input_file = args.input_file
 
     # If the input file name ends with `.pickle`, load it with pickle.load().
     if input_file.endswith('.pickle'):
         with open(input_file, 'rb') as pickle_file:
-            return pickle.load(pickle_file)
+            return (pickle.load(pickle_file), None)
+
+    base_dir = args.cwd or os.getcwd()
+    manifest_path = os.path.abspath(os.path.join(base_dir, input_file))
+    deps_path = os.path.abspath(args.ninja_deps) if args.ninja_deps else None
+
+    # Load the manifest from the cache file
+    cache_path = get_cache_path_from_args(args)
+    if cache_path:
+        manifest = load_manifest_cache(
+                cache_path, manifest_path, args.encoding, deps_path)
+        if manifest is not None:
+            return (manifest, _get_file_stamp(cache_path))
 
     # Parse the ninja file
-    return Parser(args.cwd).parse(args.input_file, args.encoding,
-                                  args.ninja_deps)
+    state_path = get_state_path_from_args(args)
+    if state_path:
+        parser = IncrementalParser(state_path, args.cwd,
+                                   getattr(args, 'jobs', 1))
+    else:
+        parser = Parser(args.cwd, getattr(args, 'jobs', 1))
+    manifest = parser.parse(input_file, args.encoding, args.ninja_deps)
 
+    # Re-create the cache file
+    if cache_path:
+        try:
+            ManifestCacheWriter().write(
+                    cache_path, manifest, parser.parsed_files, manifest_path,
+                    args.encoding, deps_path)
+            return (manifest, _get_file_stamp(cache_path))
+        except (IOError, OSError) as e:
+            print('warning: Failed to write manifest cache:', e,
+                  file=sys.stderr)
 
-def dump_manifest(manifest, file):
-    """Dump a manifest to a text file."""
+    return (manifest, None)
+
+
+def load_manifest_from_args(args):
+    """Load the input manifest specified by command line options.
 
-    for rule in manifest.rules:
-        print('rule', rule.name, file=file)
+    If a manifest cache is available and none of the parsed files have been
+    changed, the manifest is loaded from the cache.  Otherwise, the input
+    files are parsed and the cache is re-created.
+    """
+    return _load_manifest_and_cache_stamp_from_args(args)[0]
+
+
+def load_graph_index_from_args(args):
+    """Load the graph index of the input manifest specified by command line
+    options.
+
+    The graph index is saved to ``${input_file}.graph`` (or the path
+    specified by ``--graph-file``) together with the stamp of the manifest
+    cache file.  It is rebuilt when the manifest cache is re-created.
+    """
+
+    manifest, cache_stamp = _load_manifest_and_cache_stamp_from_args(args)
+    if cache_stamp is None:
+        return GraphIndex.from_manifest(manifest)
+
+    graph_path = getattr(args, 'graph_file', None) or \
+            os.path.join(args.cwd or os.getcwd(), args.input_file) + '.graph'
+    try:
+        index = GraphIndex.load(graph_path)
+        if index.source_stamp == cache_stamp:
+            return index
+    except (IOError, OSError, GraphIndexError, struct.error):
+        pass
 
-    for build in manifest.builds:
+    index = GraphIndex.from_manifest(manifest, cache_stamp)
+    try:
+        index.save(graph_path)
+    except (IOError, OSError) as e:
+        print('warning: Failed to write graph index:', e, file=sys.stderr)
+    return index
+
+
+def dump_record(record, file):
+    """Dump a ``Build``, ``Rule``, ``Pool``, or ``Default`` to a text file."""
+
+    if isinstance(record, Build):
         print('build', file=file)
-        for path in build.explicit_outs:
+        for path in record.explicit_outs:
             print('  explicit_out:', path, file=file)
-        for path in build.implicit_outs:
+        for path in record.implicit_outs:
             print('  implicit_out:', path, file=file)
-        for path in build.explicit_ins:
+        for path in record.explicit_ins:
             print('  explicit_in:', path, file=file)
-        for path in build.implicit_ins:
+        for path in record.implicit_ins:
             print('  implicit_in:', path, file=file)
-        for path in build.prerequisites:
+        for path in record.prerequisites:
             print('  prerequisites:', path, file=file)
-        for path in build.depfile_implicit_ins:
+        for path in record.depfile_implicit_ins:
             print('  depfile_implicit_in:', path, file=file)
-
-    for pool in manifest.pools:
-        print('pool', pool.name, file=file)
-
-    for default in manifest.defaults:
+    elif isinstance(record, Rule):
+        print('rule', record.name, file=file)
+    elif isinstance(record, Pool):
+        print('pool', record.name, file=file)
+    else:
         print('default', file=file)
-        for path in default.outs:
+        for path in record.outs:
             print('  out:', path, file=file)
 
 
+def dump_manifest(manifest, file):
+    """Dump a manifest to a text file."""
+
+    for records in (manifest.rules, manifest.builds, manifest.pools,
+                    manifest.defaults):
+        for record in records:
+            dump_record(record, file)
+
+
+def dump_from_args(args, file):
+    """Dump the input manifest specified by command line options.
+
+    The ninja files are parsed with ``Parser.iter_parse()`` and the records
+    are written in the order of the statements as soon as they are parsed.
+    Pickled manifests are dumped with ``dump_manifest()``.
+    """
+
+    if args.input_file.endswith('.pickle'):
+        dump_manifest(load_manifest_from_args(args), file)
+        return
+
+    parser = Parser(args.cwd)
+    for record in parser.iter_parse(args.input_file, args.encoding,
+                                    args.ninja_deps):
+        dump_record(record, file)
+
+
 def command_dump_main(args):
     """Main function for the dump sub-command"""
     if args.output is None:
-        dump_manifest(load_manifest_from_args(args), sys.stdout)
+        dump_from_args(args, sys.stdout)
     else:
         with open(args.output, 'w') as output_file:
-            dump_manifest(load_manifest_from_args(args), output_file)
+            dump_from_args(args, output_file)
 
 
 def command_pickle_main(args):
     """Main function for the pickle sub-command"""
+    # The records loaded from the manifest cache are backed by the mmap of the
+    # cache file, thus they are copied into lists before pickling.
+    manifest = Manifest(*[list(records)
+                          for records in load_manifest_from_args(args)])
     with open(args.output, 'wb') as output_file:
-        pickle.dump(load_manifest_from_args(args), output_file)
+        pickle.dump(manifest, output_file)
 
 
 def main():
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+"""Serve dependency queries on a ninja graph over HTTP on localhost.
+
+The server loads (or builds) the graph index once and answers the queries
+with JSON responses:
+
+- ``/deps?path=P`` lists the transitive inputs of ``P``.
+- ``/rdeps?path=P`` lists the transitive outputs that depend on ``P``.
+- ``/installed?path=P`` lists the installed files that depend on ``P``.
+- ``/path?from=A&to=B`` finds a dependency path from ``A`` to ``B``.
+
+``/deps`` and ``/rdeps`` accept ``direct=1`` to list the direct neighbors
+only.  All queries accept ``kinds=explicit,implicit,depfile,order_only`` to
+select the edge kinds to follow (default: ``explicit,implicit,depfile``).
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import posixpath
+import re
+import sys
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # Python 3
+    from urllib.parse import parse_qs, urlparse
+
+import ninja
+
+
+def _parse_args():
+    """Parse the command line arguments."""
+
+    parser = argparse.ArgumentParser()
+
+    # Ninja input file options
+    parser.add_argument('input_file', help='input ninja file')
+    parser.add_argument('--ninja-deps', help='.ninja_deps file')
+    parser.add_argument('--cwd', help='working directory for ninja')
+    parser.add_argument('--encoding', default='utf-8',
+                        help='ninja file encoding')
+    parser.add_argument('--cache-file',
+                        help='manifest cache file (default: '
+                             '${input_file}.cache)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write manifest cache')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes to parse subninja files')
+    parser.add_argument('--incremental', action='store_true',
+                        help='re-parse changed files only (with the parser '
+                             'state in ${input_file}.state)')
+    parser.add_argument('--graph-file',
+                        help='graph index file (default: ${input_file}.graph)')
+
+    # Options
+    parser.add_argument(
+            '--out-dir', default='out', help='path to output directory')
+    parser.add_argument(
+            '--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument(
+            '--port', type=int, default=8000, help='port to listen on')
+
+    return parser.parse_args()
+
+
+class QueryError(ValueError):
+    def __init__(self, status, reason):
+        super(QueryError, self).__init__(reason)
+        self.status = status
+
+
+def _get_param(params, name):
+    try:
+        return params[name][0]
+    except (KeyError, IndexError):
+        raise QueryError(400, 'missing parameter: ' + name)
+
+
+def _get_kinds(params):
+    if 'kinds' not in params:
+        return ninja.EDGE.DEFAULT_KINDS
+    try:
+        return frozenset(ninja.EDGE.NAMES.index(name)
+                         for name in _get_param(params, 'kinds').split(','))
+    except ValueError:
+        raise QueryError(400, 'unknown edge kind')
+
+
+def run_query(index, installed_pattern, command, params):
+    """Run a query on a graph index.
+
+    Returns:
+        A JSON serializable ``dict``.
+
+    Raises:
+        QueryError: The query is malformed or the paths are not found.
+    """
+
+    kinds = _get_kinds(params)
+    try:
+        if command in {'deps', 'rdeps', 'installed'}:
+            path = _get_param(params, 'path')
+            transitive = command == 'installed' or \
+                         params.get('direct', ['0'])[0] in {'', '0'}
+            if command == 'deps':
+                results = index.get_deps(path, transitive, kinds)
+            else:
+                results = index.get_rdeps(path, transitive, kinds)
+            if command == 'installed':
+                results = [p for p in results if installed_pattern.match(p)]
+            return {'path': path, 'results': results}
+
+        if command == 'path':
+            src = _get_param(params, 'from')
+            dst = _get_param(params, 'to')
+            return {'from': src, 'to': dst,
+                    'results': index.find_path(src, dst, kinds)}
+    except KeyError as e:
+        raise QueryError(404, 'path not found: ' + str(e.args[0]))
+
+    raise QueryError(404, 'unknown query: ' + command)
+
+
+def create_request_handler(index, installed_pattern):
+    """Create a request handler class for a graph index."""
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            command = url.path.strip('/')
+            try:
+                status = 200
+                result = run_query(index, installed_pattern, command,
+                                   parse_qs(url.query, keep_blank_values=True))
+            except QueryError as e:
+                status = e.status
+                result = {'error': str(e)}
+
+            data = json.dumps(result).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return RequestHandler
+
+
+def main():
+    args = _parse_args()
+
+    out_dir = posixpath.normpath(args.out_dir)
+    installed_pattern = re.compile(re.escape(out_dir) + '/target/product/')
+
+    index = ninja.load_graph_index_from_args(args)
+
+    server = HTTPServer((args.host, args.port),
+                        create_request_handler(index, installed_pattern))
+    print('Serving {} nodes on http://{}:{}/'.format(
+          len(index), args.host, server.server_port), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
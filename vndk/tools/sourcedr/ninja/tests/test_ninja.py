@@ -2,7 +2,12 @@
 
 import ninja
 
+import argparse
 import os
+import pickle
+import shutil
+import struct
+import tempfile
 import unittest
 
 
@@ -578,6 +583,43 @@ class ParserTest(unittest.TestCase):
         env = parser.mocked_env[1]
         self.assertEqual('changed', env['a'])
 
+    def test_subninja_stmt_parallel(self):
+        input_path = os.path.join(TEST_DATA_DIR, 'subninja.ninja')
+
+        parser = ninja.Parser(TEST_DATA_DIR, num_jobs=2)
+        manifest = parser.parse(input_path, ENCODING)
+
+        self.assertEqual(2, len(manifest.builds))
+        self.assertEqual(['out1'], manifest.builds[0].explicit_outs)
+        self.assertEqual(['prebuilt_out1'], manifest.builds[0].explicit_ins)
+        self.assertEqual(['out2'], manifest.builds[1].explicit_outs)
+        self.assertEqual(2, len(parser.parsed_files))
+
+    def test_iter_parse(self):
+        input_path = os.path.join(TEST_DATA_DIR, 'default.ninja')
+
+        parser = ninja.Parser(TEST_DATA_DIR)
+        records = list(parser.iter_parse(input_path, ENCODING))
+
+        self.assertEqual([ninja.Rule, ninja.Build, ninja.Build, ninja.Default],
+                         [type(record) for record in records])
+        self.assertEqual('cc', records[0].name)
+        self.assertEqual(['foo.o'], records[1].explicit_outs)
+        self.assertEqual(['bar.c'], records[2].explicit_ins)
+        self.assertEqual(['foo.o', 'bar.o'], records[3].outs)
+
+        # Records are not kept by the parser.
+        self.assertEqual([], parser._builds)
+        self.assertEqual([], parser._rules)
+
+    def test_iter_parse_subninja(self):
+        input_path = os.path.join(TEST_DATA_DIR, 'subninja.ninja')
+
+        records = list(ninja.Parser(TEST_DATA_DIR).iter_parse(
+                input_path, ENCODING))
+        self.assertEqual([['out1'], ['out2']],
+                         [record.explicit_outs for record in records])
+
     def test_include_stmt(self):
         input_path = os.path.join(TEST_DATA_DIR, 'include.ninja')
 
@@ -627,5 +669,351 @@ class ParserTestWithBadInput(unittest.TestCase):
         self.assertEqual(9, ctx.exception.column)
 
 
+class ManifestCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for name in ('subninja.ninja', 'sub.ninja', 'rule.ninja'):
+            shutil.copy(os.path.join(TEST_DATA_DIR, name), self.tmp_dir)
+        self.cache_path = os.path.join(self.tmp_dir, 'subninja.ninja.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_args(self, input_file='subninja.ninja'):
+        return argparse.Namespace(
+                input_file=input_file, ninja_deps=None, cwd=self.tmp_dir,
+                encoding=ENCODING, cache_file=None, no_cache=False)
+
+    def _write_cache(self, input_file):
+        parser = ninja.Parser(self.tmp_dir)
+        manifest = parser.parse(input_file, ENCODING)
+        manifest_path = os.path.join(self.tmp_dir, input_file)
+        ninja.ManifestCacheWriter().write(
+                self.cache_path, manifest, parser.parsed_files,
+                manifest_path, ENCODING)
+        return (manifest, manifest_path)
+
+    def test_round_trip_builds(self):
+        manifest, manifest_path = self._write_cache('subninja.ninja')
+
+        cache = ninja.ManifestCache(self.cache_path)
+        self.assertTrue(cache.is_up_to_date(manifest_path, ENCODING))
+
+        cached = cache.get_manifest()
+        self.assertEqual(2, len(cached.builds))
+        for build, cached_build in zip(manifest.builds, cached.builds):
+            self.assertEqual(build.rule, cached_build.rule)
+            self.assertEqual(build.explicit_outs, cached_build.explicit_outs)
+            self.assertEqual(build.explicit_ins, cached_build.explicit_ins)
+            self.assertEqual(build.implicit_ins, cached_build.implicit_ins)
+            self.assertEqual((), cached_build.depfile_implicit_ins)
+        self.assertEqual('out2', cached.builds[-1].explicit_outs[0])
+
+    def test_round_trip_rules(self):
+        self._write_cache('rule.ninja')
+
+        cached = ninja.ManifestCache(self.cache_path).get_manifest()
+        self.assertEqual(2, len(cached.rules))
+        self.assertEqual('cc', cached.rules[0].name)
+
+        sb = ninja.EvalStringBuilder()
+        sb.append_raw('gcc -c -o ')
+        sb.append_var('outs')
+        sb.append_raw(' ')
+        sb.append_var('ins')
+        self.assertEqual(sb.getvalue(), cached.rules[0].bindings['command'])
+
+    def test_out_of_date_subninja(self):
+        _, manifest_path = self._write_cache('subninja.ninja')
+
+        with open(os.path.join(self.tmp_dir, 'sub.ninja'), 'a') as fp:
+            fp.write('build out3 : phony prebuilt_out3\n')
+
+        cache = ninja.ManifestCache(self.cache_path)
+        self.assertFalse(cache.is_up_to_date(manifest_path, ENCODING))
+        self.assertFalse(cache.is_up_to_date(manifest_path, 'latin-1'))
+
+    def test_bad_magic_word(self):
+        with open(self.cache_path, 'wb') as fp:
+            fp.write(b'# not a cache\n')
+        with self.assertRaises(ninja.ManifestCacheError):
+            ninja.ManifestCache(self.cache_path)
+
+    def test_load_manifest_from_args(self):
+        args = self._create_args()
+
+        manifest = ninja.load_manifest_from_args(args)
+        self.assertIsInstance(manifest.builds, list)
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        manifest = ninja.load_manifest_from_args(args)
+        self.assertNotIsInstance(manifest.builds, list)
+        self.assertEqual(['out1'], manifest.builds[0].explicit_outs)
+
+        args.no_cache = True
+        manifest = ninja.load_manifest_from_args(args)
+        self.assertIsInstance(manifest.builds, list)
+
+    def test_pickle_from_cache(self):
+        args = self._create_args()
+        args.output = os.path.join(self.tmp_dir, 'subninja.pickle')
+
+        # The second run loads the manifest from the cache.
+        for _ in range(2):
+            ninja.command_pickle_main(args)
+            with open(args.output, 'rb') as fp:
+                manifest = pickle.load(fp)
+            self.assertEqual(2, len(manifest.builds))
+            self.assertEqual(['out1'], manifest.builds[0].explicit_outs)
+            self.assertEqual(['out2'], manifest.builds[1].explicit_outs)
+        self.assertTrue(os.path.exists(self.cache_path))
+
+
+class CountingIncrementalParser(ninja.IncrementalParser):
+    def __init__(self, *args, **kwargs):
+        super(CountingIncrementalParser, self).__init__(*args, **kwargs)
+        self.lexed_stmts = 0
+
+    def _lex_top_level_stmt(self):
+        stmt = super(CountingIncrementalParser, self)._lex_top_level_stmt()
+        if stmt is not None:
+            self.lexed_stmts += 1
+        return stmt
+
+
+class IncrementalParserTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.tmp_dir, 'top.ninja.state')
+        self._write('top.ninja',
+                    'root = a\n'
+                    'subninja sub.ninja\n'
+                    'build out : phony $root/in\n')
+        self._write('sub.ninja', 'build $root/sub_out : phony $root/sub_in\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        # Make sure the mtime changes between the writes.
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+    def _parse(self, num_jobs=1):
+        parser = CountingIncrementalParser(self.state_path, self.tmp_dir,
+                                           num_jobs)
+        manifest = parser.parse('top.ninja', ENCODING)
+        outs = [build.explicit_outs for build in manifest.builds]
+        return (parser, outs)
+
+    def test_reuse_unchanged_files(self):
+        parser, outs = self._parse()
+        self.assertEqual(4, parser.lexed_stmts)
+        self.assertEqual([['a/sub_out'], ['out']], outs)
+
+        parser, outs = self._parse()
+        self.assertEqual(0, parser.lexed_stmts)
+        self.assertEqual([['a/sub_out'], ['out']], outs)
+
+    def test_changed_subninja(self):
+        self._parse()
+
+        self._write('sub.ninja', 'build $root/sub_out2 : phony $root/sub_in\n')
+        parser, outs = self._parse()
+        self.assertEqual(1, parser.lexed_stmts)
+        self.assertEqual([['a/sub_out2'], ['out']], outs)
+
+    def test_changed_parent_binding(self):
+        self._parse()
+
+        # sub.ninja is re-evaluated with the new scope without being lexed.
+        self._write('top.ninja',
+                    'root = b\n'
+                    'subninja sub.ninja\n'
+                    'build out : phony $root/in\n')
+        parser, outs = self._parse()
+        self.assertEqual(3, parser.lexed_stmts)
+        self.assertEqual([['b/sub_out'], ['out']], outs)
+
+    def test_deps_log_not_reused(self):
+        deps_path = os.path.join(self.tmp_dir, '.ninja_deps')
+        _write_deps_log(deps_path, ['a/sub_out', 'foo.h'], [(0, 1, [1])])
+
+        parser = CountingIncrementalParser(self.state_path, self.tmp_dir)
+        manifest = parser.parse('top.ninja', ENCODING, deps_path)
+        self.assertEqual(('foo.h',), manifest.builds[0].depfile_implicit_ins)
+
+        # The reused builds don't keep the inputs from the deps log.
+        parser = CountingIncrementalParser(self.state_path, self.tmp_dir)
+        manifest = parser.parse('top.ninja', ENCODING)
+        self.assertEqual(0, parser.lexed_stmts)
+        self.assertEqual(['a/sub_out'], manifest.builds[0].explicit_outs)
+        self.assertEqual((), manifest.builds[0].depfile_implicit_ins)
+
+    def test_parallel_subninja(self):
+        # sub.ninja is lexed in the process pool instead of this process.
+        parser, outs = self._parse(num_jobs=2)
+        self.assertEqual(3, parser.lexed_stmts)
+        self.assertEqual([['a/sub_out'], ['out']], outs)
+
+        parser, outs = self._parse(num_jobs=2)
+        self.assertEqual(0, parser.lexed_stmts)
+        self.assertEqual([['a/sub_out'], ['out']], outs)
+
+        self._write('sub.ninja', 'build $root/sub_out2 : phony $root/sub_in\n')
+        parser, outs = self._parse(num_jobs=2)
+        self.assertEqual(0, parser.lexed_stmts)
+        self.assertEqual([['a/sub_out2'], ['out']], outs)
+
+
+def _write_deps_log(path, paths, deps):
+    """Write a `.ninja_deps` file with paths and (out, mtime, ins) records."""
+    with open(path, 'wb') as fp:
+        fp.write(b'# ninjadeps\n')
+        fp.write(struct.pack('<I', 3))
+        for i, p in enumerate(paths):
+            data = p.encode('utf-8')
+            data += b'\0' * (-len(data) % 4)
+            fp.write(struct.pack('<I', len(data) + 4))
+            fp.write(data)
+            fp.write(struct.pack('<I', 0xffffffff ^ i))
+        for out, mtime, ins in deps:
+            fp.write(struct.pack('<I', (1 << 31) | (8 + 4 * len(ins))))
+            fp.write(struct.pack('<II', out, mtime))
+            fp.write(struct.pack('<' + 'I' * len(ins), *ins))
+
+
+class DepFileReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.deps_path = os.path.join(self.tmp_dir, '.ninja_deps')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get(self):
+        paths = ['foo.o', 'foo.c', 'foo.h', 'bar.o', 'bar.c', 'common.h']
+        deps = [(0, 1, [1, 2]), (3, 1, [4, 5]), (0, 2, [1, 2, 5])]
+        _write_deps_log(self.deps_path, paths, deps)
+
+        reader = ninja.DepFileReader(self.deps_path, ENCODING)
+        self.assertEqual(2, len(reader))
+        self.assertEqual({'foo.o', 'bar.o'}, set(reader))
+
+        # The record with the latest mtime wins.
+        record = reader.get('foo.o')
+        self.assertEqual(['foo.c', 'foo.h', 'common.h'], record.implicit_ins)
+        self.assertEqual(2, record.mtime)
+        self.assertEqual(['bar.c', 'common.h'], reader.get('bar.o').implicit_ins)
+        self.assertIsNone(reader.get('foo.c'))
+
+    @unittest.skipUnless(hasattr(struct, 'iter_unpack'),
+                         'DepFileParser requires struct.iter_unpack()')
+    def test_compare_with_dep_file_parser(self):
+        paths = ['foo.o', 'foo.c', 'foo.h', 'bar.o', 'bar.c', 'common.h']
+        deps = [(0, 1, [1, 2]), (3, 1, [4, 5]), (0, 2, [1, 2, 5])]
+        _write_deps_log(self.deps_path, paths, deps)
+
+        reader = ninja.DepFileReader(self.deps_path, ENCODING)
+        expected = ninja.DepFileParser().parse(self.deps_path, ENCODING)
+        for out, record in expected.items():
+            self.assertEqual(record.implicit_ins, reader.get(out).implicit_ins)
+
+    def test_bad_magic_word(self):
+        with open(self.deps_path, 'wb') as fp:
+            fp.write(b'# not ninjadeps\n')
+        with self.assertRaises(ninja.DepFileError):
+            ninja.DepFileReader(self.deps_path, ENCODING)
+
+    def test_bad_path_index(self):
+        _write_deps_log(self.deps_path, ['foo.o'], [(0, 1, [5])])
+        reader = ninja.DepFileReader(self.deps_path, ENCODING)
+        with self.assertRaises(ninja.DepFileError):
+            reader.get('foo.o')
+
+    def test_parse_dep_file(self):
+        input_path = os.path.join(TEST_DATA_DIR, 'default.ninja')
+        _write_deps_log(self.deps_path, ['foo.o', 'foo.h', 'bar.h'],
+                        [(0, 1, [1, 2])])
+
+        manifest = ninja.Parser().parse(input_path, ENCODING, self.deps_path)
+        self.assertEqual(('bar.h', 'foo.h'),
+                         manifest.builds[0].depfile_implicit_ins)
+        self.assertEqual((), manifest.builds[1].depfile_implicit_ins)
+
+
+class GraphIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp_dir, 'graph.ninja'), 'w') as fp:
+            fp.write('rule cc\n'
+                     '  command = cc $in\n'
+                     'build a.o : cc a.c | a.h || gen\n'
+                     'build b.o : cc b.c\n'
+                     'build lib.so : cc a.o b.o\n'
+                     'build out/target/product/x/system/lib/lib.so : '
+                     'phony lib.so\n')
+        self.deps_path = os.path.join(self.tmp_dir, '.ninja_deps')
+        _write_deps_log(self.deps_path, ['b.o', 'b.h'], [(0, 1, [1])])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_index(self):
+        manifest = ninja.Parser(self.tmp_dir).parse(
+                'graph.ninja', ENCODING, self.deps_path)
+        return ninja.GraphIndex.from_manifest(manifest)
+
+    def _check_queries(self, index):
+        installed = 'out/target/product/x/system/lib/lib.so'
+
+        self.assertEqual(['a.c', 'a.h', 'a.o', 'b.c', 'b.h', 'b.o', 'lib.so'],
+                         index.get_deps(installed))
+        self.assertEqual(['a.o', 'b.o'], index.get_deps('lib.so', False))
+        self.assertEqual(['a.c', 'a.h', 'gen'], index.get_deps(
+                'a.o', kinds=ninja.EDGE.DEFAULT_KINDS |
+                             {ninja.EDGE.ORDER_ONLY}))
+
+        self.assertEqual(['b.o', 'lib.so', installed], index.get_rdeps('b.h'))
+        self.assertEqual(['b.o'], index.get_rdeps('b.h', False))
+
+        self.assertEqual([installed, 'lib.so', 'a.o', 'a.h'],
+                         index.find_path(installed, 'a.h'))
+        self.assertIsNone(index.find_path('a.h', installed))
+
+        with self.assertRaises(KeyError):
+            index.get_deps('unknown')
+
+    def test_queries(self):
+        self._check_queries(self._create_index())
+
+    def test_save_and_load(self):
+        index_path = os.path.join(self.tmp_dir, 'graph.ninja.graph')
+        self._create_index().save(index_path)
+
+        index = ninja.GraphIndex.load(index_path)
+        self.assertIsNone(index.source_stamp)
+        self.assertEqual(9, len(index))
+        self._check_queries(index)
+
+    def test_load_graph_index_from_args(self):
+        args = argparse.Namespace(
+                input_file='graph.ninja', ninja_deps=self.deps_path,
+                cwd=self.tmp_dir, encoding=ENCODING, cache_file=None,
+                no_cache=False)
+
+        index = ninja.load_graph_index_from_args(args)
+        self.assertIsNotNone(index.source_stamp)
+        self._check_queries(index)
+
+        # The saved graph index is reused if the cache is not changed.
+        index = ninja.load_graph_index_from_args(args)
+        self.assertIsInstance(index._paths, ninja._SectionStrTable)
+        self._check_queries(index)
+
+
 if __name__ == '__main__':
     unittest.main()